@@ -44,7 +44,66 @@ Typical Usage
 
 #------------------------------------------------------------------------------
 
-from .client import *
+import sys
+
+__all__ = (
+  'Client', 'ClientPool', 'WorkerPool', 'AsyncClient', 'Prefetcher',
+  'Selection', 'SelectionItem',
+  'Error', 'AuthorizationError', 'ProtocolError', 'TimeoutError',
+  'ValidationError', 'CircuitOpenError',
+  'Purpose', 'Transport', 'Environment', 'API_VERSIONS',
+  'RetryPolicy', 'RateLimiter', 'Deadline', 'CircuitBreaker',
+  'Cache', 'MemoryCache', 'FileCache', 'canonicalKey',
+  'SessionStore', 'FileSessionStore', 'dumpCookies', 'loadCookies',
+  'Call', 'Observer', 'MetricsCollector',
+  'ReasonCatalog', 'ContentStream', 'SingleFlight', 'getCodec',
+  'ENCODED_TYPES', 'STREAM_CHUNK_SIZE', 'AUTH_REFRESH_MARGIN',
+  'ACCEPT_ENCODING', 'DEFAULT_COMPRESS_THRESHOLD',
+  'DEFAULT_CMA_CHUNK_SIZE', 'DEFAULT_CMA_CONCURRENCY',
+  'DEFAULT_CONCURRENCY', 'DEFAULT_CONNECT_TIMEOUT', 'DEFAULT_POOL_SIZE',
+  'DEFAULT_REASONS_TTL', 'DEFAULT_RETRIES', 'DEFAULT_SESSION_TTL',
+)
+
+# the submodule that each of the names in `__all__` is imported from,
+# if not `canarymd.client`
+_modules = dict(
+  ClientPool  = 'pool',
+  WorkerPool  = 'workers',
+  AsyncClient = 'aio',
+  Prefetcher  = 'prefetch',
+)
+
+if sys.version_info >= (3, 7):
+
+  import importlib
+
+  # the names are only imported when first used, so that importing
+  # e.g. `canarymd.constants` or the command-line interface does not
+  # load the HTTP stack
+  def __getattr__(name):
+    if name not in __all__:
+      raise AttributeError(
+        'module %r has no attribute %r' % (__name__, name))
+    module = importlib.import_module(
+      '.' + _modules.get(name, 'client'), __name__)
+    value = globals()[name] = getattr(module, name)
+    return value
+
+  def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+else:
+
+  from .client import *
+  from .pool import ClientPool
+  from .workers import WorkerPool
+  from .prefetch import Prefetcher
+
+  try:
+    from .aio import AsyncClient
+  except (ImportError, SyntaxError):
+    # the asyncio client requires python 3.5+
+    __all__ = tuple(name for name in __all__ if name != 'AsyncClient')
 
 #------------------------------------------------------------------------------
 # end of $Id$
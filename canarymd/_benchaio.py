@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+The ``async`` scenario of :mod:`canarymd.bench`, which requires
+python 3.5+ and is therefore kept separate.
+'''
+
+import asyncio
+
+from . import client
+from .aio import AsyncClient, aiohttp
+from .bench import Result, _timer
+
+#------------------------------------------------------------------------------
+def benchAsync(bench):
+  if aiohttp is None:
+    return None
+  loop = asyncio.new_event_loop()
+  try:
+    return loop.run_until_complete(_run(bench))
+  finally:
+    loop.close()
+
+#------------------------------------------------------------------------------
+async def _run(bench):
+  latencies = []
+  errors    = 0
+  semaphore = asyncio.Semaphore(bench.concurrency)
+  async with AsyncClient('bench', 'bench', root=bench.root) as api:
+    await api.authenticate()
+    async def _select():
+      nonlocal errors
+      async with semaphore:
+        start = _timer()
+        try:
+          await api.select(bench.context, bench.peo)
+        except client.Error:
+          errors += 1
+        latencies.append(_timer() - start)
+    start = _timer()
+    await asyncio.gather(*[_select() for _ in range(bench.count)])
+    elapsed = _timer() - start
+    logins = api._authgen
+  return Result('async', len(latencies), elapsed, latencies, errors, logins)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+An asyncio-based variant of :class:`canarymd.Client`. This module
+requires python 3.5+ and the `aiohttp` package, which can be installed
+with ``pip install canarymd[async]``.
+'''
+
+import asyncio
+import email.utils
+import logging
+import time
+
+from aadict import aadict
+
+try:
+  import aiohttp
+except ImportError:
+  aiohttp = None
+
+from .client import \
+  Environment, AuthorizationError, ProtocolError, TimeoutError, \
+  CircuitOpenError, CircuitBreaker, \
+  API_VERSIONS, DEFAULT_SESSION_TTL, AUTH_REFRESH_MARGIN, \
+  DEFAULT_CONNECT_TIMEOUT, Deadline, _versions, _apiRoot, _defaultRoot, \
+  _parseVersion, _responseError, ENCODED_TYPES, _selectionParams, \
+  _selectionBody, _selectionResult, _deadlineParams, _clientVersion, \
+  _compressThreshold, _compressBody, _endpointName, _sessionExpiry, \
+  ACCEPT_ENCODING
+from .cache import canonicalKey
+from .codec import getCodec
+from .ratelimit import RateLimiter
+from .retry import _retryAfter
+
+#------------------------------------------------------------------------------
+
+log = logging.getLogger(__name__)
+
+#------------------------------------------------------------------------------
+DEFAULT_LIMIT = 100
+
+# how long coroutines waiting for a rate limiter slot wait for the
+# client to release one before checking again: slots released by other
+# clients (or threads) sharing the limiter do not wake them
+RATE_LIMIT_POLL = 0.1
+
+#------------------------------------------------------------------------------
+class AsyncClient(object):
+  '''
+  The asyncio equivalent of :class:`canarymd.Client`: all API methods
+  (:meth:`select`, :meth:`reasons` and :meth:`version`) are coroutines.
+  As with :class:`canarymd.Client`, version negotiation is done on the
+  first request (see `api` to skip it entirely). The client should be
+  closed when no longer needed, either with :meth:`close` or by using
+  it as an asynchronous context manager:
+
+  .. code-block:: python
+
+     async with canarymd.AsyncClient(principal=..., credential=...) as client:
+       selection = await client.select(context=..., peo=...)
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, principal, credential, env=Environment.PROD, root=None,
+               api=None, session_ttl=DEFAULT_SESSION_TTL, limit=DEFAULT_LIMIT,
+               connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=None,
+               compact=False, codec=None, single_flight=False,
+               rate_limit=None, call_timeout=None, partner=None,
+               compress=None, circuit_breaker=None):
+    '''
+    Constructs a new `canarymd.AsyncClient`. The `principal`,
+    `credential`, `env`, `root`, `api`, `session_ttl`,
+    `connect_timeout`, `read_timeout`, `compact`, `codec`,
+    `single_flight`, `rate_limit`, `call_timeout`, `partner`,
+    `compress` and `circuit_breaker` parameters are the same as for
+    :class:`canarymd.Client` (including sharing the process-wide
+    cache of negotiated versions); with `single_flight`, requests are
+    coalesced across coroutines. Additionally:
+
+    :Parameters:
+
+    limit : int, optional, default: 100
+
+      The maximum number of simultaneous connections to the Canary
+      servers; requests beyond this limit are queued until a
+      connection becomes available. Zero means no limit.
+    '''
+    if aiohttp is None:
+      raise ImportError(
+        'canarymd.AsyncClient requires the "aiohttp" package')
+    if env not in Environment.ALL:
+      raise ValueError('invalid/unknown environment: %r' % (env,))
+    if api is not None and api not in API_VERSIONS:
+      raise ValueError('invalid/unknown API version: %r' % (api,))
+    self.env        = env
+    self.root       = root or _defaultRoot(env)
+    self._baseroot  = self.root
+    self.principal  = principal
+    self.credential = credential
+    self.limit      = limit
+    self.compact    = compact
+    self.codec      = getCodec(codec)
+    self._flight    = AsyncSingleFlight() if single_flight else None
+    if rate_limit is not None and not isinstance(rate_limit, RateLimiter):
+      rate_limit    = RateLimiter(rate=rate_limit)
+    self.limiter    = rate_limit
+    self._released  = None
+    if circuit_breaker is True:
+      circuit_breaker = CircuitBreaker()
+    self.breaker    = circuit_breaker or None
+    self.timeout    = aiohttp.ClientTimeout(
+      total=None, connect=connect_timeout, sock_read=read_timeout)
+    self.call_timeout = call_timeout
+    self.partner    = partner
+    self.compress   = _compressThreshold(compress)
+    self.session    = None
+    self.session_ttl = session_ttl
+    self._authlock  = None
+    self._authgen   = 0
+    self._expires   = None
+    self._version   = aadict(client=None, api=api)
+    self._vlock     = None
+    self._pinned    = api is not None
+    if api is not None:
+      self.root     = _apiRoot(self._baseroot, api)
+
+  #----------------------------------------------------------------------------
+  async def __aenter__(self):
+    return self
+
+  #----------------------------------------------------------------------------
+  async def __aexit__(self, *exc_info):
+    await self.close()
+
+  #----------------------------------------------------------------------------
+  async def close(self):
+    '''
+    Closes all connections held by this client.
+    '''
+    if self.session is not None:
+      session, self.session = self.session, None
+      await session.close()
+
+  #----------------------------------------------------------------------------
+  def _getSession(self):
+    if self.session is None:
+      headers = {
+        'content-type'    : 'application/json',
+        'accept-encoding' : ACCEPT_ENCODING,
+      }
+      if self.partner is not None:
+        headers['x-active-partner-id'] = str(self.partner)
+      self.session = aiohttp.ClientSession(
+        connector  = aiohttp.TCPConnector(limit=self.limit),
+        cookie_jar = aiohttp.CookieJar(unsafe=True),
+        headers    = headers,
+        timeout    = self.timeout,
+      )
+    return self.session
+
+  #----------------------------------------------------------------------------
+  async def _send(self, method, url, data=None, deadline=None, **kw):
+    endpoint = _endpointName(self._baseroot, url)
+    if self.breaker is not None and not self.breaker.allow(endpoint):
+      raise CircuitOpenError(
+        'circuit open: %s requests to %r are failing fast' % (method, url))
+    if self.limiter is not None:
+      try:
+        await self._throttle(deadline)
+      except BaseException:
+        if self.breaker is not None:
+          self.breaker.record(endpoint)
+        raise
+    start = time.time()
+    try:
+      async with self._getSession().request(
+          method, url, data=data, **kw) as res:
+        ret = _Response(
+          res.status, res.reason, res.headers, await res.read(), self.codec)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+      if self.limiter is not None:
+        self._release(overload=isinstance(err, asyncio.TimeoutError))
+      if self.breaker is not None:
+        self.breaker.record(endpoint, failed=True)
+      log.error('%s request to %r failed: %s', method, url, err)
+      raise ProtocolError('%s: %s' % (err.__class__.__name__, err))
+    except BaseException:
+      # including cancellation by the call's deadline
+      if self.limiter is not None:
+        self._release()
+      if self.breaker is not None:
+        self.breaker.record(endpoint)
+      raise
+    latency = time.time() - start
+    if self.limiter is not None:
+      self._release(
+        ret.status_code, latency, _retryAfter(ret.headers.get('retry-after')))
+    if self.breaker is not None:
+      self.breaker.record(endpoint, ret.status_code, latency)
+    return ret
+
+  #----------------------------------------------------------------------------
+  def _deadline(self, timeout=None):
+    timeout = timeout or self.call_timeout
+    return Deadline(timeout) if timeout else None
+
+  #----------------------------------------------------------------------------
+  async def _within(self, deadline, coro):
+    # awaits `coro`, cancelling it when the `deadline` expires
+    if deadline is None:
+      return await coro
+    try:
+      return await asyncio.wait_for(coro, max(0, deadline.remaining()))
+    except asyncio.TimeoutError:
+      raise TimeoutError('deadline of %ss exceeded' % (deadline.budget,))
+
+  #----------------------------------------------------------------------------
+  async def _throttle(self, deadline=None):
+    # the asynchronous equivalent of `RateLimiter.acquire()`: waits for
+    # a concurrency slot to be released, then for the rate limit
+    while True:
+      wait = self.limiter.tryAcquire()
+      if wait is not None:
+        break
+      timeout = RATE_LIMIT_POLL
+      if deadline is not None:
+        if deadline.remaining() <= 0:
+          raise TimeoutError(
+            'deadline of %ss exceeded while rate limited' % (deadline.budget,))
+        timeout = min(timeout, deadline.remaining())
+      if self._released is None:
+        self._released = asyncio.Event()
+      try:
+        await asyncio.wait_for(self._released.wait(), timeout)
+      except asyncio.TimeoutError:
+        pass
+    if deadline is not None and wait > deadline.remaining():
+      # the rate limiting delay counts against the call's budget too
+      self._release(cancel=True)
+      raise TimeoutError(
+        'deadline of %ss exceeded while rate limited' % (deadline.budget,))
+    if wait:
+      try:
+        await asyncio.sleep(wait)
+      except BaseException:
+        self._release()
+        raise
+
+  #----------------------------------------------------------------------------
+  def _release(self, *args, **kw):
+    # releases the request's concurrency slot (or, with `cancel`, its
+    # reservation) and wakes the coroutines waiting in `_throttle`
+    if kw.pop('cancel', False):
+      self.limiter.cancel()
+    else:
+      self.limiter.release(*args, **kw)
+    if self._released is not None:
+      self._released.set()
+      self._released = None
+
+  #----------------------------------------------------------------------------
+  async def _checkVersion(self, probe=False):
+    if self._version.api is not None and not probe:
+      return
+    if self._vlock is None:
+      self._vlock = asyncio.Lock()
+    async with self._vlock:
+      if self._version.api is not None and not probe:
+        return
+      key = (self._baseroot, self.env)
+      if probe or key not in _versions:
+        res = await self._send('get', self._baseroot + '/version')
+        _versions[key] = _parseVersion(self.codec.loads(res.content))
+      api, server = _versions[key]
+      if self._pinned:
+        # only report the server version; the pinned API stays in effect
+        self._version.update(server=server)
+        return
+      self._version.update(api=api, server=server)
+      self.root = _apiRoot(self._baseroot, api)
+
+  #----------------------------------------------------------------------------
+  async def _authenticate(self, stale=None):
+    if self._authlock is None:
+      self._authlock = asyncio.Lock()
+    async with self._authlock:
+      if stale is None:
+        if self._expires is not None \
+            and time.time() < self._expires - AUTH_REFRESH_MARGIN:
+          return self._authgen
+      elif stale != self._authgen:
+        return self._authgen
+      log.debug('authenticating %r to %r', self.principal, self.root)
+      self._expires = None
+      res = await self._send(
+        'post', self.root + '/auth/session', self.codec.dumps({
+          'username' : self.principal,
+          'password' : self.credential,
+        }))
+      if res.status_code != 200:
+        err = _responseError(res)
+        log.error('authentication failure: %s', err)
+        raise AuthorizationError(err)
+      self._authgen += 1
+      self._expires = _sessionExpiry(self.session_ttl, [
+        _cookieExpiry(cookie) for cookie in self.session.cookie_jar])
+      return self._authgen
+
+  #----------------------------------------------------------------------------
+  async def authenticate(self):
+    '''
+    Ensures that this client has a valid session with the Canary
+    servers. See :meth:`canarymd.Client.authenticate`.
+    '''
+    await self._within(self._deadline(), self._prepare())
+    return self
+
+  #----------------------------------------------------------------------------
+  async def _prepare(self):
+    await self._checkVersion()
+    return await self._authenticate()
+
+  #----------------------------------------------------------------------------
+  async def _req(self, method, url, data=None, deadline=None):
+    authgen = await self._prepare()
+    log.debug('sending %r request to %r', method, url)
+    # the body is encoded (and compressed) only once, even if the
+    # request is re-sent
+    kw = dict()
+    if data is not None:
+      if not isinstance(data, ENCODED_TYPES):
+        data = self.codec.dumps(data)
+      compressed = _compressBody(data, self.compress)
+      if compressed is not None:
+        data = compressed
+        kw['headers'] = {'content-encoding': 'gzip'}
+    res = await self._send(method, self.root + url, data, deadline, **kw)
+    if res.status_code != 401:
+      return res
+    await self._authenticate(stale=authgen)
+    res = await self._send(method, self.root + url, data, deadline, **kw)
+    if res.status_code != 401 and res.status_code != 403:
+      return res
+    err = _responseError(res)
+    log.error('post-authentication authorization failure: %s', err)
+    raise AuthorizationError(err)
+
+  #----------------------------------------------------------------------------
+  async def version(self):
+    '''
+    Returns the client, server and negotiated protocol versions.
+    '''
+    return await self._within(self._deadline(), self._getVersion())
+
+  #----------------------------------------------------------------------------
+  async def _getVersion(self):
+    await self._checkVersion()
+    if self._version.server is None:
+      await self._checkVersion(probe=True)
+    self._version.client = _clientVersion()
+    return self._version
+
+  #----------------------------------------------------------------------------
+  async def select(self, context, peo, timeout=None):
+    '''
+    Request a message selection. See :meth:`canarymd.Client.select`
+    for details.
+    '''
+    params   = _selectionParams(context, peo, timeout)
+    deadline = self._deadline(timeout)
+    try:
+      if self._flight is None:
+        return await self._within(deadline, self._select(params, deadline))
+      return await self._within(deadline, self._flight.do(
+        canonicalKey(context, peo, namespace=[timeout]),
+        self._select, params, deadline))
+    except CircuitOpenError:
+      if self.breaker is None or not self.breaker.hasFallback:
+        raise
+      return self.breaker.fallback
+
+  #----------------------------------------------------------------------------
+  def health(self):
+    '''
+    Returns the state of the circuit breaker, see
+    :meth:`canarymd.Client.health`.
+    '''
+    if self.breaker is None:
+      return aadict(healthy=True, endpoints=dict())
+    return self.breaker.health()
+
+  #----------------------------------------------------------------------------
+  async def _select(self, params, deadline=None):
+    if deadline is not None:
+      await self._prepare()
+      params = _deadlineParams(params, deadline)
+    res = await self._req(
+      'post', '/selection', _selectionBody(self.codec, params), deadline)
+    if res.status_code != 200:
+      err = _responseError(res)
+      log.error('selection failure: %s', err)
+      raise ProtocolError(err)
+    return _selectionResult(
+      self.codec.loads(res.content), res.content, self.compact)
+
+  #----------------------------------------------------------------------------
+  async def reasons(self):
+    '''
+    Returns the list of all known reasons-for-visit known to Canary.
+    '''
+    deadline = self._deadline()
+    if self._flight is None:
+      return await self._within(deadline, self._reasons())
+    return await self._within(
+      deadline, self._flight.do('reasons', self._reasons))
+
+  #----------------------------------------------------------------------------
+  async def _reasons(self):
+    res = await self._req('get', '/reason')
+    if res.status_code != 200:
+      err = _responseError(res)
+      log.error('reasons fetch failure: %s', err)
+      raise ProtocolError(err)
+    return aadict.d2ar(self.codec.loads(res.content).get('reasons', []))
+
+#------------------------------------------------------------------------------
+class AsyncSingleFlight(object):
+  '''
+  The asyncio equivalent of :class:`canarymd.flight.SingleFlight`:
+  coalesces concurrent calls with the same key into a single task.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self):
+    self._tasks = {}
+
+  #----------------------------------------------------------------------------
+  async def do(self, key, func, *args):
+    '''
+    Awaits ``func(*args)``, unless a call for `key` is already in
+    progress, in which case its result is awaited instead. The call
+    runs in its own task, so that cancelling one of the waiting
+    coroutines (including the one that started it) does not cancel
+    it for the others.
+    '''
+    task = self._tasks.get(key)
+    if task is None or task.done():
+      task = self._tasks[key] = asyncio.ensure_future(func(*args))
+      def _done(_):
+        if self._tasks.get(key) is task:
+          del self._tasks[key]
+      task.add_done_callback(_done)
+    return await asyncio.shield(task)
+
+  #----------------------------------------------------------------------------
+  def __len__(self):
+    return len(self._tasks)
+
+#------------------------------------------------------------------------------
+def _cookieExpiry(morsel):
+  # the time the aiohttp cookie `morsel` expires, or None
+  if morsel['max-age']:
+    try:
+      return time.time() + int(morsel['max-age'])
+    except ValueError:
+      pass
+  if morsel['expires']:
+    parsed = email.utils.parsedate_tz(morsel['expires'])
+    if parsed:
+      return email.utils.mktime_tz(parsed)
+  return None
+
+#------------------------------------------------------------------------------
+class _Response(object):
+  # the parts of an aiohttp response that are needed after it has been
+  # released, with the same interface as a `requests` response
+  def __init__(self, status_code, reason, headers, content, codec):
+    self.status_code = status_code
+    self.reason      = reason
+    self.headers     = headers
+    self.content     = content
+    self.codec       = codec
+  @property
+  def text(self):
+    return self.content.decode('utf-8', 'replace')
+  def json(self):
+    return self.codec.loads(self.content)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Client benchmarks. By default, the benchmarks run against an
+in-process :class:`canarymd.mock.MockServer`; see
+``python -m canarymd.bench --help`` for options. The following
+scenarios are available:
+
+* ``sequential``: one thread making selections one after the other.
+* ``threaded``: several threads sharing one client.
+* ``batch``: :meth:`canarymd.Client.select_many`.
+* ``async``: :class:`canarymd.AsyncClient` (python 3 with aiohttp).
+* ``reauth``: sequential, with the server expiring the session
+  periodically; reports the time spent re-authenticating.
+* ``memory``: the memory retained per selection, in normal and
+  "compact" mode (python 3).
+* ``codec``: encoding selection requests and decoding selection
+  responses (without any network traffic) with each installed JSON
+  backend; the rate is in encode+decode round-trips/second.
+
+Each scenario reports the throughput in selections/second, the p50
+and p99 latencies, errors and logins.
+'''
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import sys
+import threading
+import timeit
+
+from . import client, codec
+from .metrics import Observer
+from .mock import MockServer
+
+#------------------------------------------------------------------------------
+SCENARIOS = (
+  'sequential', 'threaded', 'batch', 'async', 'reauth', 'memory', 'codec')
+
+DEFAULT_PEO = {
+  'transport'   : client.Transport.SITE,
+  'purpose'     : client.Purpose.DISCOVER,
+  'recipient'   : 'PID|||12345||Doe^Jane',
+}
+
+_timer = timeit.default_timer
+
+#------------------------------------------------------------------------------
+class Result(object):
+  '''
+  The outcome of a benchmark scenario.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, name, count, elapsed, latencies, errors=0, logins=0,
+               **extra):
+    self.name       = name
+    self.count      = count
+    self.elapsed    = elapsed
+    self.latencies  = sorted(latencies)
+    self.errors     = errors
+    self.logins     = logins
+    self.extra      = extra
+
+  #----------------------------------------------------------------------------
+  @property
+  def rate(self):
+    return self.count / self.elapsed if self.elapsed else None
+
+  #----------------------------------------------------------------------------
+  def percentile(self, q):
+    if not self.latencies:
+      return None
+    idx = min(len(self.latencies) - 1, int(q * len(self.latencies)))
+    return self.latencies[idx]
+
+  #----------------------------------------------------------------------------
+  def asDict(self):
+    ret = dict(
+      name    = self.name,
+      count   = self.count,
+      elapsed = self.elapsed,
+      rate    = self.rate,
+      p50     = self.percentile(0.5),
+      p99     = self.percentile(0.99),
+      errors  = self.errors,
+      logins  = self.logins,
+    )
+    ret.update(self.extra)
+    return ret
+
+#------------------------------------------------------------------------------
+class _Recorder(Observer):
+  def __init__(self):
+    self.calls = []
+  def observe(self, call):
+    if call.operation == 'select':
+      self.calls.append(call)
+
+#------------------------------------------------------------------------------
+class Benchmark(object):
+  '''
+  Runs benchmark scenarios against the server at `root` (or, if not
+  specified, an in-process mock server that is started on demand,
+  configured with the `mock` keyword arguments).
+
+  :Parameters:
+
+  count : int, optional, default: 1000
+
+    The number of selections per scenario.
+
+  concurrency : int, optional, default: 8
+
+    The number of threads (``threaded``), the concurrency of
+    ``batch`` and the number of simultaneous requests of ``async``.
+
+  peo : dict, optional
+
+    The PEO to request selections for.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, root=None, count=1000, concurrency=8, peo=None,
+               context='bench', **mock):
+    self.root         = root
+    self.count        = count
+    self.concurrency  = concurrency
+    self.peo          = peo or DEFAULT_PEO
+    self.context      = context
+    self.mock         = mock
+    self.server       = None
+
+  #----------------------------------------------------------------------------
+  def __enter__(self):
+    if self.root is None:
+      self.server = MockServer(**self.mock).start()
+      self.root   = self.server.root
+    return self
+
+  #----------------------------------------------------------------------------
+  def __exit__(self, *exc_info):
+    if self.server is not None:
+      self.server.stop()
+      self.server = None
+      self.root   = None
+
+  #----------------------------------------------------------------------------
+  def client(self, **kw):
+    kw.setdefault('pool_size', max(self.concurrency, client.DEFAULT_POOL_SIZE))
+    recorder = _Recorder()
+    ret = client.Client(
+      'bench', 'bench', root=self.root, observers=[recorder], **kw)
+    ret.authenticate()
+    return ret, recorder
+
+  #----------------------------------------------------------------------------
+  def run(self, scenarios=SCENARIOS):
+    '''
+    Runs the named `scenarios` and returns a list of :class:`Result`
+    objects. Scenarios that cannot run in this environment are
+    skipped.
+    '''
+    ret = []
+    for name in scenarios:
+      result = getattr(self, 'bench' + name.capitalize())()
+      if isinstance(result, list):
+        ret.extend(result)
+      elif result is not None:
+        ret.append(result)
+    return ret
+
+  #----------------------------------------------------------------------------
+  def _result(self, name, elapsed, api, recorder, errors=0, **extra):
+    return Result(
+      name, len(recorder.calls), elapsed,
+      [call.duration for call in recorder.calls],
+      errors = errors + sum(1 for call in recorder.calls if call.error),
+      logins = api.stats().logins or 0,
+      **extra)
+
+  #----------------------------------------------------------------------------
+  def _loop(self, api, count):
+    for _ in range(count):
+      try:
+        api.select(self.context, self.peo)
+      except client.Error:
+        pass
+
+  #----------------------------------------------------------------------------
+  def benchSequential(self):
+    api, recorder = self.client()
+    start = _timer()
+    self._loop(api, self.count)
+    return self._result('sequential', _timer() - start, api, recorder)
+
+  #----------------------------------------------------------------------------
+  def benchThreaded(self):
+    api, recorder = self.client()
+    # spread the remainder so that exactly `count` selections are made
+    per, extra = divmod(self.count, self.concurrency)
+    threads = [
+      threading.Thread(target=self._loop, args=(api, per + (idx < extra)))
+      for idx in range(self.concurrency)]
+    start = _timer()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return self._result('threaded', _timer() - start, api, recorder)
+
+  #----------------------------------------------------------------------------
+  def benchBatch(self):
+    api, recorder = self.client()
+    start = _timer()
+    api.select_many(
+      self.context, [self.peo] * self.count, concurrency=self.concurrency)
+    return self._result('batch', _timer() - start, api, recorder)
+
+  #----------------------------------------------------------------------------
+  def benchAsync(self):
+    try:
+      from ._benchaio import benchAsync
+    except (ImportError, SyntaxError):
+      # requires python 3.5+ and aiohttp
+      return None
+    return benchAsync(self)
+
+  #----------------------------------------------------------------------------
+  def benchReauth(self):
+    if self.server is None:
+      # session expiry can only be forced on the mock server
+      return None
+    api, recorder = self.client()
+    every = 10
+    start = _timer()
+    for idx in range(self.count):
+      if idx and idx % every == 0:
+        self.server.expireSessions()
+      try:
+        api.select(self.context, self.peo)
+      except client.Error:
+        pass
+    elapsed = _timer() - start
+    reauths = [
+      call.phases['reauth'] for call in recorder.calls
+      if 'reauth' in call.phases]
+    return self._result(
+      'reauth', elapsed, api, recorder,
+      reauth_count = len(reauths),
+      reauth_mean  = sum(reauths) / len(reauths) if reauths else None)
+
+  #----------------------------------------------------------------------------
+  def benchMemory(self):
+    try:
+      import tracemalloc
+    except ImportError:
+      return None
+    ret = []
+    for compact in (False, True):
+      api, recorder = self.client(compact=compact)
+      # warm up any lazily allocated state (connections, caches, etc)
+      self._loop(api, 10)
+      del recorder.calls[:]
+      gc.collect()
+      tracemalloc.start()
+      try:
+        base  = tracemalloc.get_traced_memory()[0]
+        start = _timer()
+        held  = []
+        for _ in range(self.count):
+          try:
+            held.append(api.select(self.context, self.peo))
+          except client.Error:
+            pass
+        elapsed = _timer() - start
+        # drop the per-call records, which are not part of the cost
+        del recorder.calls[:]
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - base
+      finally:
+        tracemalloc.stop()
+      ret.append(Result(
+        'memory-compact' if compact else 'memory', len(held), elapsed, [],
+        logins=api.stats().logins or 0,
+        bytes_per_selection=used // max(1, len(held))))
+      del held
+    return ret
+
+  #----------------------------------------------------------------------------
+  def benchCodec(self):
+    params  = client._selectionParams(self.context, self.peo, None)
+    size    = self.mock.get('payload_size', 1024)
+    payload = codec.getCodec('json').dumps(dict(
+      selection       = dict(id='0' * 32),
+      selectionitems  = [
+        dict(channel_id='channel-%d' % (idx,), message_id='0' * 32)
+        for idx in range(3)],
+      content         = '<p>' + 'x' * max(0, size - 7) + '</p>',
+    ))
+    ret = []
+    for name in codec.available():
+      backend = codec.getCodec(name)
+      start   = _timer()
+      for _ in range(self.count):
+        client._selectionBody(backend, params)
+      encode  = _timer() - start
+      for _ in range(self.count):
+        backend.loads(payload)
+      elapsed = _timer() - start
+      ret.append(Result(
+        'codec-' + name, self.count, elapsed, [],
+        encode_us = encode * 1e6 / max(1, self.count),
+        decode_us = ( elapsed - encode ) * 1e6 / max(1, self.count)))
+    return ret
+
+#------------------------------------------------------------------------------
+def _ms(value):
+  return '%8.2f' % (value * 1000,) if value is not None else '       -'
+
+#------------------------------------------------------------------------------
+def report(results, out=None):
+  '''
+  Writes a table of `results` to `out` (default: stdout).
+  '''
+  out = out or sys.stdout
+  print('%-16s %7s %9s %8s %8s %6s %6s  %s' % (
+    'scenario', 'count', 'sel/s', 'p50 ms', 'p99 ms', 'errors', 'logins',
+    'notes'), file=out)
+  for result in results:
+    notes = ' '.join(
+      '%s=%s' % (key, '%.4f' % (val,) if isinstance(val, float) else val)
+      for key, val in sorted(result.extra.items()))
+    print('%-16s %7d %9.1f %s %s %6d %6d  %s' % (
+      result.name, result.count, result.rate or 0,
+      _ms(result.percentile(0.5)), _ms(result.percentile(0.99)),
+      result.errors, result.logins, notes), file=out)
+
+#------------------------------------------------------------------------------
+def main(args=None):
+  cli = argparse.ArgumentParser(
+    description='Benchmarks the Canary client')
+  cli.add_argument(
+    'scenarios', metavar='SCENARIO', nargs='*',
+    help='the scenarios to run (default: all of %s)' % (', '.join(SCENARIOS),))
+  cli.add_argument(
+    '--root', help='benchmark the server at this API root instead of a mock')
+  cli.add_argument('-n', '--count', type=int, default=1000)
+  cli.add_argument('--concurrency', type=int, default=8)
+  cli.add_argument(
+    '--latency', type=float, default=0,
+    help='the mock server\'s response latency in seconds')
+  cli.add_argument(
+    '--error-rate', dest='error_rate', type=float, default=0,
+    help='the mock server\'s error rate')
+  cli.add_argument(
+    '--payload-size', dest='payload_size', type=int, default=1024,
+    help='the mock server\'s selection content size')
+  cli.add_argument(
+    '--json', action='store_true', help='output the results as JSON')
+  options = cli.parse_args(args=args)
+  for name in options.scenarios:
+    if name not in SCENARIOS:
+      cli.error('invalid/unknown scenario: %r' % (name,))
+  bench = Benchmark(
+    root=options.root, count=options.count, concurrency=options.concurrency,
+    latency=options.latency, error_rate=options.error_rate,
+    payload_size=options.payload_size)
+  with bench:
+    results = bench.run(options.scenarios or SCENARIOS)
+  if options.json:
+    print(json.dumps([result.asDict() for result in results], indent=2))
+  else:
+    report(results)
+  return 0
+
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+  sys.exit(main())
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Fast failure while the Canary API is degraded, see the
+`circuit_breaker` parameter of :class:`canarymd.Client`. A
+:class:`CircuitBreaker` tracks the outcome of the most recent
+requests to each endpoint. When too many of them failed (or were too
+slow), the endpoint's circuit "opens" and requests to it are rejected
+immediately, instead of each one waiting out the network timeout.
+After `reset_timeout` seconds, the circuit is "half-open": a limited
+number of probe requests are let through, and the circuit closes
+again once they succeed, or re-opens if one fails.
+'''
+
+import collections
+import threading
+import timeit
+
+from aadict import aadict
+
+#------------------------------------------------------------------------------
+CLOSED    = 'closed'
+OPEN      = 'open'
+HALF_OPEN = 'half-open'
+
+# HTTP statuses that indicate that the server is failing, as opposed
+# to rejecting the request itself
+FAILURE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+_timer = timeit.default_timer
+
+# the default `fallback`, i.e. none
+_RAISE = object()
+
+#------------------------------------------------------------------------------
+class _Circuit(object):
+
+  __slots__ = ('outcomes', 'state', 'opened', 'probes', 'successes', 'trips')
+
+  #----------------------------------------------------------------------------
+  def __init__(self, window):
+    # true for each failed request, false for each successful one
+    self.outcomes   = collections.deque(maxlen=window)
+    self.state      = CLOSED
+    self.opened     = None
+    self.probes     = 0
+    self.successes  = 0
+    self.trips      = 0
+
+#------------------------------------------------------------------------------
+class CircuitBreaker(object):
+  '''
+  A thread-safe circuit breaker with a separate circuit per endpoint.
+  Callers check :meth:`allow` before each request and report its
+  outcome with :meth:`record`. One breaker may be shared by several
+  clients of the same server (e.g. by passing it to a
+  :class:`canarymd.ClientPool`).
+
+  :Parameters:
+
+  failure_rate : float, optional, default: 0.5
+
+    The fraction of the `window` most recent requests to an endpoint
+    that must have failed for its circuit to open. Requests fail if
+    they time out, cannot connect, receive a ``5xx`` or ``429``
+    response or, with `latency`, are too slow.
+
+  window : int, optional, default: 20
+
+    The number of most recent requests to each endpoint to compute
+    the failure rate over.
+
+  min_requests : int, optional, default: 10
+
+    The minimum number of requests in the window before a circuit
+    may open, so that a few early failures do not open it.
+
+  latency : float, optional, default: null
+
+    If specified, responses that take longer than this number of
+    seconds also count as failures.
+
+  reset_timeout : float, optional, default: 30
+
+    The number of seconds a circuit stays open before probe requests
+    are let through.
+
+  probes : int, optional, default: 1
+
+    The number of successful probe requests needed to close a
+    half-open circuit; that many may be in progress at once.
+
+  fallback : any, optional
+
+    If specified, :meth:`canarymd.Client.select` returns this value
+    instead of raising a :class:`canarymd.CircuitOpenError` while the
+    selection circuit is open. ``None`` is a good choice, since it
+    already means "no applicable messages". By default, the error is
+    raised.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, failure_rate=0.5, window=20, min_requests=10,
+               latency=None, reset_timeout=30, probes=1, fallback=_RAISE):
+    self.failure_rate   = failure_rate
+    self.window         = window
+    self.min_requests   = min(min_requests, window)
+    self.latency        = latency
+    self.reset_timeout  = reset_timeout
+    self.probes         = probes
+    self.fallback       = fallback
+    self._circuits      = dict()
+    self._lock          = threading.Lock()
+
+  #----------------------------------------------------------------------------
+  @property
+  def hasFallback(self):
+    return self.fallback is not _RAISE
+
+  #----------------------------------------------------------------------------
+  def _circuit(self, endpoint):
+    circuit = self._circuits.get(endpoint)
+    if circuit is None:
+      circuit = self._circuits[endpoint] = _Circuit(self.window)
+    return circuit
+
+  #----------------------------------------------------------------------------
+  def allow(self, endpoint):
+    '''
+    Returns true if a request to `endpoint` may be sent, in which case
+    its outcome must be reported with :meth:`record`. In a half-open
+    circuit, this takes one of the probe slots.
+    '''
+    with self._lock:
+      circuit = self._circuit(endpoint)
+      if circuit.state == CLOSED:
+        return True
+      if circuit.state == OPEN:
+        if _timer() - circuit.opened < self.reset_timeout:
+          return False
+        circuit.state     = HALF_OPEN
+        circuit.successes = 0
+      if circuit.probes >= self.probes:
+        return False
+      circuit.probes += 1
+      return True
+
+  #----------------------------------------------------------------------------
+  def record(self, endpoint, status=None, latency=None, failed=None):
+    '''
+    Reports the outcome of a request to `endpoint` that was allowed
+    by :meth:`allow`: its HTTP `status` and `latency` or, if it did
+    not receive a response, whether it `failed`. A request without a
+    response that did not fail (e.g. because the caller gave up on
+    it) only releases its probe slot, if it had one.
+    '''
+    if status is not None:
+      failed = status in FAILURE_STATUSES or bool(
+        self.latency and latency and latency > self.latency)
+    with self._lock:
+      circuit = self._circuit(endpoint)
+      if circuit.state == HALF_OPEN:
+        circuit.probes = max(0, circuit.probes - 1)
+        if failed:
+          self._open(circuit)
+        elif failed is not None:
+          circuit.successes += 1
+          if circuit.successes >= self.probes:
+            circuit.state = CLOSED
+            circuit.outcomes.clear()
+        return
+      if failed is None:
+        return
+      circuit.outcomes.append(failed)
+      if circuit.state == CLOSED \
+          and len(circuit.outcomes) >= self.min_requests \
+          and sum(circuit.outcomes) >= self.failure_rate * len(
+            circuit.outcomes):
+        self._open(circuit)
+
+  #----------------------------------------------------------------------------
+  def _open(self, circuit):
+    circuit.state   = OPEN
+    circuit.opened  = _timer()
+    circuit.probes  = 0
+    circuit.trips  += 1
+
+  #----------------------------------------------------------------------------
+  def state(self, endpoint):
+    '''
+    Returns the state of the circuit of `endpoint`: ``"closed"``,
+    ``"open"`` or ``"half-open"``. An open circuit whose
+    `reset_timeout` has passed is reported as half-open.
+    '''
+    with self._lock:
+      circuit = self._circuits.get(endpoint)
+      if circuit is None:
+        return CLOSED
+      return self._state(circuit, _timer())
+
+  #----------------------------------------------------------------------------
+  def _state(self, circuit, now):
+    if circuit.state == OPEN and now - circuit.opened >= self.reset_timeout:
+      return HALF_OPEN
+    return circuit.state
+
+  #----------------------------------------------------------------------------
+  def reset(self):
+    '''
+    Closes all circuits and forgets all outcomes.
+    '''
+    with self._lock:
+      self._circuits.clear()
+
+  #----------------------------------------------------------------------------
+  def health(self):
+    '''
+    Returns the health of all endpoints, for health checks: an object
+    whose `healthy` attribute is false if any circuit is not closed,
+    and whose `endpoints` map each endpoint to its `state`, the
+    number of `requests` and `failures` in the current window, the
+    number of times its circuit `opened`, and for open circuits, the
+    number of seconds until probes are let through (`retry_in`).
+    '''
+    now = _timer()
+    endpoints = dict()
+    with self._lock:
+      for endpoint, circuit in self._circuits.items():
+        state = self._state(circuit, now)
+        endpoints[endpoint] = aadict(
+          state     = state,
+          requests  = len(circuit.outcomes),
+          failures  = sum(circuit.outcomes),
+          opened    = circuit.trips,
+          retry_in  = max(0, circuit.opened + self.reset_timeout - now)
+            if state == OPEN else None,
+        )
+    return aadict(
+      healthy   = all(info.state == CLOSED for info in endpoints.values()),
+      endpoints = endpoints,
+    )
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
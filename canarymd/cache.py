@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Caches for selection responses, see the `cache` parameter of
+:class:`canarymd.Client`. A cache maps a string key (as generated by
+:func:`canonicalKey`) to the selection response text; any object that
+implements the `get` and `set` methods of :class:`Cache` can be used.
+'''
+
+import collections
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import six
+
+#------------------------------------------------------------------------------
+
+log = logging.getLogger(__name__)
+
+#------------------------------------------------------------------------------
+DEFAULT_CACHE_SIZE  = 1000
+DEFAULT_CACHE_TTL   = 300
+
+#------------------------------------------------------------------------------
+def _segments(value):
+  # HL7 segments may be terminated by CR, LF or CRLF, depending on who
+  # serialized them; dictionaries of attributes are left as is
+  if isinstance(value, (list, tuple)):
+    return [_segments(val) for val in value]
+  if isinstance(value, six.string_types):
+    return value.replace('\r\n', '\r').replace('\n', '\r').strip()
+  return value
+
+#------------------------------------------------------------------------------
+def _normalize(peo):
+  # only the fields that hold HL7 segments (see the selection schema in
+  # `canarymd.client`) are normalized: in all others, line breaks and
+  # surrounding whitespace are significant
+  if not isinstance(peo, dict):
+    return peo
+  ret = dict(peo)
+  if 'recipient' in ret:
+    ret['recipient'] = _segments(ret['recipient'])
+  appointment = ret.get('appointment')
+  if isinstance(appointment, dict):
+    ret['appointment'] = dict(appointment)
+    for key in ('patients', 'provider', 'policy'):
+      if key in appointment:
+        ret['appointment'][key] = _segments(appointment[key])
+  elif appointment is not None:
+    ret['appointment'] = _segments(appointment)
+  return ret
+
+#------------------------------------------------------------------------------
+def canonicalKey(context, peo, namespace=None):
+  '''
+  Returns a stable cache key for a selection request of `peo` in
+  `context`, i.e. two PEOs that differ only in dictionary ordering or
+  HL7 segment terminators produce the same key. The optional
+  `namespace` (any JSON-serializable value) is included in the key,
+  and should identify the server and principal that the selection was
+  made with, so that clients can safely share a cache. A pre-encoded
+  (JSON bytes) `peo` produces the same key as its decoded equivalent.
+  '''
+  if isinstance(peo, (six.binary_type, bytearray)):
+    peo = json.loads(bytes(peo).decode('utf-8'))
+  data = json.dumps(
+    [namespace, context, _normalize(peo)],
+    sort_keys=True, separators=(',', ':'))
+  return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+#------------------------------------------------------------------------------
+class Cache(object):
+  '''
+  Abstract base class of selection caches. Subclasses must implement
+  :meth:`get` and :meth:`set` in a thread-safe manner and should
+  maintain the `hits` and `misses` counters.
+  '''
+
+  hits    = 0
+  misses  = 0
+
+  #----------------------------------------------------------------------------
+  def get(self, key):
+    '''
+    Returns the value stored for `key`, or ``None`` if it is not
+    cached or has expired.
+    '''
+    raise NotImplementedError()
+
+  #----------------------------------------------------------------------------
+  def set(self, key, value):
+    '''
+    Stores the string `value` for `key`.
+    '''
+    raise NotImplementedError()
+
+  #----------------------------------------------------------------------------
+  def stats(self):
+    return dict(hits=self.hits, misses=self.misses)
+
+#------------------------------------------------------------------------------
+class MemoryCache(Cache):
+  '''
+  An in-process cache that evicts the least-recently-used entries when
+  there are more than `maxsize` entries or, if specified, when the
+  values occupy more than `maxbytes` characters. Entries expire `ttl`
+  seconds after they were stored.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL,
+               maxbytes=None):
+    self.maxsize  = maxsize
+    self.ttl      = ttl
+    self.maxbytes = maxbytes
+    self.size     = 0
+    self._data    = collections.OrderedDict()
+    self._lock    = threading.Lock()
+
+  #----------------------------------------------------------------------------
+  def get(self, key):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is not None and entry[0] < time.time():
+        self._remove(key)
+        entry = None
+      if entry is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      # move to the end of the LRU order
+      del self._data[key]
+      self._data[key] = entry
+      return entry[1]
+
+  #----------------------------------------------------------------------------
+  def set(self, key, value):
+    with self._lock:
+      if key in self._data:
+        self._remove(key)
+      self._data[key] = (time.time() + self.ttl, value)
+      self.size += len(value)
+      while self._data and (
+          len(self._data) > self.maxsize
+          or ( self.maxbytes is not None and self.size > self.maxbytes )):
+        self._remove(next(iter(self._data)))
+
+  #----------------------------------------------------------------------------
+  def _remove(self, key):
+    self.size -= len(self._data.pop(key)[1])
+
+  #----------------------------------------------------------------------------
+  def stats(self):
+    ret = super(MemoryCache, self).stats()
+    ret.update(entries=len(self._data), size=self.size)
+    return ret
+
+#------------------------------------------------------------------------------
+class FileCache(Cache):
+  '''
+  A cache that stores entries as files in the directory `path`, which
+  allows multiple processes on the same host to share it. Entries
+  expire `ttl` seconds after they were stored. When this process
+  estimates that there are more than `maxsize` entries, the
+  least-recently-used ones are removed until 10% below `maxsize`, so
+  that the directory is only scanned once every ``maxsize / 10`` new
+  entries. The `hits` and `misses` counters are per-process.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, path, maxsize=DEFAULT_CACHE_SIZE * 10,
+               ttl=DEFAULT_CACHE_TTL):
+    self.path     = path
+    self.maxsize  = maxsize
+    self.ttl      = ttl
+    self._lock    = threading.Lock()
+    self._entries = None
+    if not os.path.isdir(path):
+      try:
+        os.makedirs(path)
+      except OSError as err:
+        if err.errno != errno.EEXIST:
+          raise
+
+  #----------------------------------------------------------------------------
+  def _filename(self, key):
+    return os.path.join(self.path, key + '.json')
+
+  #----------------------------------------------------------------------------
+  def get(self, key):
+    filename = self._filename(key)
+    try:
+      stat = os.stat(filename)
+      if stat.st_mtime + self.ttl < time.time():
+        os.unlink(filename)
+        raise OSError(errno.ENOENT, 'expired')
+      with open(filename, 'rb') as fp:
+        value = fp.read().decode('utf-8')
+      # the access time records LRU order; the modification time
+      # records the expiration
+      os.utime(filename, (time.time(), stat.st_mtime))
+    except (IOError, OSError):
+      with self._lock:
+        self.misses += 1
+      return None
+    with self._lock:
+      self.hits += 1
+    return value
+
+  #----------------------------------------------------------------------------
+  def set(self, key, value):
+    filename = self._filename(key)
+    isnew = not os.path.exists(filename)
+    fd, tmpname = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+    try:
+      with os.fdopen(fd, 'wb') as fp:
+        fp.write(value.encode('utf-8'))
+      os.rename(tmpname, filename)
+    except Exception:
+      os.unlink(tmpname)
+      raise
+    with self._lock:
+      if self._entries is None:
+        self._entries = len(self._names())
+      elif isnew:
+        self._entries += 1
+      if self._entries <= self.maxsize:
+        return
+      self._entries = self._prune(int(self.maxsize * 0.9))
+
+  #----------------------------------------------------------------------------
+  def _names(self):
+    return [name for name in os.listdir(self.path) if name.endswith('.json')]
+
+  #----------------------------------------------------------------------------
+  def _prune(self, maxsize):
+    # removes the least-recently-used entries until at most `maxsize`
+    # remain and returns the number of remaining entries
+    names = self._names()
+    if len(names) <= maxsize:
+      return len(names)
+    entries = []
+    for name in names:
+      try:
+        entries.append(
+          (os.stat(os.path.join(self.path, name)).st_atime, name))
+      except OSError:
+        pass
+    entries.sort()
+    for atime, name in entries[:len(entries) - maxsize]:
+      try:
+        os.unlink(os.path.join(self.path, name))
+      except OSError:
+        pass
+    return min(len(entries), maxsize)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
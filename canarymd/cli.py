@@ -6,13 +6,21 @@
 # copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
 #------------------------------------------------------------------------------
 
+from __future__ import print_function
+
 import argparse
 import sys
 import logging
 import os
 import json
-
-from . import client
+import itertools
+import socket
+
+# `canarymd.client` (and with it the HTTP stack) is only imported by
+# the commands that need it, so that e.g. selections through a daemon
+# start quickly
+from . import constants
+from .cma import DEFAULT_CMA_CHUNK_SIZE, DEFAULT_CMA_CONCURRENCY
 from .i18n import _
 
 #------------------------------------------------------------------------------
@@ -51,9 +59,27 @@ def main(args=None):
 
   cli.add_argument(
     _('-e'), _('--env'), metavar=_('ENVIRONMENT'),
-    dest='env', default=os.environ.get('CANARYMD_ENV', client.Environment.PROD),
+    dest='env',
+    default=os.environ.get('CANARYMD_ENV', constants.Environment.PROD),
     help=_('the principal\'s credential/token (i.e. password)'))
 
+  cli.add_argument(
+    _('--root'), metavar=_('URL'),
+    dest='root', default=os.environ.get('CANARYMD_ROOT', None),
+    help=_('override the API root URL derived from the environment (e.g.'
+           ' the URL of a `python -m canarymd.mock` server)'))
+
+  cli.add_argument(
+    _('--api'), metavar=_('VERSION'),
+    dest='api', default=os.environ.get('CANARYMD_API', None),
+    help=_('pin the API protocol version (e.g. "v2"), which skips the'
+           ' version negotiation with the server'))
+
+  cli.add_argument(
+    _('--partner'), metavar=_('ID'),
+    dest='partner', default=os.environ.get('CANARYMD_PARTNER', None),
+    help=_('the ID of the partner to act on behalf of'))
+
   # todo: make this required
   cli.add_argument(
     _('-c'), _('--context'), metavar=_('CONTEXT'),
@@ -63,41 +89,110 @@ def main(args=None):
   # todo: make this required?
   cli.add_argument(
     _('--purpose'), metavar=_('PURPOSE'),
-    dest='purpose', default=client.Purpose.DISCOVER,
+    dest='purpose', default=constants.Purpose.DISCOVER,
     help=_('the selection\'s purpose (default: %(default)r)'))
 
   # todo: make this required?
   cli.add_argument(
     _('--transport'), metavar=_('TRANSPORT'),
-    dest='transport', default=client.Transport.SITE,
+    dest='transport', default=constants.Transport.SITE,
     help=_('the selection\'s transport (default: %(default)r)'))
 
   cli.add_argument(
     _('-t'), _('--timeout'), metavar=_('SECONDS'),
     dest='timeout', default=None, type=float,
-    help=_('the maximum number of seconds (supports decimals) to wait'
-           ' for a response'))
+    help=_('the maximum number of seconds (supports decimals) that each'
+           ' selection may take, including logging in and retries'))
+
+  cli.add_argument(
+    _('--concurrency'), metavar=_('COUNT'),
+    dest='concurrency', default=None, type=int,
+    help=_('[select-batch, cma-upload, cma-download] the number of'
+           ' simultaneous selection requests (default: %d) or chunk'
+           ' transfers (default: %d)') % (
+             constants.DEFAULT_CONCURRENCY, DEFAULT_CMA_CONCURRENCY))
+
+  cli.add_argument(
+    _('--chunk-size'), metavar=_('BYTES'),
+    dest='chunk_size', default=DEFAULT_CMA_CHUNK_SIZE, type=int,
+    help=_('[cma-upload] the size of the chunks that the file is'
+           ' uploaded in (default: %(default)r)'))
+
+  cli.add_argument(
+    _('--name'), metavar=_('NAME'),
+    dest='name', default=None,
+    help=_('[cma-upload] the name of the file on the server (default:'
+           ' the name of the uploaded file)'))
+
+  cli.add_argument(
+    _('--processes'), metavar=_('COUNT'),
+    dest='processes', default=None, type=int,
+    help=_('[select-batch] spread the selections across this many worker'
+           ' processes, each making --concurrency simultaneous requests'
+           ' (default: a single process)'))
+
+  cli.add_argument(
+    _('-o'), _('--output'), metavar=_('FILENAME'),
+    dest='output', default=None,
+    help=_('the file to write the selection content or, for'
+           ' select-batch, the results in JSON Lines format to'
+           ' (default: stdout); for cma-download, the file to download'
+           ' to (default: the name of the file on the server)'))
+
+  cli.add_argument(
+    _('--socket'), metavar=_('PATH'),
+    dest='socket', default=os.environ.get('CANARYMD_SOCKET', None),
+    help=_('[select, serve] the Unix socket of the selection daemon'
+           ' (default: derived from the environment, root, username and'
+           ' partner)'))
+
+  cli.add_argument(
+    _('--no-daemon'),
+    dest='daemon', default=True, action='store_false',
+    help=_('[select] do not use a selection daemon, even if one is'
+           ' running'))
+
+  cli.add_argument(
+    _('--offset'), metavar=_('COUNT'),
+    dest='offset', default=None, type=int,
+    help=_('[select-batch] the number of input lines to skip'))
+
+  cli.add_argument(
+    _('--checkpoint'), metavar=_('FILENAME'),
+    dest='checkpoint', default=None,
+    help=_('[select-batch] a file that tracks the number of input lines'
+           ' processed (and the size of --output); if it exists (and'
+           ' --offset is not specified), processing resumes from there'))
 
   #----------------------------------------------------------------------------
   # todo: move to sub-parser style options...
 
   cli.add_argument(
     'command', metavar=_('COMMAND'),
-    help=_('the canarymd command; must be one of: "select" or "version"'))
+    help=_('the canarymd command; must be one of: "select",'
+           ' "select-batch", "serve", "cma-upload", "cma-download" or'
+           ' "version"'))
 
   cli.add_argument(
     'datafile', metavar=_('FILENAME'),
     nargs='?', default=None,
-    help=_('the data file, in JSON format, containing the PEO details'))
+    help=_('the data file, in JSON format, containing the PEO details;'
+           ' for "select-batch", in JSON Lines format, one PEO per line'
+           ' (default for "select-batch": stdin); for "cma-upload", the'
+           ' file to upload; for "cma-download", the ID of the file'))
 
   # /todo
   #----------------------------------------------------------------------------
 
   options = cli.parse_args(args)
 
-  if options.command not in ('select', 'version'):
+  if options.command not in COMMANDS:
     cli.error('unsupported/unknown command: %r' % (options.command,))
 
+  if options.command in ('cma-upload', 'cma-download') \
+      and not options.datafile:
+    cli.error('the %r command requires a FILENAME' % (options.command,))
+
   if options.verbose > 2:
     logging.getLogger().setLevel(1)
   elif options.verbose == 2:
@@ -111,50 +206,315 @@ def main(args=None):
 
   peo = dict(purpose=options.purpose, transport=options.transport)
 
-  if options.datafile:
+  if options.datafile and options.command == 'select':
     try:
       with open(options.datafile, 'rb') as fp:
         data = json.loads(fp.read())
         peo.update(data)
     except Exception as err:
-      print >> sys.stderr, \
-        '[**] ERROR: could not open and/or parse data file: %r' \
-        % (options.datafile,)
-      print >> sys.stderr, '[**]      : %s' % (err)
+      print(
+        '[**] ERROR: could not open and/or parse data file: %r'
+        % (options.datafile,), file=sys.stderr)
+      print('[**]      : %s' % (err), file=sys.stderr)
       return 10
 
+  if options.command == 'select' and options.daemon:
+    ret = selectViaDaemon(options, peo)
+    if ret is not None:
+      return ret
+
+  from . import client
+
   try:
 
-    cli = client.Client(
+    params = dict(
       principal   = options.username,
       credential  = options.password,
       env         = options.env,
+      root        = options.root,
+      api         = options.api,
+      partner     = options.partner,
+      # the batch and daemon output only needs the IDs and content
+      compact     = options.command in ('select-batch', 'serve'),
     )
 
+    if options.command == 'select-batch' and options.processes:
+      from .workers import WorkerPool
+      with WorkerPool(processes=options.processes, **params) as pool:
+        return selectBatch(pool, options, peo)
+
+    if options.command == 'serve':
+      return serve(options, params)
+
+    cli = client.Client(**params)
+
     if options.command == 'version':
       version = cli.version()
-      print 'server:', version.server
-      print 'client:', version.client
-      print 'protocol:', version.api
+      print('server:', version.server)
+      print('client:', version.client)
+      print('protocol:', version.api)
       return 0
 
+    if options.command == 'select-batch':
+      return selectBatch(cli, options, peo)
+
+    if options.command == 'cma-upload':
+      return cmaUpload(cli, options)
+
+    if options.command == 'cma-download':
+      return cmaDownload(cli, options)
+
+    # the content is written to the output as it is received
+    output = options.output
+    if not output or output == '-':
+      output = getattr(sys.stdout, 'buffer', sys.stdout)
     selection = cli.select(
       context     = options.context,
       timeout     = options.timeout,
       peo         = peo,
+      stream      = output,
     )
 
   except client.Error as err:
-    print >> sys.stderr, '[**] ERROR: %s' % (err,)
+    print('[**] ERROR: %s' % (err,), file=sys.stderr)
     return 20
 
-  log.info('selection id: %s', selection.id)
-  log.info('  channels: %r', [item.channel_id for item in selection.items])
+  if selection is not None:
+    log.info('selection id: %s', selection.id)
+    log.info('  channels: %r', [item.channel_id for item in selection.items])
+
+  return 0
 
-  sys.stdout.write(selection.content)
+#------------------------------------------------------------------------------
+COMMANDS = (
+  'select', 'select-batch', 'serve', 'cma-upload', 'cma-download', 'version')
 
+#------------------------------------------------------------------------------
+def cmaUpload(api, options):
+  '''
+  Implements the "cma-upload" command: uploads the file
+  `options.datafile` in chunks (resuming an interrupted upload of the
+  same file) and prints its ID.
+  '''
+  try:
+    res = api.cma_upload(
+      options.datafile, name=options.name, chunk_size=options.chunk_size,
+      concurrency=options.concurrency or DEFAULT_CMA_CONCURRENCY)
+  except (IOError, OSError) as err:
+    print('[**] ERROR: %s' % (err,), file=sys.stderr)
+    return 20
+  log.info('uploaded %r (%d bytes): %d of %d chunks sent',
+           res.name, res.size, res.sent, res.chunks)
+  print(res.id)
+  return 0
+
+#------------------------------------------------------------------------------
+def cmaDownload(api, options):
+  '''
+  Implements the "cma-download" command: downloads the file with the
+  ID `options.datafile` in chunks (resuming an interrupted download)
+  to `options.output` and prints the name of the file written.
+  '''
+  output = options.output if options.output != '-' else None
+  try:
+    res = api.cma_download(
+      options.datafile, output,
+      concurrency=options.concurrency or DEFAULT_CMA_CONCURRENCY)
+  except (IOError, OSError) as err:
+    print('[**] ERROR: %s' % (err,), file=sys.stderr)
+    return 20
+  log.info('downloaded %r (%d bytes): %d of %d chunks fetched',
+           res.name, res.size, res.fetched, res.chunks)
+  print(res.path)
   return 0
 
+#------------------------------------------------------------------------------
+# the number of seconds to wait for a daemon's response beyond the
+# selection's own --timeout
+DAEMON_TIMEOUT_MARGIN = 5
+
+#------------------------------------------------------------------------------
+def _socketPath(options):
+  from . import daemon
+  return options.socket or daemon.socketPath(
+    options.env, options.root, options.username, options.partner)
+
+#------------------------------------------------------------------------------
+def selectViaDaemon(options, peo):
+  '''
+  Implements the "select" command through the selection daemon that
+  is listening on `options.socket` (or the default socket for the
+  environment and username), if there is one. Returns the exit code,
+  or ``None`` if there is no (suitable) daemon, in which case the
+  selection should be made in-process.
+  '''
+  from . import daemon
+  if not daemon.available():
+    return None
+  path = None
+  try:
+    path = _socketPath(options)
+    res = daemon.request(path, dict(
+      command     = 'select',
+      principal   = options.username,
+      credential  = options.password,
+      partner     = options.partner,
+      context     = options.context,
+      peo         = peo,
+      timeout     = options.timeout,
+    ), timeout=options.timeout and options.timeout + DAEMON_TIMEOUT_MARGIN)
+  except socket.timeout:
+    print('[**] ERROR: selection daemon timed out', file=sys.stderr)
+    return 20
+  except (IOError, OSError, ValueError) as err:
+    log.warning('selection daemon at %r failed (%s), selecting directly',
+                path, err)
+    return None
+  if res is None:
+    return None
+  if res['status'] == 'rejected':
+    log.info('selection daemon at %r serves another principal', path)
+    return None
+  if res['status'] != 'ok':
+    print('[**] ERROR: %s' % (res.get('error'),), file=sys.stderr)
+    return 20
+  selection = res['selection'] or dict(content=None)
+  output = getattr(sys.stdout, 'buffer', sys.stdout)
+  if options.output and options.output != '-':
+    output = open(options.output, 'wb')
+  try:
+    if selection['content']:
+      output.write(selection['content'].encode('utf-8'))
+  finally:
+    if output is not getattr(sys.stdout, 'buffer', sys.stdout):
+      output.close()
+  if res['selection'] is not None:
+    log.info('selection id: %s', selection['id'])
+    log.info('  channels: %r', selection['items'])
+  return 0
+
+#------------------------------------------------------------------------------
+def serve(options, params):
+  '''
+  Implements the "serve" command: runs a selection daemon with the
+  client parameters `params` in the foreground until it is
+  interrupted or terminated.
+  '''
+  import signal
+  from . import daemon
+  path = _socketPath(options)
+  try:
+    server = daemon.Daemon(path, **params)
+    # shut down cleanly (i.e. remove the socket) when killed
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    print('serving selections on', path)
+    sys.stdout.flush()
+    server.serve()
+  except (IOError, OSError) as err:
+    print('[**] ERROR: %s' % (err,), file=sys.stderr)
+    return 20
+  return 0
+
+#------------------------------------------------------------------------------
+CHECKPOINT_INTERVAL = 100
+
+#------------------------------------------------------------------------------
+def selectBatch(api, options, defaults):
+  '''
+  Implements the "select-batch" command: reads PEOs, one per line in
+  JSON format, from `options.datafile` (or stdin), requests a
+  selection for each using `api`, and writes one JSON object per
+  line with the `index` (the zero-based input line number) and either
+  the selection's `id`, `items` (the channel IDs) and `content`, or an
+  `error`. Results are written in input order and only a bounded
+  number of PEOs is held in memory at any time.
+
+  If `options.checkpoint` is set, the number of input lines processed
+  and the size of the output file are recorded there periodically.
+  When resuming from a checkpoint, the output file is truncated to the
+  recorded size, so that results written after the last checkpoint
+  are not duplicated.
+  '''
+  from . import client
+  offset = options.offset
+  outpos = None
+  if offset is None and options.checkpoint \
+      and os.path.exists(options.checkpoint):
+    with open(options.checkpoint, 'r') as fp:
+      state = fp.read().split()
+    offset = int(state[0]) if state else 0
+    outpos = int(state[1]) if len(state) > 1 else None
+    log.info('resuming from checkpoint at line %d', offset)
+  offset  = offset or 0
+  infp    = getattr(sys.stdin, 'buffer', sys.stdin)
+  outfp   = getattr(sys.stdout, 'buffer', sys.stdout)
+  if options.datafile and options.datafile != '-':
+    infp  = open(options.datafile, 'rb')
+  if options.output and options.output != '-':
+    if outpos is not None and os.path.exists(options.output):
+      outfp = open(options.output, 'r+b')
+      outfp.seek(outpos)
+      outfp.truncate()
+    else:
+      outfp = open(options.output, 'ab' if offset else 'wb')
+  closein  = infp is not getattr(sys.stdin, 'buffer', sys.stdin)
+  closeout = outfp is not getattr(sys.stdout, 'buffer', sys.stdout)
+  badlines = dict()
+  done     = offset
+  def _peos():
+    for idx, line in enumerate(itertools.islice(infp, offset, None)):
+      peo = dict(defaults)
+      try:
+        peo.update(json.loads(line))
+      except Exception as err:
+        # let the selection fail on the (invalid) defaults and report
+        # the parsing error in its place
+        badlines[offset + idx] = 'invalid JSON data: %s' % (err,)
+        peo = dict()
+      yield peo
+  try:
+    results = api.iselect_many(
+      options.context, _peos(),
+      concurrency=options.concurrency or constants.DEFAULT_CONCURRENCY,
+      timeout=options.timeout, ordered=True)
+    for idx, result in results:
+      idx += offset
+      if idx in badlines:
+        result = client.Error(badlines.pop(idx))
+      if isinstance(result, client.Error):
+        record = dict(index=idx, error=str(result))
+      elif result is None:
+        record = dict(index=idx, id=None, items=[], content=None)
+      else:
+        record = dict(
+          index   = idx,
+          id      = result.id,
+          items   = [item.channel_id for item in result.items],
+          content = result.content,
+        )
+      outfp.write((json.dumps(record) + '\n').encode('utf-8'))
+      done = idx + 1
+      if options.checkpoint and done % CHECKPOINT_INTERVAL == 0:
+        _checkpoint(outfp, closeout, options.checkpoint, done)
+    if options.checkpoint:
+      _checkpoint(outfp, closeout, options.checkpoint, done)
+  finally:
+    if closein:
+      infp.close()
+    if closeout:
+      outfp.close()
+  return 0
+
+#------------------------------------------------------------------------------
+def _checkpoint(outfp, seekable, filename, count):
+  outfp.flush()
+  state = str(count)
+  if seekable:
+    state += ' ' + str(outfp.tell())
+  with open(filename + '.tmp', 'w') as fp:
+    fp.write(state)
+  os.rename(filename + '.tmp', filename)
+
 #------------------------------------------------------------------------------
 # end of $Id$
 #------------------------------------------------------------------------------
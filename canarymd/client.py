@@ -7,11 +7,35 @@
 #------------------------------------------------------------------------------
 
 import logging
+import os
+import re
+import threading
+import time
+import timeit
+import zlib
+import collections
+import contextlib
 import requests
+import six
+from six.moves import queue
 from aadict import aadict
 import morph
-import json
-import asset
+
+from . import validate
+from .constants import Purpose, Transport, Environment, DEFAULT_CONCURRENCY
+from .codec import getCodec
+from .flight import SingleFlight
+from .sessions import SessionStore, FileSessionStore, dumpCookies, loadCookies
+from .retry import RetryPolicy, _retryAfter
+from .ratelimit import RateLimiter
+from .breaker import CircuitBreaker
+from .reasons import ReasonCatalog, DEFAULT_REASONS_TTL
+from .stream import ContentStream, STREAM_CHUNK_SIZE
+from .metrics import Call, Observer, MetricsCollector
+from .cache import Cache, MemoryCache, FileCache, canonicalKey
+from .cma import \
+  ChunkedFile, fileDigest, sha256, CHECKSUM_HEADER, \
+  DEFAULT_CMA_CHUNK_SIZE, DEFAULT_CMA_CONCURRENCY
 
 #------------------------------------------------------------------------------
 
@@ -21,35 +45,284 @@ log = logging.getLogger(__name__)
 class Error(Exception): pass
 class AuthorizationError(Error): pass
 class ProtocolError(Error): pass
+class TimeoutError(Error): pass
+class CircuitOpenError(ProtocolError): pass
+
+#------------------------------------------------------------------------------
+class ValidationError(Error, ValueError):
+  '''
+  Raised (without contacting the server) when request parameters are
+  invalid. The `fields` attribute maps each invalid parameter's
+  dotted name (e.g. ``"peo.appointment.time"``) to an error message.
+  '''
+  def __init__(self, fields):
+    self.fields = fields
+    super(ValidationError, self).__init__(
+      'invalid parameters (' + ', '.join(
+        key + ': ' + value for key, value in sorted(fields.items())) + ')')
+  def __reduce__(self):
+    return (self.__class__, (self.fields,))
+
+#------------------------------------------------------------------------------
+class Deadline(object):
+  '''
+  The time budget of a single API call: `budget` seconds from when it
+  is created. Every HTTP request made on behalf of the call is limited
+  to the remaining budget; once it is used up, the call fails with a
+  :class:`canarymd.TimeoutError`.
+  '''
+  __slots__ = ('budget', 'expires')
+  def __init__(self, budget):
+    self.budget  = budget
+    self.expires = _timer() + budget
+  def remaining(self):
+    return self.expires - _timer()
+  def check(self):
+    '''
+    Returns the remaining number of seconds, or raises a
+    :class:`canarymd.TimeoutError` if there are none left.
+    '''
+    remaining = self.remaining()
+    if remaining <= 0:
+      raise TimeoutError('deadline of %ss exceeded' % (self.budget,))
+    return remaining
+  def timeouts(self, timeout):
+    '''
+    Returns the `requests` (connect, read) `timeout` tuple, limited to
+    the remaining budget.
+    '''
+    remaining = self.check()
+    if not isinstance(timeout, tuple):
+      timeout = (timeout, timeout)
+    return tuple(
+      remaining if value is None else min(value, remaining)
+      for value in timeout)
+
+#------------------------------------------------------------------------------
+DEFAULT_SESSION_TTL = 900
+AUTH_REFRESH_MARGIN = 30
+DEFAULT_POOL_SIZE   = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_RETRIES     = 3
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+# the response encodings that are negotiated (and that `requests`
+# decodes while the response is read, including when streaming)
+ACCEPT_ENCODING     = 'gzip, deflate'
+
+_timer = timeit.default_timer
+
+#------------------------------------------------------------------------------
+def _defaultRoot(env):
+  return {
+    Environment.PROD : 'https://api.canary.md/api',
+    Environment.DEV  : 'http://api-dev.canary.md:8899/api',
+  }.get(env,           'https://api-{env}.canary.md/api').format(env=env)
+
+#------------------------------------------------------------------------------
+API_VERSIONS = ('v1', 'v2')
+
+# the types of PEOs that have already been JSON-encoded by the caller
+ENCODED_TYPES = (six.binary_type, bytearray)
+
+# process-wide cache of negotiated API versions: maps (root, env) to
+# the `_parseVersion` result for that server
+_versions = dict()
+
+# the version of this package, see `_clientVersion`
+_clientver = None
+
+#------------------------------------------------------------------------------
+def _clientVersion():
+  # `asset` loads `pkg_resources`, which is slow to import, so the
+  # package version is only looked up when first needed
+  global _clientver
+  if _clientver is None:
+    import asset
+    _clientver = asset.version('canarymd')
+  return _clientver
+
+#------------------------------------------------------------------------------
+def _apiRoot(root, api):
+  if api == 'v1':
+    return root
+  return root + '/' + api
 
 #------------------------------------------------------------------------------
-class Purpose:
-  DISCOVER        = 'discover'
-  PREPARE         = 'prepare'
-  AUGMENT         = 'augment'
-  EXTEND          = 'extend'
-  ALL             = (DISCOVER, PREPARE, AUGMENT, EXTEND)
+def _parseVersion(res):
+  '''
+  Negotiates the API version to use given the server's response to a
+  ``GET /version`` request. Returns a tuple of ``(api, server)``, where
+  `api` is either ``"v1"`` or the version-specific sub-root that must
+  be appended to the API root (e.g. ``"v2"``).
+  '''
+  if 'apis' not in res:
+    sapi = res.get('api', 'UNKNOWN')
+    if sapi == '1.1.0':
+      return ('v1', res.get('server'))
+    raise ProtocolError(
+      'incompatible client/server versions (1.1.0 != %s)' % (sapi,))
+  sapi = res.get('apis', [])
+  for version in ('v2',):
+    if version in sapi:
+      return (version, res.get('server'))
+  raise ProtocolError(
+    'incompatible client/server versions ("v2" not in %r)' % (sapi,))
 
 #------------------------------------------------------------------------------
-class Transport:
-  SITE            = 'site'
-  EMAIL           = 'email'
-  PAPER           = 'paper'
-  SMS             = 'sms'
-  VOICE           = 'voice'
-  ALL             = (SITE, EMAIL, PAPER, SMS, VOICE)
+def _formatApiError(status, res):
+  ret = str(status) + ': ' + res['message']
+  if 'field' in res:
+    ret += ' (' + ', '.join([
+        key + ': ' + value
+        for key, value in morph.flatten(res['field']).items()]) + ')'
+  return ret
 
 #------------------------------------------------------------------------------
-class Environment:
-  DEV             =  'dev'
-  TEST            =  'test'
-  CI              =  'ci'
-  QA              =  'qa'
-  UAT             =  'uat'
-  PPE             =  'ppe'
-  STG             =  'stg'
-  PROD            =  'prod'
-  ALL             = (DEV, TEST, CI, QA, UAT, PPE, STG, PROD)
+def _responseError(res):
+  try:
+    data = res.json()
+  except ValueError:
+    data = None
+  if not isinstance(data, dict) or 'message' not in data:
+    data = dict(message=res.reason or 'unexpected non-JSON response')
+  return _formatApiError(res.status_code, data)
+
+#------------------------------------------------------------------------------
+# the selection request schema, compiled once (see `canarymd.validate`)
+_SELECTION_SCHEMA = validate.record([
+  ('context',     validate.string(),                            True),
+  ('timeout',     validate.number(minimum=0),                   False),
+  ('peo',         validate.record([
+    ('transport',   validate.oneOf(Transport.ALL, 'transport'), True),
+    ('purpose',     validate.oneOf(Purpose.ALL, 'purpose'),     True),
+    ('width',       validate.integer(minimum=1),                False),
+    ('height',      validate.integer(minimum=1),                False),
+    ('recipient',   validate.hl7(),                             True),
+    ('appointment', validate.either(validate.string(), validate.record([
+      ('time',        validate.isotime(),                       False),
+      ('patients',    validate.listOf(validate.hl7()),          False),
+      ('provider',    validate.hl7(),                           False),
+      ('type',        validate.string(),                        False),
+      ('reason',      validate.string(),                        False),
+      ('policy',      validate.hl7(),                           False),
+    ])),                                                        False),
+  ], conditions=[
+    ('transport', Transport.PAPER, ('width', 'height')),
+  ]),                                                           True),
+])
+
+#------------------------------------------------------------------------------
+def _selectionErrors(context, peo, timeout=None, reasons=None):
+  '''
+  Returns the flattened errors of a selection request, or ``None`` if
+  it is valid. If `reasons` is specified, it is called with the
+  appointment's reason code, if any, and must return ``None`` for
+  unknown codes.
+  '''
+  encoded = isinstance(peo, ENCODED_TYPES)
+  errors  = _SELECTION_SCHEMA(dict(
+    context=context, peo=None if encoded else peo, timeout=timeout))
+  errors  = validate.flatten(errors) if errors else dict()
+  if encoded:
+    # pre-encoded PEOs are passed through as-is
+    errors.pop('peo', None)
+  if reasons is not None and 'peo.appointment.reason' not in errors:
+    appointment = peo.get('appointment') if isinstance(peo, dict) else None
+    if isinstance(appointment, dict) and appointment.get('reason') \
+        and reasons(appointment['reason']) is None:
+      errors['peo.appointment.reason'] = \
+        'unknown reason code: %r' % (appointment['reason'],)
+  return errors or None
+
+#------------------------------------------------------------------------------
+def _selectionParams(context, peo, timeout, reasons=None):
+  errors = _selectionErrors(context, peo, timeout, reasons)
+  if errors:
+    raise ValidationError(errors)
+  params = {
+    'selection' : {
+      'context'   : context,
+      'peo'       : peo,
+    },
+  }
+  if timeout is not None:
+    params['timeout'] = timeout
+  return params
+
+#------------------------------------------------------------------------------
+def _selectionBody(codec, params):
+  # encodes the selection request `params`, splicing in a pre-encoded
+  # PEO without decoding it
+  peo = params['selection']['peo']
+  if not isinstance(peo, ENCODED_TYPES):
+    return codec.dumps(params)
+  ret = b'{"selection":{"context":' \
+    + codec.dumps(params['selection']['context']) \
+    + b',"peo":' + bytes(peo) + b'}'
+  if 'timeout' in params:
+    ret += b',"timeout":' + codec.dumps(params['timeout'])
+  return ret + b'}'
+
+#------------------------------------------------------------------------------
+def _gzip(data):
+  # ``gzip.compress`` is not available on python 2
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+  return compressor.compress(bytes(data)) + compressor.flush()
+
+#------------------------------------------------------------------------------
+def _compressThreshold(compress):
+  # maps the `compress` option to the minimum size of request bodies
+  # to compress, or ``None`` to never compress them
+  if compress is True:
+    return DEFAULT_COMPRESS_THRESHOLD
+  return compress or None
+
+#------------------------------------------------------------------------------
+def _compressBody(data, threshold):
+  # returns the gzip-compressed `data` if it is at least `threshold`
+  # bytes and compression actually makes it smaller, otherwise None
+  if threshold is None or len(data) < threshold:
+    return None
+  ret = _gzip(data)
+  return ret if len(ret) < len(data) else None
+
+#------------------------------------------------------------------------------
+# path segments that identify a resource rather than an endpoint, e.g.
+# the file ID and chunk index of "/v2/cma/{id}/chunk/{id}"
+_RESOURCE_ID = re.compile(r'^(?:\d+|[0-9a-fA-F-]{16,})$')
+
+def _endpointName(baseroot, url):
+  # the circuit breaker's name for the endpoint of `url`, i.e. its
+  # route template relative to `baseroot`, e.g. "/v2/selection"
+  if url.startswith(baseroot):
+    url = url[len(baseroot):]
+  return '/'.join(
+    '{id}' if _RESOURCE_ID.match(segment) else segment
+    for segment in url.split('?', 1)[0].split('/'))
+
+#------------------------------------------------------------------------------
+def _sessionExpiry(ttl, expiries):
+  # the time a new session expires: after `ttl` seconds, or when the
+  # first of its cookies expires (`expiries` are timestamps or None)
+  return min([time.time() + ttl] + [value for value in expiries if value])
+
+#------------------------------------------------------------------------------
+def _deadlineParams(params, deadline):
+  # the server is given whatever is left of the call's time budget
+  return dict(params, timeout=max(0.001, round(deadline.check(), 3)))
+
+#------------------------------------------------------------------------------
+def _selectionResult(jdat, text, compact=False):
+  if 'selection' not in jdat:
+    log.error(
+      'unexpected error: no `selection` attribute in selection response: %r',
+      text)
+    raise ProtocolError(
+      'unexpected error: no `selection` attribute in selection response')
+  if jdat['selection'] is None:
+    return None
+  return Selection(jdat, compact=compact)
 
 #------------------------------------------------------------------------------
 class Client(object):
@@ -57,7 +330,16 @@ class Client(object):
   # todo: add
 
   #----------------------------------------------------------------------------
-  def __init__(self, principal, credential, env=Environment.PROD, root=None):
+  def __init__(self, principal, credential, env=Environment.PROD, root=None,
+               api=None, session_ttl=DEFAULT_SESSION_TTL,
+               pool_size=DEFAULT_POOL_SIZE, max_connections=None,
+               keep_alive=True, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+               read_timeout=None, retry=DEFAULT_RETRIES,
+               reasons_ttl=DEFAULT_REASONS_TTL, reasons_snapshot=None,
+               cache=None, compact=False, observers=None, codec=None,
+               single_flight=False, session_store=None, rate_limit=None,
+               call_timeout=None, partner=None, adapter=None, compress=None,
+               circuit_breaker=None):
     '''
     Constructs a new `canarymd.Client` object that is used to
     communicate with the Canary API. The following parameterns
@@ -81,70 +363,622 @@ class Client(object):
       production servers. For testing, the staging environment
       should be used, i.e. ``canarymd.Environment.STG``.
 
+    root : str, optional
+
+      Overrides the API root URL that is otherwise derived from `env`.
+
+    api : str, optional, default: null
+
+      Pins the API protocol version to use (one of
+      ``canarymd.API_VERSIONS``), which skips the ``/version``
+      negotiation with the server. By default, the version is
+      negotiated on the first request (not during construction) and
+      the result is cached process-wide per `root` and `env`.
+
+    session_ttl : int, optional, default: 900
+
+      The number of seconds an authenticated session is assumed to
+      remain valid if the server does not specify an expiration. The
+      client logs in before the first request and re-authenticates
+      shortly before the session expires, so that requests are not
+      first rejected and then re-sent.
+
+    pool_size : int, optional, default: 10
+
+      The number of connections per host that are kept open for
+      re-use. This should be at least the number of threads that use
+      this client concurrently (e.g. the `concurrency` of
+      :meth:`select_many`).
+
+    max_connections : int, optional, default: null
+
+      If specified, a hard limit on the number of simultaneous
+      connections per host: requests that would exceed it wait for a
+      connection to become available. This overrides `pool_size`.
+
+    keep_alive : bool, optional, default: true
+
+      Whether or not to keep connections open between requests.
+
+    connect_timeout : float, optional, default: 10
+
+      The maximum number of seconds to wait for a connection to the
+      Canary servers to be established. ``None`` waits forever.
+
+    read_timeout : float, optional, default: null
+
+      The maximum number of seconds to wait for data from the Canary
+      servers. ``None`` (the default) waits forever.
+
+    retry : { int, canarymd.RetryPolicy }, optional, default: 3
+
+      The policy that controls re-sending of requests that failed
+      transiently (e.g. with a ``503`` status or a connection reset).
+      An integer is the maximum number of retries with the default
+      exponential backoff; zero or ``None`` disables retries.
+
+    reasons_ttl : float, optional, default: 3600
+
+      The number of seconds the reasons-for-visit catalogue returned
+      by :meth:`reasons` is cached before it is re-validated with the
+      server (which only re-downloads it if it has changed).
+
+    reasons_snapshot : str, optional, default: null
+
+      The name of a file in which to keep a snapshot of the
+      reasons-for-visit catalogue so that new processes start warm.
+
+    cache : canarymd.Cache, optional, default: null
+
+      A cache for :meth:`select` responses, e.g. a
+      ``canarymd.MemoryCache()`` or, to share it between processes on
+      the same host, a ``canarymd.FileCache(path)``. Selections are
+      cached by a canonical form of their `context` and `peo`, and
+      namespaced by the server, API version and principal. By
+      default, selections are not cached.
+
+    compact : bool, optional, default: false
+
+      If truthy, :class:`canarymd.Selection` objects returned by this
+      client only retain the selection ID, the channel IDs of its
+      items and the content, but not the complete server response.
+      This reduces memory usage when many selections are held at
+      once, e.g. in batch jobs.
+
+    observers : list(canarymd.Observer), optional, default: null
+
+      Instrumentation hooks that are notified of every API call with
+      a :class:`canarymd.Call` record of its per-phase timings,
+      status, payload sizes, retries and cache usage, e.g. a
+      ``canarymd.MetricsCollector()``. See :mod:`canarymd.metrics`.
+
+    codec : { str, canarymd.codec.Codec }, optional, default: null
+
+      The JSON backend to use: ``"orjson"``, ``"ujson"`` or
+      ``"json"`` (the standard library). By default, the fastest
+      installed backend is used.
+
+    single_flight : bool, optional, default: false
+
+      If truthy, concurrent identical requests are coalesced: while a
+      :meth:`select` call for a given `context` and (canonicalized)
+      `peo` is in progress, other threads requesting the same
+      selection wait for it and receive the same
+      :class:`canarymd.Selection` object instead of sending their own
+      request. The same applies to fetching the reasons-for-visit
+      catalogue. Streamed selections are never coalesced.
+
+    session_store : canarymd.SessionStore, optional, default: null
+
+      A store that persists this client's server session, so that
+      clients in other (or later) processes using the same `root` and
+      `principal` can continue it instead of logging in again, e.g. a
+      ``canarymd.FileSessionStore(path)``. Logins are serialized
+      through the store's lock, so that many processes starting at
+      once only log in once.
+
+    rate_limit : { float, canarymd.RateLimiter }, optional, default: null
+
+      Throttles requests to the Canary servers: a
+      ``canarymd.RateLimiter`` or, as a shorthand, the maximum number
+      of requests per second. The limiter lowers the request rate and
+      concurrency when the server signals overload (e.g. with ``429``
+      responses) and raises them again while requests succeed. Its
+      current limits are included in :meth:`stats`. By default,
+      requests are not throttled.
+
+    call_timeout : float, optional, default: null
+
+      The maximum number of seconds that each API call may take from
+      start to finish, including version negotiation, logging in,
+      retries and re-authentication. Every HTTP request is limited to
+      what remains of this budget and, once it is used up, the call
+      fails with a :class:`canarymd.TimeoutError`. The `timeout` of
+      :meth:`select` overrides it. Note that `read_timeout` applies
+      to each read from the connection, not to the whole response, so
+      a server that trickles data can still exceed `read_timeout`,
+      but not `call_timeout`. By default, calls are not limited.
+
+    partner : str, optional, default: null
+
+      The ID of the partner to act on behalf of, for principals that
+      have access to several partners; it is sent with every request
+      in the ``x-active-partner-id`` header.
+
+    adapter : requests.adapters.HTTPAdapter, optional, default: null
+
+      The connection pool to use, which may be shared with other
+      clients (see :class:`canarymd.ClientPool`); `pool_size` and
+      `max_connections` are then ignored. By default, each client
+      has its own. Note that shared adapters are not shared across
+      a ``fork()``: a client used in a forked child process creates
+      its own.
+
+    compress : { bool, int }, optional, default: null
+
+      Whether or not to gzip-compress request bodies (e.g. PEOs with
+      many HL7-serialized patients), which are then sent with a
+      ``Content-Encoding: gzip`` header: ``True`` compresses bodies of
+      1024 bytes or more, an integer sets that minimum size. Bodies
+      that do not shrink are sent as is. Independently of this,
+      compressed responses are always negotiated (see
+      ``ACCEPT_ENCODING``) and are decoded while they are read. The
+      bytes saved in either direction are reported by :meth:`stats`.
+      By default, request bodies are not compressed.
+
+    circuit_breaker : { bool, canarymd.CircuitBreaker }, optional, default: null
+
+      Fails fast while the Canary API is degraded: a
+      ``canarymd.CircuitBreaker`` or, as a shorthand, ``True`` for one
+      with the default settings. Once too many recent requests to an
+      endpoint failed or were too slow, further requests to it raise
+      a :class:`canarymd.CircuitOpenError` (a
+      :class:`canarymd.ProtocolError`) immediately, without being
+      sent, until probe requests succeed again. :meth:`select` can
+      return the breaker's `fallback` instead, and :meth:`health`
+      reports the state of each endpoint. By default, requests are
+      always sent.
+
     '''
     if env not in Environment.ALL:
       raise ValueError('invalid/unknown environment: %r' % (env,))
-    self.cookies    = {}
+    if api is not None and api not in API_VERSIONS:
+      raise ValueError('invalid/unknown API version: %r' % (api,))
     self.env        = env
-    self.root       = root or {
-      Environment.PROD : 'https://api.canary.md/api',
-      Environment.DEV  : 'http://api-dev.canary.md:8899/api',
-    }.get(env,           'https://api-{env}.canary.md/api').format(env=env)
+    self.root       = root or _defaultRoot(env)
     self.principal  = None
     self.credential = None
     self.session    = None
+    self.session_ttl = session_ttl
+    self.pool_size  = max_connections or pool_size
+    self.pool_block = bool(max_connections)
+    self.keep_alive = keep_alive
+    self.timeout    = (connect_timeout, read_timeout)
+    self.call_timeout = call_timeout
+    self.partner    = partner
+    self.adapter    = adapter
+    self.compress   = _compressThreshold(compress)
+    if retry and not isinstance(retry, RetryPolicy):
+      retry         = RetryPolicy(retries=retry)
+    self.retry      = retry or None
+    self._stats     = collections.Counter()
+    self._statslock = threading.Lock()
+    self._reasons   = ReasonCatalog(ttl=reasons_ttl, path=reasons_snapshot)
+    self.cache      = cache
+    self.compact    = compact
+    self.observers  = list(observers or [])
+    self.codec      = getCodec(codec)
+    self._flight    = SingleFlight() if single_flight else None
+    self.session_store = session_store
+    if rate_limit is not None and not isinstance(rate_limit, RateLimiter):
+      rate_limit    = RateLimiter(rate=rate_limit)
+    self.limiter    = rate_limit
+    if circuit_breaker is True:
+      circuit_breaker = CircuitBreaker()
+    self.breaker    = circuit_breaker or None
+    self._pid       = os.getpid()
+    self._authlock  = threading.Lock()
+    self._authgen   = 0
+    self._expires   = None
     self.updateAuth(principal, credential)
-    self._version   = aadict(client=asset.version('canarymd'))
-    self._checkVersion()
+    self._baseroot  = self.root
+    self._version   = aadict(client=None, api=api)
+    self._vlock     = threading.Lock()
+    self._pinned    = api is not None
+    if api is not None:
+      self.root     = _apiRoot(self._baseroot, api)
 
   #----------------------------------------------------------------------------
-  def _checkVersion(self):
-    res = self.session.get(self.root + '/version').json()
-    if 'apis' not in res:
-      sapi = res.get('api', 'UNKNOWN')
-      if sapi == '1.1.0':
-        self._version.update(api='v1', server=res.get('server'))
+  def _checkVersion(self, probe=False, deadline=None):
+    '''
+    Negotiates the API version with the server, unless already done
+    (or pinned). If `probe` is truthy, the server is queried even if
+    the version was pinned or is known from the process-wide cache;
+    for a pinned client, this only fills in the server version.
+    '''
+    if self._version.api is not None and not probe:
+      return
+    with self._vlock:
+      if self._version.api is not None and not probe:
         return
-      raise ProtocolError(
-        'incompatible client/server versions (1.1.0 != %s)' % (sapi,))
-    sapi = res.get('apis', [])
-    for version in ('v2',):
-      if version in sapi:
-        self._version.update(api=version, server=res.get('server'))
-        self.root += '/' + version
+      key = (self._baseroot, self.env)
+      if probe or key not in _versions:
+        _versions[key] = _parseVersion(self.codec.loads(self._send(
+          'get', self._baseroot + '/version', deadline=deadline).content))
+      api, server = _versions[key]
+      if self._pinned:
+        # only report the server version; the pinned API stays in effect
+        self._version.update(server=server)
         return
-    raise ProtocolError(
-      'incompatible client/server versions ("v2" not in %r)' % (sapi,))
+      self._version.update(api=api, server=server)
+      self.root = _apiRoot(self._baseroot, api)
+
+  #----------------------------------------------------------------------------
+  def _deadline(self, timeout=None):
+    timeout = timeout or self.call_timeout
+    return Deadline(timeout) if timeout else None
 
   #----------------------------------------------------------------------------
   def _apiError(self, res):
-    ret = str(res.status_code) + ': '
-    # todo: handle case where `res.content_type` is not application/json...
-    res = res.json()
-    ret += res['message']
-    if 'field' in res:
-      ret += ' (' + ', '.join([
-          key + ': ' + value
-          for key, value in morph.flatten(res['field']).items()]) + ')'
+    return _responseError(res)
+
+  #----------------------------------------------------------------------------
+  def _newSession(self, adapter=None):
+    session = requests.Session()
+    adapter = adapter or self.adapter or requests.adapters.HTTPAdapter(
+      pool_maxsize=self.pool_size, pool_block=self.pool_block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['content-type'] = 'application/json'
+    session.headers['accept-encoding'] = ACCEPT_ENCODING
+    if not self.keep_alive:
+      session.headers['connection'] = 'close'
+    if self.partner is not None:
+      session.headers['x-active-partner-id'] = str(self.partner)
+    return session
+
+  #----------------------------------------------------------------------------
+  def _checkFork(self):
+    '''
+    Makes this client safe to use after a ``fork()``: if it is being
+    used in a different process than before, the connections and
+    locks inherited from the parent are replaced (they are shared
+    with, or may be held by threads of, the parent) and the counters
+    are reset. The negotiated API version and the server session
+    cookies are kept, so the child does not need to re-negotiate or
+    log in again.
+    '''
+    if self._pid == os.getpid():
+      return
+    self._pid       = os.getpid()
+    self._authlock  = threading.Lock()
+    self._statslock = threading.Lock()
+    self._vlock     = threading.Lock()
+    self._stats     = collections.Counter()
+    self._reasons._lock = threading.Lock()
+    if self._flight is not None:
+      self._flight  = SingleFlight()
+    # the connections of a shared adapter belong to the parent
+    self.adapter    = None
+    parent = self.session
+    self.session = self._newSession()
+    if parent is not None:
+      self.session.cookies.update(parent.cookies)
+    log.debug('rebuilt client transport in forked process %d', self._pid)
+
+  #----------------------------------------------------------------------------
+  def _count(self, name, value=1):
+    with self._statslock:
+      self._stats[name] += value
+
+  #----------------------------------------------------------------------------
+  @contextlib.contextmanager
+  def _observe(self, operation):
+    # yields a `Call` record for an API call and passes it to the
+    # observers when the call completes, whether it succeeded or not
+    self._checkFork()
+    call = Call(operation)
+    try:
+      yield call
+    except Exception as err:
+      call.error = err.__class__.__name__
+      raise
+    finally:
+      call.finish()
+      for observer in self.observers:
+        try:
+          observer.observe(call)
+        except Exception:
+          log.exception('observer %r failed', observer)
+
+  #----------------------------------------------------------------------------
+  def _countEncoding(self, res, size):
+    # records how many bytes the compression of the response `res`,
+    # whose decoded body is `size` bytes, saved on the wire
+    encoding = res.headers.get('content-encoding')
+    tell = getattr(getattr(res, 'raw', None), 'tell', None)
+    if encoding not in ('gzip', 'deflate') or tell is None:
+      return
+    self._count('compressed_responses')
+    self._count('response_bytes_saved', size - tell())
+
+  #----------------------------------------------------------------------------
+  def stats(self):
+    '''
+    Returns a snapshot of this client's counters, e.g. the number of
+    HTTP `requests` sent, how many of those were `retries`, and the
+    number of `logins`. The numbers of `compressed_requests` and
+    `compressed_responses`, and the `request_bytes_saved` and
+    `response_bytes_saved` by compressing them, are also included
+    once there are any. With a `rate_limit`, the current
+    `rate_limit` and `concurrency_limit` and the number of
+    `throttled` responses are also included.
+    '''
+    with self._statslock:
+      ret = aadict(self._stats)
+    if self.limiter is not None:
+      limits = self.limiter.stats()
+      ret.update(
+        rate_limit        = limits['rate'],
+        concurrency_limit = limits['concurrency'],
+        throttled         = limits['throttled'])
     return ret
 
   #----------------------------------------------------------------------------
-  def _req(self, method, url, data=None, *args, **kw):
-    log.debug('sending %r request to %r', method, url)
-    if data is not None:
-      data = json.dumps(data)
-    res = getattr(self.session, method)(self.root + url, data=data, *args, **kw)
-    if res.status_code != 401:
-      return res
-    res = self.session.post(self.root + '/auth/session', json.dumps({
+  def health(self):
+    '''
+    Returns the state of this client's `circuit_breaker` (see
+    :meth:`canarymd.CircuitBreaker.health`), for health checks.
+    Without a circuit breaker, the client always reports itself as
+    healthy.
+    '''
+    if self.breaker is None:
+      return aadict(healthy=True, endpoints=dict())
+    return self.breaker.health()
+
+  #----------------------------------------------------------------------------
+  def _send(self, method, url, data=None, call=None, deadline=None, **kw):
+    '''
+    Sends a single HTTP request to `url`, re-sending it as allowed by
+    the retry policy. Connection-level failures that are not retried
+    are raised as :class:`canarymd.ProtocolError`. If `call` is
+    specified, the status, response size and retries are recorded in
+    it. If `deadline` is specified, each attempt is limited to its
+    remaining budget and a :class:`canarymd.TimeoutError` is raised
+    when it runs out (including when there is no time left to wait
+    for a retry).
+    '''
+    kw.setdefault('timeout', self.timeout)
+    attempt = 0
+    while True:
+      attempt += 1
+      try:
+        res = self._request(method, url, data, kw, deadline)
+      except requests.RequestException as err:
+        if deadline is not None and isinstance(err, requests.Timeout):
+          deadline.check()
+        delay = self.retry.delay(method, attempt, error=err) \
+          if self.retry else None
+        if delay is None:
+          log.error('%s request to %r failed: %s', method, url, err)
+          raise ProtocolError('%s: %s' % (err.__class__.__name__, err))
+        log.info('%s request to %r failed (%s), retrying in %.2fs',
+                 method, url, err, delay)
+      else:
+        delay = self.retry.delay(method, attempt, res=res) \
+          if self.retry else None
+        if delay is None:
+          if call is not None:
+            call.status = res.status_code
+            if not kw.get('stream'):
+              call.response_bytes += len(res.content)
+          if not kw.get('stream'):
+            self._countEncoding(res, len(res.content))
+          return res
+        log.info('%s request to %r failed (%s), retrying in %.2fs',
+                 method, url, res.status_code, delay)
+        _release(res)
+      if deadline is not None and delay >= deadline.check():
+        raise TimeoutError(
+          'deadline of %ss exceeded before retrying %s request to %r'
+          % (deadline.budget, method, url))
+      self._count('retries')
+      if call is not None:
+        call.retries += 1
+      time.sleep(delay)
+
+  #----------------------------------------------------------------------------
+  def _request(self, method, url, data, kw, deadline=None):
+    endpoint = self._endpoint(url)
+    if self.breaker is not None and not self.breaker.allow(endpoint):
+      self._count('circuit_rejected')
+      raise CircuitOpenError(
+        'circuit open: %s requests to %r are failing fast' % (method, url))
+    self._count('requests')
+    if self.limiter is not None:
+      # the rate limiting delay counts against the call's budget too
+      if self.limiter.acquire(None if deadline is None else max(
+          0, deadline.remaining())) is None:
+        if self.breaker is not None:
+          self.breaker.record(endpoint)
+        raise TimeoutError(
+          'deadline of %ss exceeded while rate limited' % (deadline.budget,))
+    start = time.time()
+    try:
+      if deadline is not None:
+        kw = dict(kw, timeout=deadline.timeouts(kw['timeout']))
+      res = self.session.request(method, url, data=data, **kw)
+    except requests.RequestException as err:
+      # running out of the call's own budget is not a sign of overload
+      overload = isinstance(err, requests.Timeout) and (
+        deadline is None or deadline.remaining() > 0)
+      if self.limiter is not None:
+        self.limiter.release(overload=overload)
+      if self.breaker is not None:
+        expired = isinstance(err, requests.Timeout) and not overload
+        self.breaker.record(endpoint, failed=None if expired else True)
+      raise
+    except Exception:
+      if self.limiter is not None:
+        self.limiter.release()
+      if self.breaker is not None:
+        self.breaker.record(endpoint)
+      raise
+    latency = time.time() - start
+    if self.limiter is not None:
+      self.limiter.release(
+        res.status_code, latency, _retryAfter(res.headers.get('retry-after')))
+    if self.breaker is not None:
+      self.breaker.record(endpoint, res.status_code, latency)
+    return res
+
+  #----------------------------------------------------------------------------
+  def _endpoint(self, url):
+    return _endpointName(self._baseroot, url)
+
+  #----------------------------------------------------------------------------
+  def _authenticate(self, stale=None, deadline=None):
+    '''
+    Logs in to the Canary servers, unless the current session is still
+    valid. If `stale` is specified, then it is the session generation
+    that was rejected by the server: a new session is established
+    unless another thread has already done so in the meantime. Returns
+    the current session generation. Waiting for another thread's login
+    and logging in are both limited by `deadline`, if specified.
+    '''
+    _acquire(self._authlock, deadline)
+    try:
+      if stale is None:
+        if self._expires is not None \
+            and time.time() < self._expires - AUTH_REFRESH_MARGIN:
+          return self._authgen
+      elif stale != self._authgen:
+        return self._authgen
+      if self.session_store is None:
+        self._login(deadline)
+        return self._authgen
+      with self.session_store.lock(self._baseroot, self.principal):
+        # another process may have logged in while this one waited
+        if not self._resumeSession(rejected=stale is not None):
+          self._login(deadline)
+          self._saveSession()
+      return self._authgen
+    finally:
+      self._authlock.release()
+
+  #----------------------------------------------------------------------------
+  def _login(self, deadline=None):
+    log.debug('authenticating %r to %r', self.principal, self.root)
+    self._expires = None
+    self._count('logins')
+    res = self._send('post', self.root + '/auth/session', self.codec.dumps({
       'username' : self.principal,
       'password' : self.credential,
-    }))
+    }), deadline=deadline)
     if res.status_code != 200:
       err = self._apiError(res)
       log.error('authentication failure: %s', err)
       raise AuthorizationError(err)
-    res = getattr(self.session, method)(self.root + url, data=data, *args, **kw)
+    self._authgen += 1
+    self._expires = self._sessionExpiry()
+
+  #----------------------------------------------------------------------------
+  def _resumeSession(self, rejected=False):
+    # adopts the stored session, if there is one that is still valid
+    # and is not the one that the server just `rejected`
+    stored = self.session_store.load(
+      self._baseroot, self.principal, self.credential)
+    if stored is None \
+        or time.time() >= stored['expires'] - AUTH_REFRESH_MARGIN:
+      return False
+    if rejected and stored['cookies'] == dumpCookies(self.session.cookies):
+      self.session_store.discard(self._baseroot, self.principal)
+      return False
+    log.debug('resuming stored session of %r', self.principal)
+    loadCookies(self.session.cookies, stored['cookies'])
+    self._count('session_resumes')
+    self._authgen += 1
+    self._expires = stored['expires']
+    return True
+
+  #----------------------------------------------------------------------------
+  def _saveSession(self):
+    try:
+      self.session_store.save(
+        self._baseroot, self.principal, self.credential, dict(
+          cookies = dumpCookies(self.session.cookies),
+          expires = self._expires,
+        ))
+    except (IOError, OSError) as err:
+      log.warning('could not store session of %r: %s', self.principal, err)
+
+  #----------------------------------------------------------------------------
+  def _sessionExpiry(self):
+    return _sessionExpiry(
+      self.session_ttl, [cookie.expires for cookie in self.session.cookies])
+
+  #----------------------------------------------------------------------------
+  def authenticate(self):
+    '''
+    Ensures that this client has a valid session with the Canary
+    servers, logging in if necessary. This is done automatically
+    before requests, but can be called to "pre-warm" a client.
+    '''
+    deadline = self._deadline()
+    with self._observe('authenticate') as call:
+      self._checkVersion(deadline=deadline)
+      call.lap('version')
+      self._authenticate(deadline=deadline)
+      call.lap('auth')
+    return self
+
+  #----------------------------------------------------------------------------
+  def _prepare(self, call, deadline=None):
+    # negotiates the API version and logs in, if needed, and returns
+    # the session generation. Phases that did not do any work (e.g.
+    # the session was still valid) are not recorded.
+    negotiate = self._version.api is None
+    self._checkVersion(deadline=deadline)
+    call.lap('version' if negotiate else None)
+    before  = self._authgen
+    authgen = self._authenticate(deadline=deadline)
+    call.lap('auth' if authgen != before else None)
+    return authgen
+
+  #----------------------------------------------------------------------------
+  def _req(self, method, url, data=None, call=None, deadline=None, **kw):
+    if call is None:
+      call = Call(None)
+    authgen = self._prepare(call, deadline)
+    log.debug('sending %r request to %r', method, url)
+    # the body is encoded (and compressed) only once, even if the
+    # request is re-sent
+    if data is not None:
+      if not isinstance(data, ENCODED_TYPES):
+        data = self.codec.dumps(data)
+      compressed = _compressBody(data, self.compress)
+      if compressed is not None:
+        self._count('compressed_requests')
+        self._count('request_bytes_saved', len(data) - len(compressed))
+        kw['headers'] = dict(
+          kw.get('headers') or {}, **{'content-encoding': 'gzip'})
+        data = compressed
+      call.request_bytes = len(data)
+      call.lap('serialize')
+    res = self._send(
+      method, self.root + url, data=data, call=call, deadline=deadline, **kw)
+    call.lap('network')
+    if res.status_code != 401:
+      return res
+    # the session was invalidated server-side before it was due to
+    # expire: re-authenticate (or wait for another thread to do so)
+    # and re-send the (already encoded) request once.
+    _release(res)
+    self._authenticate(stale=authgen, deadline=deadline)
+    call.lap('reauth')
+    res = self._send(
+      method, self.root + url, data=data, call=call, deadline=deadline, **kw)
+    call.lap('network')
     if res.status_code != 401 and res.status_code != 403:
       return res
     err = self._apiError(res)
@@ -153,6 +987,18 @@ class Client(object):
 
   #----------------------------------------------------------------------------
   def version(self):
+    '''
+    Returns an object with the `client` and `server` software
+    versions and the negotiated `api` protocol version. This always
+    queries the server if its version is not yet known.
+    '''
+    deadline = self._deadline()
+    with self._observe('version') as call:
+      self._checkVersion(deadline=deadline)
+      if self._version.server is None:
+        self._checkVersion(probe=True, deadline=deadline)
+      call.lap('version')
+    self._version.client = _clientVersion()
     return self._version
 
   #----------------------------------------------------------------------------
@@ -166,15 +1012,20 @@ class Client(object):
     #       to the server then? we could force a re-auth immediately...
     if self.principal == principal and self.credential == credential:
       return self
+    self._checkFork()
     self.principal  = principal
     self.credential = credential
-    # todo: or just de-auth the current session?...
-    self.session    = requests.Session()
-    self.session.headers['content-type'] = 'application/json'
+    # the new session drops the previous credentials' cookies, but
+    # keeps the (warm) connections
+    adapters = getattr(self.session, 'adapters', None) or {}
+    with self._authlock:
+      self.session    = self._newSession(adapters.get('https://'))
+      self._expires   = None
+      self._authgen  += 1
     return self
 
   #----------------------------------------------------------------------------
-  def select(self, context, peo, timeout=None):
+  def select(self, context, peo, timeout=None, cache=True, stream=None):
     '''
     Request a message selection. If no applicable messages are found,
     then this returns ``None``, otherwise a
@@ -230,48 +1081,620 @@ class Client(object):
         appointment; either as a dictionary of attributes or in HL7
         serialized form.
 
+    timeout : float, optional, default: null
+
+      The maximum number of seconds this call may take, including
+      logging in and retries; it overrides the client's
+      `call_timeout`. The server is asked to make the selection in
+      whatever remains of this time when the request is sent, and a
+      :class:`canarymd.TimeoutError` is raised when it runs out.
+
+    cache : bool, optional, default: true
+
+      Whether or not to use the client's selection cache, if one was
+      configured (see :class:`canarymd.Client`).
+
+    The parameters are validated before anything is sent to the
+    server: invalid parameters (including, if the reasons-for-visit
+    catalogue has been loaded, unknown appointment reason codes)
+    raise a :class:`canarymd.ValidationError`.
+
+    stream : { file, str }, optional, default: null
+
+      A binary file-like object or the name of a file to write the
+      selection's content to, UTF-8 encoded, as it is received from
+      the server. The content is then never held in memory in its
+      entirety, which is useful for large ``paper`` and ``email``
+      renderings. The returned selection's `content` is ``None``, but
+      all other attributes are available as usual. Streamed
+      selections bypass the selection cache.
+
     '''
-    if peo.get('transport') not in Transport.ALL:
-      raise ValueError('invalid/unknown transport: %r' % (peo.get('transport'),))
-    if peo.get('purpose') not in Purpose.ALL:
-      raise ValueError('invalid/unknown purpose: %r' % (peo.get('purpose'),))
-    # todo: do a full parameter check?...
-    params = {
-      'selection' : {
-        'context'   : context,
-        'peo'       : peo,
-      },
-    }
-    if timeout is not None:
-      params['timeout'] = timeout
-    res = self._req('post', '/selection', params)
+    deadline = self._deadline(timeout)
+    try:
+      with self._observe('select') as call:
+        return self._select(
+          context, peo, timeout, cache, stream, call, deadline)
+    except CircuitOpenError:
+      if self.breaker is None or not self.breaker.hasFallback:
+        raise
+      self._count('circuit_fallbacks')
+      return self.breaker.fallback
+
+  #----------------------------------------------------------------------------
+  def _select(self, context, peo, timeout, cache, stream, call, deadline):
+    params = _selectionParams(context, peo, timeout, self._reasonLookup())
+    if stream is not None:
+      return self._selectStream(params, stream, call, deadline)
+    if self._flight is None:
+      return self._selectCached(context, peo, params, cache, call, deadline)
+    ret, shared = self._flight.do(
+      canonicalKey(context, peo, namespace=[timeout, bool(cache)]),
+      self._selectCached, context, peo, params, cache, call, deadline)
+    if shared:
+      self._count('coalesced')
+      call.lap(None)
+    return ret
+
+  #----------------------------------------------------------------------------
+  def _selectCached(self, context, peo, params, cache, call, deadline):
+    key = None
+    if cache and self.cache is not None:
+      self._checkVersion()
+      call.lap(None)
+      key  = canonicalKey(context, peo, namespace=[
+        self._baseroot, self.env, self._version.api, self.principal,
+        self.partner])
+      text = self.cache.get(key)
+      call.lap('cache')
+      if text is not None:
+        self._count('cache_hits')
+        call.cache = 'hit'
+        ret = _selectionResult(self.codec.loads(text), text, self.compact)
+        call.lap('parse')
+        return ret
+      self._count('cache_misses')
+      call.cache = 'miss'
+    if deadline is not None:
+      self._prepare(call, deadline)
+      params = _deadlineParams(params, deadline)
+    body = _selectionBody(self.codec, params)
+    call.lap('serialize')
+    res = self._req('post', '/selection', body, call=call, deadline=deadline)
     if res.status_code != 200:
       err = self._apiError(res)
       log.error('selection failure: %s', err)
       raise ProtocolError(err)
-    jdat = res.json()
-    if 'selection' not in jdat:
-      log.error(
-        'unexpected error: no `selection` attribute in selection response: %r',
-        res.text)
-      raise ProtocolError(
-        'unexpected error: no `selection` attribute in selection response')
-    if jdat['selection'] is None:
+    ret = _selectionResult(
+      self.codec.loads(res.content), res.content, self.compact)
+    call.lap('parse')
+    if key is not None:
+      self.cache.set(key, res.content.decode('utf-8'))
+    return ret
+
+  #----------------------------------------------------------------------------
+  def _selectStream(self, params, stream, call, deadline):
+    if deadline is not None:
+      self._prepare(call, deadline)
+      params = _deadlineParams(params, deadline)
+    body = _selectionBody(self.codec, params)
+    call.lap('serialize')
+    res = self._req(
+      'post', '/selection', body, call=call, deadline=deadline, stream=True)
+    try:
+      if res.status_code != 200:
+        err = self._apiError(res)
+        log.error('selection failure: %s', err)
+        raise ProtocolError(err)
+      output = stream
+      if isinstance(stream, six.string_types):
+        output = open(stream, 'wb')
+      try:
+        scanner = ContentStream(output)
+        for chunk in res.iter_content(STREAM_CHUNK_SIZE):
+          call.response_bytes += len(chunk)
+          scanner.feed(chunk)
+          if deadline is not None:
+            deadline.check()
+        call.lap('network')
+        self._countEncoding(res, call.response_bytes)
+        jdat = scanner.close()
+        call.lap('parse')
+      finally:
+        if output is not stream:
+          output.close()
+    except requests.RequestException as err:
+      if deadline is not None:
+        deadline.check()
+      log.error('selection download failed: %s', err)
+      raise ProtocolError('%s: %s' % (err.__class__.__name__, err))
+    except ValueError as err:
+      log.error('invalid streamed selection response: %s', err)
+      raise ProtocolError('invalid selection response: %s' % (err,))
+    finally:
+      _release(res)
+    log.debug('streamed %d bytes of selection content', scanner.size)
+    return _selectionResult(jdat, jdat, self.compact)
+
+  #----------------------------------------------------------------------------
+  def select_many(self, context, peos, concurrency=DEFAULT_CONCURRENCY,
+                  timeout=None):
+    '''
+    Requests a message selection for each of the PEOs in `peos`,
+    using up to `concurrency` simultaneous requests over this
+    client's session. Returns a list with one entry per PEO, in the
+    same order as `peos`. Each entry is what :meth:`select` would have
+    returned for that PEO (i.e. a :class:`canarymd.Selection` or
+    ``None``) or, if the selection failed, a :class:`canarymd.Error`
+    instance describing the failure -- a failure for one PEO does
+    not abort the rest of the batch.
+
+    See :meth:`iselect_many` for a version that yields results as
+    they become available.
+    '''
+    return [
+      result for idx, result in self.iselect_many(
+        context, peos, concurrency=concurrency, timeout=timeout, ordered=True)]
+
+  #----------------------------------------------------------------------------
+  def iselect_many(self, context, peos, concurrency=DEFAULT_CONCURRENCY,
+                   timeout=None, ordered=False):
+    '''
+    Generator version of :meth:`select_many`: yields ``(index,
+    result)`` tuples, where `index` is the position of the PEO in
+    `peos` and `result` is as described in :meth:`select_many`.
+
+    By default, results are yielded as soon as they complete. If
+    `ordered` is truthy, they are yielded in the same order as
+    `peos`. In both cases, `peos` may be any iterable (including a
+    generator) and is only consumed as fast as the selections
+    complete, i.e. memory usage is bounded by `concurrency` and not
+    by the number of PEOs.
+    '''
+    def _select(peo):
+      return _trySelect(self, context, peo, timeout)
+    return _imap(_select, peos, concurrency, ordered)
+
+  #----------------------------------------------------------------------------
+  def validate(self, context, peos, timeout=None, reasons=False):
+    '''
+    Validates selection requests for each of the PEOs in `peos`
+    without sending them, and returns a list with one entry per PEO:
+    ``None`` if it is valid, otherwise a
+    :class:`canarymd.ValidationError` whose `fields` attribute
+    describes the problems. If `reasons` is truthy, appointment
+    reason codes are checked against the reasons-for-visit catalogue,
+    which is fetched if necessary (once for the whole batch);
+    otherwise they are only checked if the catalogue is already
+    loaded.
+    '''
+    if reasons:
+      self._refreshReasons()
+    lookup = self._reasonLookup()
+    ret = []
+    for peo in peos:
+      errors = _selectionErrors(context, peo, timeout, lookup)
+      ret.append(ValidationError(errors) if errors else None)
+    return ret
+
+  #----------------------------------------------------------------------------
+  def _reasonLookup(self):
+    # reason codes can only be checked once the catalogue is loaded
+    if self._reasons.reasons is None:
       return None
-    return Selection(jdat)
+    return self._reasons.get
 
   #----------------------------------------------------------------------------
-  def reasons(self):
+  def reasons(self, prefix=None, refresh=False):
     '''
     Returns the list of all known reasons-for-visit known to Canary.
+    If `prefix` is specified, only the reasons whose code starts with
+    `prefix` are returned, e.g. ``client.reasons('us/namcs:')``.
+
+    The catalogue is cached for `reasons_ttl` seconds (see
+    :class:`canarymd.Client`); if `refresh` is truthy, it is
+    re-validated with the server immediately.
     '''
-    res = self._req('get', '/reason')
+    self._refreshReasons(force=refresh)
+    if prefix is not None:
+      return self._reasons.search(prefix)
+    return list(self._reasons.reasons)
+
+  #----------------------------------------------------------------------------
+  def reason(self, code):
+    '''
+    Returns the reason-for-visit with the specified `code` (e.g.
+    ``"us/namcs:5035.0"``), or ``None`` if there is no such reason.
+    '''
+    self._refreshReasons()
+    return self._reasons.get(code)
+
+  #----------------------------------------------------------------------------
+  def _refreshReasons(self, force=False):
+    # any refresh that finds another one in progress (forced or not)
+    # shares it: the catalogue is being re-validated either way
+    self._checkFork()
+    if self._flight is None or ( not force and self._reasons.fresh() ):
+      return self._reasons.refresh(self._fetchReasons, force=force)
+    if self._flight.do(
+        'reasons', self._reasons.refresh, self._fetchReasons, force=force)[1]:
+      self._count('coalesced')
+
+  #----------------------------------------------------------------------------
+  def _fetchReasons(self, headers):
+    # only actual fetches are observed, not catalogue lookups
+    with self._observe('reasons') as call:
+      res = self._req(
+        'get', '/reason', call=call, deadline=self._deadline(),
+        headers=headers)
+      if res.status_code == 304:
+        self._count('reasons_not_modified')
+        return None
+      if res.status_code != 200:
+        err = self._apiError(res)
+        log.error('reasons fetch failure: %s', err)
+        raise ProtocolError(err)
+      self._count('reasons_fetched')
+      reasons = self.codec.loads(res.content).get('reasons', [])
+      call.lap('parse')
+      return (
+        reasons,
+        res.headers.get('etag'),
+        res.headers.get('last-modified'),
+      )
+
+  #----------------------------------------------------------------------------
+  def cma_upload(self, source, name=None, chunk_size=DEFAULT_CMA_CHUNK_SIZE,
+                 concurrency=DEFAULT_CMA_CONCURRENCY):
+    '''
+    Uploads a CMA file to Canary in chunks of `chunk_size` bytes,
+    `concurrency` of them at a time, each with its own checksum. At
+    most about ``concurrency * chunk_size`` bytes of the file are held
+    in memory at once. If an earlier upload of the same file (i.e.
+    with the same `name`, size and checksum) was interrupted, only the
+    chunks that the server has not confirmed yet are sent. The
+    client's `call_timeout` limits each request (i.e. each chunk)
+    rather than the whole upload. See :mod:`canarymd.cma` for the
+    protocol.
+
+    Returns an object with the file's `id`, `name`, `size` and
+    `sha256` checksum, and the number of `chunks`, how many of those
+    were `sent` and how many had already been received before
+    (`resumed`).
+
+    :Parameters:
+
+    source : { str, file }
+
+      The name of the file to upload, or a seekable binary file-like
+      object.
+
+    name : str, optional, default: null
+
+      The name of the file on the server; defaults to the file name of
+      `source`, without its directory.
+
+    chunk_size : int, optional, default: 4194304
+
+      The size of the chunks; the server may choose a different size,
+      e.g. when an upload is resumed.
+
+    concurrency : int, optional, default: 4
+
+      The number of chunks to send simultaneously.
+    '''
+    fp = open(source, 'rb') if isinstance(source, six.string_types) \
+      else source
+    try:
+      if name is None:
+        name = getattr(fp, 'name', None)
+        if not isinstance(name, six.string_types):
+          raise ValueError('a name is required for anonymous files')
+        name = os.path.basename(name)
+      with self._observe('cma_upload') as call:
+        return self._cmaUpload(fp, name, chunk_size, concurrency, call)
+    finally:
+      if fp is not source:
+        fp.close()
+
+  #----------------------------------------------------------------------------
+  def _cmaUpload(self, fp, name, chunk_size, concurrency, call):
+    size, digest = fileDigest(fp)
+    call.lap('checksum')
+    res = self._req('post', '/cma', dict(upload=dict(
+      name=name, size=size, sha256=digest, chunk_size=chunk_size)),
+      deadline=self._deadline())
+    upload = self._cmaResult(res, 'upload')
+    chunks = ChunkedFile(fp, upload['chunk_size'], size)
+    received = set(upload.get('received') or [])
+    pending = [idx for idx in range(chunks.count) if idx not in received]
+    if received:
+      log.info('resuming upload %s of %r: %d of %d chunks received',
+               upload['id'], name, len(received), chunks.count)
+    def _put(index):
+      data = chunks.read(index)
+      res = self._req(
+        'put', '/cma/%s/chunk/%d' % (upload['id'], index), data, headers={
+          'content-type'  : 'application/octet-stream',
+          CHECKSUM_HEADER : sha256(data),
+        }, deadline=self._deadline())
+      self._cmaResult(res, 'chunk')
+      return len(data)
+    # the chunks that were confirmed before a failure are not sent
+    # again when the upload is resumed
+    for sent in self._cmaChunks(_put, pending, concurrency):
+      call.request_bytes += sent
+      self._count('cma_chunks_sent')
+    call.lap('network')
+    res = self._req(
+      'post', '/cma/%s/complete' % (upload['id'],), {},
+      deadline=self._deadline())
+    info = self._cmaResult(res, 'file')
+    call.lap('network')
+    return aadict(
+      id      = info['id'],
+      name    = name,
+      size    = size,
+      sha256  = digest,
+      chunks  = chunks.count,
+      sent    = len(pending),
+      resumed = len(received),
+    )
+
+  #----------------------------------------------------------------------------
+  def cma_download(self, file_id, path=None,
+                   concurrency=DEFAULT_CMA_CONCURRENCY):
+    '''
+    Downloads the CMA file `file_id` from Canary to `path` in chunks,
+    `concurrency` of them at a time, verifying the checksum of each
+    chunk and of the whole file. The file is assembled in ``path +
+    ".part"``, which is only renamed to `path` once it is complete,
+    and at most about ``concurrency * chunk_size`` bytes of it are
+    held in memory at once. If an earlier download was interrupted,
+    the chunks of the partial file that match their checksums are kept
+    and only the others are downloaded. As for :meth:`cma_upload`,
+    `call_timeout` limits each request rather than the whole
+    download. See :mod:`canarymd.cma` for the protocol.
+
+    Returns an object with the file's `id`, `name`, `size` and
+    `sha256` checksum, the `path` it was written to, and the number of
+    `chunks`, how many of those were `fetched` and how many were
+    already present (`resumed`).
+
+    :Parameters:
+
+    file_id : str
+
+      The ID of the file, as returned by :meth:`cma_upload`.
+
+    path : str, optional, default: null
+
+      The name of the file to write; defaults to the file's name on
+      the server, in the current directory.
+
+    concurrency : int, optional, default: 4
+
+      The number of chunks to download simultaneously.
+    '''
+    with self._observe('cma_download') as call:
+      res = self._req(
+        'get', '/cma/%s' % (file_id,), deadline=self._deadline())
+      info = self._cmaResult(res, 'file')
+      call.lap('network')
+      path = path or os.path.basename(info['name'])
+      partial = path + '.part'
+      mode = 'r+b' if os.path.exists(partial) else 'w+b'
+      with open(partial, mode) as fp:
+        fp.truncate(info['size'])
+        chunks = ChunkedFile(fp, info['chunk_size'], info['size'])
+        present = chunks.verified(info['chunks'])
+        call.lap('checksum')
+        pending = [idx for idx in range(chunks.count) if idx not in present]
+        if present:
+          log.info('resuming download of %s to %r: %d of %d chunks present',
+                   file_id, path, len(present), chunks.count)
+        def _get(index):
+          res = self._req(
+            'get', '/cma/%s/chunk/%d' % (file_id, index),
+            deadline=self._deadline())
+          if res.status_code != 200:
+            raise ProtocolError(self._apiError(res))
+          data = res.content
+          if sha256(data) != info['chunks'][index]:
+            raise ProtocolError(
+              'checksum mismatch in chunk %d of %s' % (index, file_id))
+          chunks.write(index, data)
+          return len(data)
+        for received in self._cmaChunks(_get, pending, concurrency):
+          call.response_bytes += received
+          self._count('cma_chunks_received')
+        call.lap('network')
+        fp.flush()
+        size, digest = fileDigest(fp)
+        call.lap('checksum')
+      if size != info['size'] or digest != info['sha256']:
+        os.unlink(partial)
+        raise ProtocolError('checksum mismatch in %s' % (file_id,))
+      if os.path.exists(path):
+        # `os.rename` does not replace existing files on windows
+        os.unlink(path)
+      os.rename(partial, path)
+    return aadict(
+      id      = info['id'],
+      name    = info['name'],
+      size    = size,
+      sha256  = digest,
+      path    = path,
+      chunks  = chunks.count,
+      fetched = len(pending),
+      resumed = len(present),
+    )
+
+  #----------------------------------------------------------------------------
+  def _cmaChunks(self, func, indices, concurrency):
+    # generator that yields ``func(index)`` for each of `indices`,
+    # calling it in parallel. After the first failure, no further
+    # chunks are started, but the ones in progress are waited for (so
+    # that none of them touches the file afterwards) before the error
+    # is raised.
+    errors = []
+    def _call(index):
+      return None if errors else func(index)
+    for _, res in _imap(
+        _call, (idx for idx in indices if not errors), concurrency, False):
+      if isinstance(res, Exception):
+        errors.append(res)
+      elif res is not None:
+        yield res
+    if errors:
+      raise errors[0]
+
+  #----------------------------------------------------------------------------
+  def _cmaResult(self, res, key):
+    # returns the `key` attribute of a successful CMA response
     if res.status_code != 200:
       err = self._apiError(res)
-      log.error('reasons fetch failure: %s', err)
+      log.error('CMA transfer failure: %s', err)
       raise ProtocolError(err)
-    return aadict.d2ar(res.json().get('reasons', []))
+    jdat = self.codec.loads(res.content)
+    if not isinstance(jdat, dict) or key not in jdat:
+      raise ProtocolError(
+        'unexpected error: no `%s` attribute in CMA response' % (key,))
+    return jdat[key]
+
+#------------------------------------------------------------------------------
+def _release(res):
+  # returns the connection of a (possibly streamed) response that will
+  # not be read to the pool
+  close = getattr(res, 'close', None)
+  if close is not None:
+    close()
+
+#------------------------------------------------------------------------------
+def _acquire(lock, deadline):
+  # waits for `lock`, but (where supported) no longer than `deadline`
+  if deadline is None or six.PY2:
+    lock.acquire()
+  elif not lock.acquire(timeout=deadline.check()):
+    raise TimeoutError('deadline of %ss exceeded' % (deadline.budget,))
+
+#------------------------------------------------------------------------------
+def _trySelect(client, context, peo, timeout):
+  # returns the selection or, if it failed, the `Error`
+  try:
+    return client.select(context, peo, timeout=timeout)
+  except Error as err:
+    return err
+  except Exception as err:
+    return Error('%s: %s' % (err.__class__.__name__, err))
 
+#------------------------------------------------------------------------------
+_STOP = object()
+def _imap(func, items, concurrency, ordered):
+  '''
+  Generator that calls `func` on each element of `items` using a pool
+  of `concurrency` threads and yields ``(index, result)`` tuples.
+  Exceptions raised by `func` are yielded as the result. At most
+  ``2 * concurrency`` items are pulled from `items` ahead of the
+  consumer.
+  '''
+  concurrency = max(1, int(concurrency or 1))
+  window  = concurrency * 2
+  inq     = queue.Queue()
+  outq    = queue.Queue()
+  def _worker():
+    while True:
+      job = inq.get()
+      if job is _STOP:
+        return
+      idx, item = job
+      try:
+        res = func(item)
+      except Exception as err:
+        res = err
+      outq.put((idx, res))
+  workers = []
+  for _ in range(concurrency):
+    thread = threading.Thread(target=_worker, name='canarymd-select')
+    thread.daemon = True
+    thread.start()
+    workers.append(thread)
+  items    = iter(items)
+  nextidx  = 0
+  yielded  = 0
+  buffered = {}
+  try:
+    while True:
+      while items is not None and nextidx - yielded < window:
+        try:
+          item = next(items)
+        except StopIteration:
+          items = None
+          break
+        inq.put((nextidx, item))
+        nextidx += 1
+      if yielded >= nextidx:
+        return
+      idx, res = outq.get()
+      if not ordered:
+        yielded += 1
+        yield idx, res
+        continue
+      buffered[idx] = res
+      while yielded in buffered:
+        res = buffered.pop(yielded)
+        yielded += 1
+        yield yielded - 1, res
+  finally:
+    for _ in workers:
+      inq.put(_STOP)
+
+#------------------------------------------------------------------------------
+class SelectionItem(object):
+  '''
+  One of the messages contained in a :class:`canarymd.Selection`.
+  The `channel_id` attribute is always available; all other attributes
+  of the item, as returned by the server, are parsed on first access
+  -- unless the selection was made in "compact" mode (see the
+  `compact` parameter of :class:`canarymd.Client`), in which case only
+  `channel_id` is retained.
+  '''
+
+  __slots__ = ('channel_id', '_data', '_attrs')
+
+  #----------------------------------------------------------------------------
+  def __init__(self, data, compact=False):
+    self.channel_id = data.get('channel_id')
+    self._data      = None if compact else data
+    self._attrs     = None
+
+  #----------------------------------------------------------------------------
+  def __getattr__(self, name):
+    # only called for attributes other than the slots; slots that have
+    # not been set yet (e.g. during unpickling) must not recurse
+    if name.startswith('_'):
+      raise AttributeError(name)
+    if self._attrs is None:
+      if self._data is None:
+        raise AttributeError(name)
+      self._attrs = aadict.d2ar(self._data)
+    try:
+      return self._attrs[name]
+    except KeyError:
+      raise AttributeError(name)
+
+  #----------------------------------------------------------------------------
+  def __getstate__(self):
+    return (self.channel_id, self._data)
+
+  #----------------------------------------------------------------------------
+  def __setstate__(self, state):
+    self.channel_id, self._data = state
+    self._attrs = None
+
+  #----------------------------------------------------------------------------
+  def __repr__(self):
+    return '<canarymd.SelectionItem channel_id=%r>' % (self.channel_id,)
 
 #------------------------------------------------------------------------------
 class Selection(object):
@@ -292,16 +1715,78 @@ class Selection(object):
 
   items : list
 
-    An itemized list of the messages contained in `content`. (Useful
-    for forensic purposes.)
+    An itemized list of the messages contained in `content`, as
+    :class:`canarymd.SelectionItem` objects. (Useful for forensic
+    purposes.)
+
+  data : aadict
+
+    The complete selection response, or ``None`` if the selection
+    was made in "compact" mode (see the `compact` parameter of
+    :class:`canarymd.Client`).
+
+  The `items` and `data` attributes are only converted from the raw
+  response when first accessed.
   '''
 
+  __slots__ = ('id', 'content', '_items', '_raw', '_data', '_compact')
+
+  #----------------------------------------------------------------------------
+  def __init__(self, data, compact=False):
+    self.id       = ( data.get('selection') or {} ).get('id')
+    self.content  = data.get('content')
+    self._items   = data.get('selectionitems') or []
+    self._raw     = None if compact else data
+    self._data    = None
+    self._compact = compact
+    if compact:
+      # only the channel IDs are retained, so convert them now and
+      # drop the rest of the response
+      self._items = [SelectionItem(item, compact=True) for item in self._items]
+
+  #----------------------------------------------------------------------------
+  @property
+  def items(self):
+    items = self._items
+    if items and not isinstance(items[0], SelectionItem):
+      items = self._items = [SelectionItem(item) for item in items]
+    return items
+
+  #----------------------------------------------------------------------------
+  @property
+  def data(self):
+    if self._data is None and self._raw is not None:
+      self._data = aadict.d2ar(self._raw)
+    return self._data
+
+  #----------------------------------------------------------------------------
+  def __getstate__(self):
+    items = self._items
+    if items and isinstance(items[0], SelectionItem):
+      items = [item.__getstate__() for item in items]
+      items = [dict(channel_id=cid) if data is None else data
+               for cid, data in items]
+    return dict(
+      id=self.id, content=self.content, items=items, raw=self._raw,
+      compact=self._compact)
+
+  #----------------------------------------------------------------------------
+  def __setstate__(self, state):
+    self.id       = state['id']
+    self.content  = state['content']
+    self._raw     = state['raw']
+    self._data    = None
+    self._compact = state['compact']
+    self._items   = state['items']
+    if self._compact:
+      self._items = [SelectionItem(item, compact=True) for item in self._items]
+    elif self._raw is not None:
+      # share the item data with the raw response again
+      self._items = self._raw.get('selectionitems') or []
+
   #----------------------------------------------------------------------------
-  def __init__(self, data):
-    self._data   = aadict.d2ar(data)
-    self.id      = self._data.selection.id
-    self.items   = self._data.selectionitems
-    self.content = self._data.content
+  def __repr__(self):
+    return '<canarymd.Selection id=%r>' % (self.id,)
 
 #------------------------------------------------------------------------------
 # end of $Id$
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Support for chunked CMA file transfers, see
+:meth:`canarymd.Client.cma_upload` and
+:meth:`canarymd.Client.cma_download`. Files are transferred in
+fixed-size chunks, several at a time, each with its own SHA-256
+checksum in the ``X-Checksum-SHA256`` header, using these endpoints:
+
+* ``POST /cma`` with ``{"upload": {"name", "size", "sha256",
+  "chunk_size"}}`` starts an upload or, if an unfinished upload of the
+  same file exists, resumes it; the response's `upload` has its `id`,
+  the `chunk_size` in effect and the indices of the chunks already
+  `received`.
+
+* ``PUT /cma/{id}/chunk/{index}`` uploads a chunk; the server rejects
+  it with ``400 Bad Request`` if its checksum does not match.
+
+* ``POST /cma/{id}/complete`` finishes an upload once all chunks have
+  been received and returns the `file`.
+
+* ``GET /cma/{id}`` returns the `file` with its `name`, `size`,
+  `sha256`, `chunk_size` and the checksum of each of its `chunks`.
+
+* ``GET /cma/{id}/chunk/{index}`` downloads a chunk.
+'''
+
+import hashlib
+import threading
+
+#------------------------------------------------------------------------------
+DEFAULT_CMA_CHUNK_SIZE  = 4 * 1024 * 1024
+DEFAULT_CMA_CONCURRENCY = 4
+CHECKSUM_HEADER         = 'x-checksum-sha256'
+
+# the block size for hashing whole files
+_BLOCK_SIZE = 64 * 1024
+
+#------------------------------------------------------------------------------
+def sha256(data):
+  return hashlib.sha256(data).hexdigest()
+
+#------------------------------------------------------------------------------
+def chunkCount(size, chunk_size):
+  '''
+  Returns the number of `chunk_size` chunks of a file of `size` bytes.
+  '''
+  return ( size + chunk_size - 1 ) // chunk_size
+
+#------------------------------------------------------------------------------
+def fileDigest(fp):
+  '''
+  Returns the size and SHA-256 checksum of the seekable binary file
+  object `fp`, which is read in blocks.
+  '''
+  digest = hashlib.sha256()
+  size = 0
+  fp.seek(0)
+  for block in iter(lambda: fp.read(_BLOCK_SIZE), b''):
+    digest.update(block)
+    size += len(block)
+  return size, digest.hexdigest()
+
+#------------------------------------------------------------------------------
+class ChunkedFile(object):
+  '''
+  Thread-safe reads and writes of the fixed-size chunks of the
+  seekable binary file object `fp`, of a file of `size` bytes.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, fp, chunk_size, size):
+    self.fp         = fp
+    self.chunk_size = chunk_size
+    self.size       = size
+    self.count      = chunkCount(size, chunk_size)
+    self._lock      = threading.Lock()
+
+  #----------------------------------------------------------------------------
+  def read(self, index):
+    with self._lock:
+      self.fp.seek(index * self.chunk_size)
+      return self.fp.read(self.chunk_size)
+
+  #----------------------------------------------------------------------------
+  def write(self, index, data):
+    with self._lock:
+      self.fp.seek(index * self.chunk_size)
+      self.fp.write(data)
+
+  #----------------------------------------------------------------------------
+  def verified(self, checksums):
+    '''
+    Returns the set of the indices of the chunks whose current content
+    matches their checksum in `checksums`, i.e. that need not be
+    transferred again. Chunks are read one at a time.
+    '''
+    ret = set()
+    for index, checksum in enumerate(checksums[:self.count]):
+      data = self.read(index)
+      expected = min(self.chunk_size, self.size - index * self.chunk_size)
+      if len(data) == expected and sha256(data) == checksum:
+        ret.add(index)
+    return ret
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Pluggable JSON encoding and decoding, see the `codec` parameter of
+:class:`canarymd.Client`. The fastest available backend is used by
+default: ``orjson``, then ``ujson``, then the standard library's
+``json`` module. All codecs encode to and decode from UTF-8 bytes.
+'''
+
+import json
+
+import six
+
+#------------------------------------------------------------------------------
+BACKENDS = ('orjson', 'ujson', 'json')
+
+#------------------------------------------------------------------------------
+class Codec(object):
+  '''
+  A JSON codec. Subclasses implement :meth:`dumps` and :meth:`loads`.
+  '''
+
+  name = None
+
+  #----------------------------------------------------------------------------
+  def dumps(self, obj):
+    '''
+    Returns the compact JSON encoding of `obj` as UTF-8 bytes.
+    '''
+    raise NotImplementedError()
+
+  #----------------------------------------------------------------------------
+  def loads(self, data):
+    '''
+    Decodes the JSON document `data` (bytes or text).
+    '''
+    raise NotImplementedError()
+
+  #----------------------------------------------------------------------------
+  def __repr__(self):
+    return '<canarymd.Codec %s>' % (self.name,)
+
+#------------------------------------------------------------------------------
+class StdlibCodec(Codec):
+
+  name = 'json'
+
+  #----------------------------------------------------------------------------
+  def dumps(self, obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+  #----------------------------------------------------------------------------
+  def loads(self, data):
+    if isinstance(data, six.binary_type) and not six.PY2:
+      data = data.decode('utf-8')
+    return json.loads(data)
+
+#------------------------------------------------------------------------------
+class OrjsonCodec(StdlibCodec):
+
+  name = 'orjson'
+
+  #----------------------------------------------------------------------------
+  def __init__(self):
+    import orjson
+    self._dumps = orjson.dumps
+    self._loads = orjson.loads
+
+  #----------------------------------------------------------------------------
+  def dumps(self, obj):
+    try:
+      return self._dumps(obj)
+    except TypeError:
+      # e.g. non-string dictionary keys, which the standard library
+      # converts
+      return StdlibCodec.dumps(self, obj)
+
+  #----------------------------------------------------------------------------
+  def loads(self, data):
+    return self._loads(data)
+
+#------------------------------------------------------------------------------
+class UjsonCodec(StdlibCodec):
+
+  name = 'ujson'
+
+  #----------------------------------------------------------------------------
+  def __init__(self):
+    import ujson
+    self._dumps = ujson.dumps
+    self._loads = ujson.loads
+
+  #----------------------------------------------------------------------------
+  def dumps(self, obj):
+    try:
+      return self._dumps(obj).encode('utf-8')
+    except (TypeError, OverflowError):
+      return StdlibCodec.dumps(self, obj)
+
+  #----------------------------------------------------------------------------
+  def loads(self, data):
+    return self._loads(data)
+
+#------------------------------------------------------------------------------
+_classes = dict(orjson=OrjsonCodec, ujson=UjsonCodec, json=StdlibCodec)
+_codecs  = dict()
+_default = None
+
+#------------------------------------------------------------------------------
+def available():
+  '''
+  Returns the names of the installed backends, fastest first.
+  '''
+  ret = []
+  for name in BACKENDS:
+    try:
+      getCodec(name)
+    except ImportError:
+      continue
+    ret.append(name)
+  return ret
+
+#------------------------------------------------------------------------------
+def getCodec(name=None):
+  '''
+  Returns the (shared) codec for the backend `name`, or the fastest
+  available one if `name` is ``None``. Raises ImportError if the
+  backend is not installed and ValueError if it is unknown.
+  '''
+  global _default
+  if isinstance(name, Codec):
+    return name
+  if name is None:
+    if _default is None:
+      _default = getCodec(available()[0])
+    return _default
+  if name not in _classes:
+    raise ValueError('invalid/unknown JSON backend: %r' % (name,))
+  if name not in _codecs:
+    _codecs[name] = _classes[name]()
+  return _codecs[name]
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+The constants of the Canary API. This module has no dependencies, so
+that it can be imported (e.g. by the command-line interface) without
+loading the HTTP stack.
+'''
+
+#------------------------------------------------------------------------------
+DEFAULT_CONCURRENCY = 8
+
+#------------------------------------------------------------------------------
+class Purpose:
+  DISCOVER        = 'discover'
+  PREPARE         = 'prepare'
+  AUGMENT         = 'augment'
+  EXTEND          = 'extend'
+  ALL             = (DISCOVER, PREPARE, AUGMENT, EXTEND)
+
+#------------------------------------------------------------------------------
+class Transport:
+  SITE            = 'site'
+  EMAIL           = 'email'
+  PAPER           = 'paper'
+  SMS             = 'sms'
+  VOICE           = 'voice'
+  ALL             = (SITE, EMAIL, PAPER, SMS, VOICE)
+
+#------------------------------------------------------------------------------
+class Environment:
+  DEV             =  'dev'
+  TEST            =  'test'
+  CI              =  'ci'
+  QA              =  'qa'
+  UAT             =  'uat'
+  PPE             =  'ppe'
+  STG             =  'stg'
+  PROD            =  'prod'
+  ALL             = (DEV, TEST, CI, QA, UAT, PPE, STG, PROD)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
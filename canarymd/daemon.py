@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+A persistent selection daemon for the command-line interface.
+``canarymd serve`` runs a :class:`Daemon`, which keeps a warm,
+authenticated :class:`canarymd.Client` and accepts selection requests
+on a local Unix socket. Later ``canarymd select`` invocations send
+their request to the daemon (see :func:`request`) instead of
+importing the HTTP stack, negotiating the API version and logging in
+themselves.
+
+Each connection carries a single request and its response, each a
+line of JSON. The socket is only accessible to the user that started
+the daemon, and requests that specify a different principal,
+credential or partner than the daemon's are rejected.
+
+This module only imports :mod:`canarymd.client` when a daemon is
+created, so that clients of the daemon start quickly.
+'''
+
+import collections
+import errno
+import hashlib
+import hmac
+import json
+import logging
+import os
+import socket
+import threading
+
+from six.moves import socketserver
+
+#------------------------------------------------------------------------------
+
+log = logging.getLogger(__name__)
+
+#------------------------------------------------------------------------------
+def available():
+  '''
+  Returns true if Unix sockets, and therefore daemons, are supported.
+  '''
+  return hasattr(socket, 'AF_UNIX')
+
+#------------------------------------------------------------------------------
+def socketPath(env, root=None, principal=None, partner=None):
+  '''
+  Returns the default socket path of the daemon for `principal` (and
+  `partner`) on the `env` environment (or at `root`): a file in the
+  user's runtime directory or, if there is none, in a private
+  directory in the temporary directory.
+  '''
+  base = os.environ.get('XDG_RUNTIME_DIR')
+  if base:
+    base = os.path.join(base, 'canarymd')
+  else:
+    import getpass
+    import tempfile
+    # `os.getuid` is not available on all platforms
+    user = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+    base = os.path.join(tempfile.gettempdir(), 'canarymd-%s' % (user,))
+  key = '\0'.join([env or '', root or '', principal or '', partner or ''])
+  key = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+  return os.path.join(base, key + '.sock')
+
+#------------------------------------------------------------------------------
+def request(path, message, timeout=None):
+  '''
+  Sends the request `message` (a JSON-serializable dictionary) to the
+  daemon listening on `path` and returns its response, or ``None`` if
+  no daemon is listening there. `timeout` limits each socket
+  operation; ``socket.error`` is raised if the daemon fails to
+  respond.
+  '''
+  if not available():
+    return None
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.settimeout(timeout)
+    try:
+      sock.connect(path)
+    except socket.error as err:
+      if err.errno in (errno.ENOENT, errno.ECONNREFUSED):
+        return None
+      raise
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+    with sock.makefile('rb') as fp:
+      line = fp.readline()
+  finally:
+    sock.close()
+  if not line.endswith(b'\n'):
+    raise socket.error(errno.ECONNRESET, 'incomplete response from daemon')
+  return json.loads(line.decode('utf-8'))
+
+#------------------------------------------------------------------------------
+class Daemon(object):
+  '''
+  Serves selections to local processes on the Unix socket `path` with
+  a single, shared :class:`canarymd.Client`. Use :meth:`serve` to run
+  it in the current thread, or :meth:`start` and :meth:`stop` (or use
+  it as a context manager) to run it in a background thread.
+
+  :Parameters:
+
+  path : str
+
+    The path of the socket, see :func:`socketPath`. Its directory is
+    created if needed, with owner-only permissions. A stale socket
+    left behind by a daemon that did not shut down cleanly is
+    replaced; if another daemon is listening on it, an ``IOError`` is
+    raised.
+
+  principal, credential : str
+
+    The credentials to authenticate with, as for
+    :class:`canarymd.Client`.
+
+  options : dict
+
+    Any other keyword arguments are passed to the
+    :class:`canarymd.Client` constructor.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, path, principal, credential, **options):
+    # deferred, see the module documentation
+    from .client import Client, Error
+    if not available():
+      raise IOError('Unix sockets are not supported on this platform')
+    self.path     = path
+    self.client   = Client(principal, credential, **options)
+    self.stats    = collections.Counter()
+    self._error   = Error
+    self._lock    = threading.Lock()
+    self._server  = None
+    self._thread  = None
+
+  #----------------------------------------------------------------------------
+  def _listen(self):
+    # the client is authenticated first, so that bad credentials are
+    # reported before anything is served
+    self.client.authenticate()
+    dirname = os.path.dirname(self.path)
+    if dirname and not os.path.isdir(dirname):
+      os.makedirs(dirname, 0o700)
+    if os.path.exists(self.path):
+      if request(self.path, dict(command='ping'), timeout=1) is not None:
+        raise IOError('a daemon is already listening on %r' % (self.path,))
+      os.unlink(self.path)
+    umask = os.umask(0o177)
+    try:
+      self._server = _UnixServer(self.path, _Handler)
+    finally:
+      os.umask(umask)
+    self._server.daemon = self
+    log.info('serving selections on %r', self.path)
+
+  #----------------------------------------------------------------------------
+  def _close(self):
+    self._server.server_close()
+    try:
+      os.unlink(self.path)
+    except OSError:
+      pass
+
+  #----------------------------------------------------------------------------
+  def serve(self):
+    '''
+    Serves requests in the current thread until interrupted.
+    '''
+    self._listen()
+    try:
+      self._server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self._close()
+
+  #----------------------------------------------------------------------------
+  def start(self):
+    self._listen()
+    self._thread = threading.Thread(
+      target=self._server.serve_forever, kwargs=dict(poll_interval=0.05),
+      name='canarymd-daemon')
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  #----------------------------------------------------------------------------
+  def stop(self):
+    self._server.shutdown()
+    self._thread.join()
+    self._close()
+
+  #----------------------------------------------------------------------------
+  def __enter__(self):
+    return self.start()
+
+  #----------------------------------------------------------------------------
+  def __exit__(self, *exc_info):
+    self.stop()
+
+  #----------------------------------------------------------------------------
+  def _count(self, name):
+    with self._lock:
+      self.stats[name] += 1
+
+  #----------------------------------------------------------------------------
+  def _accepts(self, message):
+    # requests may omit the credentials, but not specify other ones,
+    # and must be for the same partner
+    for key in ('principal', 'credential'):
+      value = message.get(key)
+      if value is not None and not hmac.compare_digest(
+          value.encode('utf-8'),
+          ( getattr(self.client, key) or '' ).encode('utf-8')):
+        return False
+    return message.get('partner') == self.client.partner
+
+  #----------------------------------------------------------------------------
+  def dispatch(self, message):
+    '''
+    Returns the response to the request `message`: a dictionary with
+    the `status` (``"ok"``, ``"error"`` or, if the request is for
+    another principal or partner, ``"rejected"``) and either the
+    `selection` (its `id`, `items` and `content`, or ``None``) or an
+    `error` message.
+    '''
+    command = message.get('command')
+    if command == 'ping':
+      return dict(status='ok')
+    if command != 'select':
+      return dict(status='error', error='unknown command: %r' % (command,))
+    if not self._accepts(message):
+      self._count('rejected')
+      return dict(status='rejected', error='principal/credential mismatch')
+    self._count('selections')
+    try:
+      selection = self.client.select(
+        message.get('context'), message.get('peo'),
+        timeout=message.get('timeout'))
+    except self._error as err:
+      self._count('errors')
+      return dict(status='error', error=str(err))
+    if selection is None:
+      return dict(status='ok', selection=None)
+    return dict(status='ok', selection=dict(
+      id      = selection.id,
+      items   = [item.channel_id for item in selection.items],
+      content = selection.content,
+    ))
+
+#------------------------------------------------------------------------------
+if available():
+  # `socketserver.UnixStreamServer` only exists where Unix sockets do
+  class _UnixServer(
+      socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads      = True
+
+#------------------------------------------------------------------------------
+class _Handler(socketserver.StreamRequestHandler):
+
+  #----------------------------------------------------------------------------
+  def handle(self):
+    line = self.rfile.readline()
+    try:
+      message = json.loads(line.decode('utf-8'))
+      if not isinstance(message, dict):
+        raise ValueError('not an object')
+    except ValueError as err:
+      response = dict(status='error', error='invalid request: %s' % (err,))
+    else:
+      try:
+        response = self.server.daemon.dispatch(message)
+      except Exception as err:
+        log.exception('failed to process request')
+        response = dict(
+          status='error', error='%s: %s' % (err.__class__.__name__, err))
+    try:
+      self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+    except socket.error:
+      # the client gave up (e.g. after a timeout)
+      pass
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
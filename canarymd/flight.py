@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Request coalescing, see the `single_flight` parameter of
+:class:`canarymd.Client`: while a call with a given key is in
+progress, threads making a call with the same key wait for it and
+share its result (or exception) instead of repeating the work.
+'''
+
+import threading
+
+#------------------------------------------------------------------------------
+class _Flight(object):
+  __slots__ = ('done', 'result', 'error')
+  def __init__(self):
+    self.done     = threading.Event()
+    self.result   = None
+    self.error    = None
+
+#------------------------------------------------------------------------------
+class SingleFlight(object):
+  '''
+  Coalesces concurrent calls with the same key into a single call.
+  Keys are only coalesced while a call is in progress; nothing is
+  remembered once it completes.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self):
+    self._lock    = threading.Lock()
+    self._flights = {}
+
+  #----------------------------------------------------------------------------
+  def do(self, key, func, *args, **kw):
+    '''
+    Calls ``func(*args, **kw)``, unless a call for `key` is already in
+    progress, in which case this waits for that call to complete
+    instead. Returns a tuple of ``(result, shared)``, where `shared` is
+    truthy if the result came from another thread's call. If the call
+    raises an exception, the same exception is raised in all threads
+    that waited for it.
+    '''
+    with self._lock:
+      flight = self._flights.get(key)
+      leader = flight is None
+      if leader:
+        flight = self._flights[key] = _Flight()
+    if not leader:
+      flight.done.wait()
+      if flight.error is not None:
+        raise flight.error
+      return flight.result, True
+    try:
+      flight.result = func(*args, **kw)
+    except BaseException as err:
+      flight.error = err
+      raise
+    finally:
+      with self._lock:
+        del self._flights[key]
+      flight.done.set()
+    return flight.result, False
+
+  #----------------------------------------------------------------------------
+  def __len__(self):
+    '''
+    Returns the number of calls currently in progress.
+    '''
+    with self._lock:
+      return len(self._flights)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Client-side instrumentation, see the `observers` parameter of
+:class:`canarymd.Client`. Each API call made by a client (e.g.
+:meth:`canarymd.Client.select`) is described by a :class:`Call`
+object, which is passed to the :meth:`Observer.observe` method of all
+of the client's observers when the call completes:
+
+.. code-block:: python
+
+   metrics = canarymd.MetricsCollector()
+   client  = canarymd.Client(..., observers=[metrics])
+   ...
+   print(metrics.prometheus())
+'''
+
+import bisect
+import collections
+import logging
+import threading
+import timeit
+
+from six.moves import BaseHTTPServer
+
+#------------------------------------------------------------------------------
+
+log = logging.getLogger(__name__)
+
+_timer = timeit.default_timer
+
+#------------------------------------------------------------------------------
+DEFAULT_BUCKETS = (
+  0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+#------------------------------------------------------------------------------
+class Call(object):
+  '''
+  The record of a single API call.
+
+  :Attributes:
+
+  operation : str
+
+    The client method, e.g. ``"select"``, ``"reasons"``, ``"version"``
+    or ``"authenticate"``.
+
+  status : int
+
+    The HTTP status of the (last) response, or ``None`` if no request
+    was sent (e.g. for a selection cache hit) or none completed.
+
+  error : str
+
+    The name of the exception class if the call failed, otherwise
+    ``None``.
+
+  duration : float
+
+    The total number of seconds spent in the call.
+
+  phases : dict
+
+    The number of seconds spent in each phase of the call:
+    ``"cache"`` (selection cache lookup), ``"version"`` (API version
+    negotiation), ``"auth"`` (logging in), ``"serialize"`` (encoding
+    the request), ``"network"`` (sending the request and receiving
+    the response, including retries), ``"reauth"`` (re-authenticating
+    after the server rejected the session), ``"parse"`` (decoding
+    the response) and, for CMA file transfers, ``"checksum"``
+    (hashing the file). Phases that did not occur are omitted.
+
+  request_bytes, response_bytes : int
+
+    The size of the request and response bodies.
+
+  retries : int
+
+    The number of times a request was re-sent by the retry policy.
+
+  cache : str
+
+    ``"hit"`` or ``"miss"`` if the selection cache was consulted,
+    otherwise ``None``.
+  '''
+
+  __slots__ = (
+    'operation', 'status', 'error', 'start', 'duration', 'phases',
+    'request_bytes', 'response_bytes', 'retries', 'cache', '_last')
+
+  #----------------------------------------------------------------------------
+  def __init__(self, operation):
+    self.operation      = operation
+    self.status         = None
+    self.error          = None
+    self.start          = self._last = _timer()
+    self.duration       = None
+    self.phases         = {}
+    self.request_bytes  = 0
+    self.response_bytes = 0
+    self.retries        = 0
+    self.cache          = None
+
+  #----------------------------------------------------------------------------
+  def lap(self, phase):
+    '''
+    Attributes the time since the previous lap (or the start of the
+    call) to `phase`. If `phase` is ``None``, the time is only
+    included in the call's `duration`.
+    '''
+    now = _timer()
+    if phase is not None:
+      self.phases[phase] = self.phases.get(phase, 0) + now - self._last
+    self._last = now
+
+  #----------------------------------------------------------------------------
+  def finish(self):
+    self.duration = _timer() - self.start
+
+  #----------------------------------------------------------------------------
+  def __repr__(self):
+    return '<canarymd.Call %s status=%r duration=%r phases=%r>' % (
+      self.operation, self.status, self.duration, self.phases)
+
+#------------------------------------------------------------------------------
+class Observer(object):
+  '''
+  The interface for client instrumentation: subclasses override
+  :meth:`observe`, which is called once per completed API call (in
+  the thread that made it) and must therefore be thread-safe and
+  fast. Exceptions raised by observers are logged and ignored.
+  '''
+
+  #----------------------------------------------------------------------------
+  def observe(self, call):
+    '''
+    Called with the :class:`canarymd.Call` record of each completed
+    API call.
+    '''
+    pass
+
+#------------------------------------------------------------------------------
+class Histogram(object):
+  '''
+  A cumulative histogram of observed values with fixed bucket upper
+  bounds (in the style of Prometheus).
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, buckets=DEFAULT_BUCKETS):
+    self.buckets = tuple(sorted(buckets))
+    self.counts  = [0] * ( len(self.buckets) + 1 )
+    self.count   = 0
+    self.sum     = 0.0
+
+  #----------------------------------------------------------------------------
+  def add(self, value):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.count += 1
+    self.sum   += value
+
+  #----------------------------------------------------------------------------
+  def quantile(self, q):
+    '''
+    Returns an estimate of the `q`-quantile (e.g. ``0.99``) of the
+    observed values by linear interpolation within its bucket, or
+    ``None`` if there are none.
+    '''
+    if not self.count:
+      return None
+    rank  = q * self.count
+    total = 0
+    for idx, count in enumerate(self.counts):
+      if count and total + count >= rank:
+        lower = self.buckets[idx - 1] if idx > 0 else 0
+        if idx >= len(self.buckets):
+          return lower
+        return lower + ( self.buckets[idx] - lower ) * ( rank - total ) / count
+      total += count
+    return self.buckets[-1]
+
+#------------------------------------------------------------------------------
+class MetricsCollector(Observer):
+  '''
+  An :class:`Observer` that aggregates calls in memory: histograms of
+  call durations (per operation and status) and phase durations (per
+  operation and phase), and counters of bytes sent and received,
+  retries, cache lookups and errors. The aggregates can be retrieved
+  with :meth:`snapshot` or in the Prometheus text exposition format
+  with :meth:`prometheus`.
+
+  :Parameters:
+
+  buckets : list(float), optional
+
+    The upper bounds (in seconds) of the histogram buckets.
+
+  prefix : str, optional, default: "canarymd"
+
+    The prefix of the exported metric names.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, buckets=DEFAULT_BUCKETS, prefix='canarymd'):
+    self.buckets   = buckets
+    self.prefix    = prefix
+    self.calls     = {}
+    self.phases    = {}
+    self.counters  = collections.Counter()
+    self._lock     = threading.Lock()
+
+  #----------------------------------------------------------------------------
+  def _histogram(self, table, key):
+    ret = table.get(key)
+    if ret is None:
+      ret = table[key] = Histogram(self.buckets)
+    return ret
+
+  #----------------------------------------------------------------------------
+  def observe(self, call):
+    op     = call.operation
+    status = str(call.status) if call.status is not None else 'none'
+    with self._lock:
+      self._histogram(self.calls, (op, status)).add(call.duration)
+      for phase, seconds in call.phases.items():
+        self._histogram(self.phases, (op, phase)).add(seconds)
+      counters = self.counters
+      counters[('request_bytes', op)]  += call.request_bytes
+      counters[('response_bytes', op)] += call.response_bytes
+      if call.retries:
+        counters[('retries', op)] += call.retries
+      if call.cache:
+        counters[('cache', op, call.cache)] += 1
+      if call.error:
+        counters[('errors', op, call.error)] += 1
+
+  #----------------------------------------------------------------------------
+  def reset(self):
+    with self._lock:
+      self.calls    = {}
+      self.phases   = {}
+      self.counters = collections.Counter()
+
+  #----------------------------------------------------------------------------
+  def snapshot(self):
+    '''
+    Returns a dictionary summarizing the collected metrics, with the
+    call count, mean, p50 and p99 durations per ``operation/status``
+    and ``operation/phase``, and the counters.
+    '''
+    def _summary(hist):
+      return dict(
+        count = hist.count,
+        mean  = hist.sum / hist.count if hist.count else None,
+        p50   = hist.quantile(0.5),
+        p99   = hist.quantile(0.99),
+      )
+    with self._lock:
+      return dict(
+        calls    = dict(
+          ('/'.join(key), _summary(hist)) for key, hist in self.calls.items()),
+        phases   = dict(
+          ('/'.join(key), _summary(hist)) for key, hist in self.phases.items()),
+        counters = dict(
+          ('/'.join(key), value) for key, value in self.counters.items()),
+      )
+
+  #----------------------------------------------------------------------------
+  def prometheus(self):
+    '''
+    Returns the collected metrics in the Prometheus text exposition
+    format (version 0.0.4).
+    '''
+    out = []
+    with self._lock:
+      self._exportHistograms(
+        out, 'call_duration_seconds', 'Duration of canarymd API calls.',
+        self.calls, ('operation', 'status'))
+      self._exportHistograms(
+        out, 'phase_duration_seconds', 'Duration of canarymd API call phases.',
+        self.phases, ('operation', 'phase'))
+      for name, labels, text in _COUNTERS:
+        items = sorted(
+          (key[1:], value) for key, value in self.counters.items()
+          if key[0] == name)
+        if not items:
+          continue
+        metric = '%s_%s_total' % (self.prefix, name)
+        out.append('# HELP %s %s' % (metric, text))
+        out.append('# TYPE %s counter' % (metric,))
+        for key, value in items:
+          out.append('%s{%s} %s' % (metric, _labels(labels, key), value))
+    return '\n'.join(out) + '\n'
+
+  #----------------------------------------------------------------------------
+  def _exportHistograms(self, out, name, text, table, labels):
+    if not table:
+      return
+    metric = '%s_%s' % (self.prefix, name)
+    out.append('# HELP %s %s' % (metric, text))
+    out.append('# TYPE %s histogram' % (metric,))
+    for key in sorted(table):
+      hist  = table[key]
+      label = _labels(labels, key)
+      total = 0
+      for bound, count in zip(hist.buckets, hist.counts):
+        total += count
+        out.append('%s_bucket{%s,le="%s"} %d' % (
+          metric, label, _number(bound), total))
+      out.append('%s_bucket{%s,le="+Inf"} %d' % (metric, label, hist.count))
+      out.append('%s_sum{%s} %s' % (metric, label, _number(hist.sum)))
+      out.append('%s_count{%s} %d' % (metric, label, hist.count))
+
+  #----------------------------------------------------------------------------
+  def serve(self, port, address=''):
+    '''
+    Starts a daemon thread that serves :meth:`prometheus` over HTTP
+    on `address`:`port` (for any path) and returns the server object;
+    call its ``shutdown()`` method to stop it.
+    '''
+    collector = self
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+      def do_GET(self):
+        body = collector.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+      def log_message(self, *args):
+        pass
+    server = BaseHTTPServer.HTTPServer((address, port), Handler)
+    thread = threading.Thread(
+      target=server.serve_forever, name='canarymd-metrics')
+    thread.daemon = True
+    thread.start()
+    return server
+
+#------------------------------------------------------------------------------
+_COUNTERS = (
+  ('request_bytes',   ('operation',),           'Request body bytes sent.'),
+  ('response_bytes',  ('operation',),           'Response body bytes received.'),
+  ('retries',         ('operation',),           'Requests re-sent by the retry policy.'),
+  ('cache',           ('operation', 'result'),  'Selection cache lookups.'),
+  ('errors',          ('operation', 'error'),   'Failed API calls.'),
+)
+
+#------------------------------------------------------------------------------
+def _labels(names, values):
+  return ','.join(
+    '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+    for name, value in zip(names, values))
+
+#------------------------------------------------------------------------------
+def _number(value):
+  return repr(float(value)) if value != int(value) else '%d' % (value,)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
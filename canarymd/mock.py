@@ -0,0 +1,614 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+A local stand-in for the Canary API, for testing and benchmarking
+clients without access to the Canary servers. It implements the
+``/version``, ``/auth/session``, ``/selection`` and ``/reason``
+endpoints of both API versions, and the chunked CMA file transfer
+endpoints (see :mod:`canarymd.cma`), with configurable latency, error
+rate, session expiry and payload size:
+
+.. code-block:: python
+
+   with canarymd.mock.MockServer(latency=0.01) as server:
+     client = canarymd.Client('user', 'pass', root=server.root)
+     ...
+
+It can also be run stand-alone with ``python -m canarymd.mock``.
+'''
+
+from __future__ import print_function
+
+import argparse
+import collections
+import hashlib
+import re
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves import http_cookies
+
+from .constants import Transport, Purpose
+from .cma import CHECKSUM_HEADER, chunkCount
+
+#------------------------------------------------------------------------------
+SERVER_VERSION = 'mock-1.0.0'
+
+DEFAULT_REASONS = [
+  {'code': 'us/namcs:%d.0' % (code,), 'label': 'Reason %d' % (code,)}
+  for code in range(1000, 1100)]
+
+_CMA_ROUTE = re.compile(r'^cma(?:/([0-9a-f]+)(?:/(complete|chunk/(\d+)))?)?$')
+
+#------------------------------------------------------------------------------
+class MockServer(object):
+  '''
+  A threaded HTTP server that emulates the Canary API on
+  ``http://127.0.0.1:{port}/api`` (see `root`). Use :meth:`start` and
+  :meth:`stop`, or use it as a context manager.
+
+  :Parameters:
+
+  api : str, optional, default: "v2"
+
+    The API version to emulate: ``"v1"`` serves the endpoints at the
+    root and reports ``{"api": "1.1.0"}`` on ``/version``, ``"v2"``
+    serves them under ``/v2`` and reports ``{"apis": ["v2"]}``.
+
+  principal, credential : str, optional, default: null
+
+    The only accepted login; by default any login is accepted.
+
+  latency : { float, tuple(float, float) }, optional, default: 0
+
+    The number of seconds to delay each response by, or a ``(min,
+    max)`` range to pick a uniformly random delay from.
+
+  error_rate : float, optional, default: 0
+
+    The fraction of selection and reason requests that fail with a
+    ``503 Service Unavailable`` response.
+
+  session_ttl : float, optional, default: null
+
+    The number of seconds after which sessions are expired by the
+    server (without telling the client), which forces clients to
+    re-authenticate. By default, sessions never expire.
+
+  payload_size : int, optional, default: 1024
+
+    The approximate size, in characters, of selection contents.
+
+  items : int, optional, default: 3
+
+    The number of selection items per selection.
+
+  reasons : list, optional
+
+    The reasons-for-visit catalogue to serve.
+
+  capacity : int, optional, default: null
+
+    The maximum number of selection requests that are processed
+    simultaneously; further requests are rejected with a ``429 Too
+    Many Requests`` response. By default, there is no limit.
+
+  max_chunk_size : int, optional, default: null
+
+    The maximum size of CMA upload chunks; uploads that request larger
+    chunks are told to use this size instead. Uploaded files are kept
+    in memory, in `files`.
+
+  compress : bool, optional, default: false
+
+    Whether or not to compress responses for clients that accept it
+    (see the ``Accept-Encoding`` request header) with gzip or
+    deflate. Compressed requests (see the ``Content-Encoding``
+    request header) are always accepted.
+
+  port : int, optional, default: 0
+
+    The port to listen on; zero picks a free port.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, api='v2', principal=None, credential=None, latency=0,
+               error_rate=0, session_ttl=None, payload_size=1024, items=3,
+               reasons=None, capacity=None, max_chunk_size=None,
+               compress=False, address='127.0.0.1', port=0):
+    if api not in ('v1', 'v2'):
+      raise ValueError('invalid/unknown API version: %r' % (api,))
+    self.api          = api
+    self.principal    = principal
+    self.credential   = credential
+    self.latency      = latency
+    self.error_rate   = error_rate
+    self.session_ttl  = session_ttl
+    self.payload_size = payload_size
+    self.items        = items
+    self.reasons      = DEFAULT_REASONS if reasons is None else reasons
+    self.capacity     = capacity
+    self.max_chunk_size = max_chunk_size
+    self.compress     = compress
+    # the CMA files (and unfinished uploads) by ID
+    self.files        = dict()
+    self.active       = 0
+    self.stats        = collections.Counter()
+    # the number of selections per ``x-active-partner-id`` header
+    self.partners     = collections.Counter()
+    self.sessions     = dict()
+    self._lock        = threading.Lock()
+    self._server      = _HTTPServer((address, port), _Handler)
+    self._server.mock = self
+    self._thread      = None
+
+  #----------------------------------------------------------------------------
+  @property
+  def root(self):
+    '''
+    The API root URL to pass to :class:`canarymd.Client`.
+    '''
+    host, port = self._server.server_address[:2]
+    return 'http://%s:%d/api' % (host, port)
+
+  #----------------------------------------------------------------------------
+  def start(self):
+    self._thread = threading.Thread(
+      target=self._server.serve_forever, kwargs=dict(poll_interval=0.05),
+      name='canarymd-mock')
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  #----------------------------------------------------------------------------
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+    self._thread.join()
+
+  #----------------------------------------------------------------------------
+  def __enter__(self):
+    return self.start()
+
+  #----------------------------------------------------------------------------
+  def __exit__(self, *exc_info):
+    self.stop()
+
+  #----------------------------------------------------------------------------
+  def expireSessions(self):
+    '''
+    Invalidates all current sessions.
+    '''
+    with self._lock:
+      self.sessions.clear()
+
+  #----------------------------------------------------------------------------
+  def _count(self, name):
+    with self._lock:
+      self.stats[name] += 1
+
+  #----------------------------------------------------------------------------
+  def _admit(self):
+    # returns true if a selection request may be processed, in which
+    # case `_leave` must be called when it is done
+    with self._lock:
+      if self.capacity is not None and self.active >= self.capacity:
+        self.stats['throttled'] += 1
+        return False
+      self.active += 1
+      return True
+
+  #----------------------------------------------------------------------------
+  def _leave(self):
+    with self._lock:
+      self.active -= 1
+
+  #----------------------------------------------------------------------------
+  def _delay(self):
+    latency = self.latency
+    if isinstance(latency, (tuple, list)):
+      latency = random.uniform(*latency)
+    if latency:
+      time.sleep(latency)
+
+  #----------------------------------------------------------------------------
+  def _login(self, data):
+    if not isinstance(data, dict):
+      return None
+    if self.principal is not None:
+      if data.get('username') != self.principal \
+          or data.get('password') != self.credential:
+        return None
+    sid = uuid.uuid4().hex
+    with self._lock:
+      self.sessions[sid] = time.time()
+      self.stats['logins'] += 1
+    return sid
+
+  #----------------------------------------------------------------------------
+  def _valid(self, sid):
+    with self._lock:
+      created = self.sessions.get(sid)
+      if created is None:
+        return False
+      if self.session_ttl is not None \
+          and time.time() > created + self.session_ttl:
+        del self.sessions[sid]
+        return False
+      return True
+
+  #----------------------------------------------------------------------------
+  def _selection(self, data):
+    # returns (status, response)
+    try:
+      peo = data['selection']['peo']
+      data['selection']['context']
+    except (KeyError, TypeError):
+      return 400, dict(message='invalid parameters', field=dict(
+        selection='required: context and peo'))
+    errors = dict()
+    if peo.get('transport') not in Transport.ALL:
+      errors['transport'] = 'invalid/unknown transport'
+    if peo.get('purpose') not in Purpose.ALL:
+      errors['purpose'] = 'invalid/unknown purpose'
+    if peo.get('transport') == Transport.PAPER:
+      for key in ('width', 'height'):
+        if not isinstance(peo.get(key), int):
+          errors[key] = 'required for paper transport'
+    if errors:
+      return 400, dict(
+        message='invalid parameters', field=dict(selection=dict(peo=errors)))
+    sid = uuid.uuid4().hex
+    chunk = '<p>%s</p>' % (peo.get('recipient') or '',)
+    content = '<div id="%s">' % (sid,)
+    content += chunk * max(1, ( self.payload_size - len(content) - 6 )
+                           // max(1, len(chunk))) + '</div>'
+    return 200, dict(
+      selection       = dict(id=sid),
+      selectionitems  = [
+        dict(channel_id='channel-%d' % (idx,), message_id=uuid.uuid4().hex)
+        for idx in range(self.items)],
+      content         = content,
+    )
+
+  #----------------------------------------------------------------------------
+  def _cmaStart(self, data):
+    # starts or resumes an upload; returns (status, response)
+    try:
+      upload = data['upload']
+      key = (upload['name'], int(upload['size']), upload['sha256'])
+      chunk_size = int(upload['chunk_size'])
+    except (KeyError, TypeError, ValueError):
+      return 400, dict(message='invalid parameters', field=dict(
+        upload='required: name, size, sha256 and chunk_size'))
+    if chunk_size < 1:
+      return 400, dict(message='invalid parameters', field=dict(
+        upload=dict(chunk_size='must be positive')))
+    if self.max_chunk_size:
+      chunk_size = min(chunk_size, self.max_chunk_size)
+    with self._lock:
+      for record in self.files.values():
+        if not record['complete'] and record['key'] == key:
+          break
+      else:
+        record = dict(
+          id=uuid.uuid4().hex, key=key, chunk_size=chunk_size,
+          chunks=dict(), checksums=dict(), complete=False)
+        self.files[record['id']] = record
+      return 200, dict(upload=dict(
+        id          = record['id'],
+        chunk_size  = record['chunk_size'],
+        received    = sorted(record['chunks']),
+      ))
+
+  #----------------------------------------------------------------------------
+  def _cmaPut(self, fid, index, data, checksum):
+    # stores an uploaded chunk; returns (status, response)
+    with self._lock:
+      record = self.files.get(fid)
+      if record is None or record['complete']:
+        return 404, dict(message='not found')
+      size, chunk_size = record['key'][1], record['chunk_size']
+      if index >= chunkCount(size, chunk_size) or len(data) != min(
+          chunk_size, size - index * chunk_size):
+        return 400, dict(message='invalid chunk')
+      if hashlib.sha256(data).hexdigest() != checksum:
+        self.stats['cma_checksum_errors'] += 1
+        return 400, dict(message='checksum mismatch')
+      record['chunks'][index] = data
+      record['checksums'][index] = checksum
+      self.stats['cma_chunks_received'] += 1
+    return 200, dict(chunk=dict(index=index, sha256=checksum))
+
+  #----------------------------------------------------------------------------
+  def _cmaComplete(self, fid):
+    with self._lock:
+      record = self.files.get(fid)
+      if record is None:
+        return 404, dict(message='not found')
+      name, size, digest = record['key']
+      if len(record['chunks']) != chunkCount(size, record['chunk_size']):
+        return 409, dict(message='missing chunks')
+      content = b''.join(
+        record['chunks'][idx] for idx in range(len(record['chunks'])))
+      if hashlib.sha256(content).hexdigest() != digest:
+        del self.files[fid]
+        return 400, dict(message='checksum mismatch')
+      record['complete'] = True
+    return self._cmaFile(fid)
+
+  #----------------------------------------------------------------------------
+  def _cmaFile(self, fid):
+    with self._lock:
+      record = self.files.get(fid)
+      if record is None or not record['complete']:
+        return 404, dict(message='not found')
+      name, size, digest = record['key']
+      return 200, dict(file=dict(
+        id          = fid,
+        name        = name,
+        size        = size,
+        sha256      = digest,
+        chunk_size  = record['chunk_size'],
+        chunks      = [
+          record['checksums'][idx] for idx in range(len(record['chunks']))],
+      ))
+
+  #----------------------------------------------------------------------------
+  def _cmaGet(self, fid, index):
+    # returns the content of a chunk, or None
+    with self._lock:
+      record = self.files.get(fid)
+      if record is None or not record['complete']:
+        return None
+      data = record['chunks'].get(index)
+      if data is not None:
+        self.stats['cma_chunks_sent'] += 1
+      return data
+
+#------------------------------------------------------------------------------
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads      = True
+  allow_reuse_address = True
+
+  #----------------------------------------------------------------------------
+  def handle_error(self, request, client_address):
+    # clients that hang up before the response is sent (e.g. after a
+    # client-side timeout) are expected and not worth reporting
+    if isinstance(sys.exc_info()[1], socket.error):
+      return
+    BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+#------------------------------------------------------------------------------
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+
+  #----------------------------------------------------------------------------
+  def setup(self):
+    # headers and body are written separately: without this, delayed
+    # ACKs add ~40ms to every keep-alive response
+    self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+  #----------------------------------------------------------------------------
+  def log_message(self, *args):
+    pass
+
+  #----------------------------------------------------------------------------
+  def _encoding(self):
+    # returns the response encoding to use, if any
+    if not self.server.mock.compress:
+      return None
+    accepted = [
+      value.split(';', 1)[0].strip().lower()
+      for value in ( self.headers.get('Accept-Encoding') or '' ).split(',')]
+    for encoding in ('gzip', 'deflate'):
+      if encoding in accepted:
+        return encoding
+    return None
+
+  #----------------------------------------------------------------------------
+  def _reply(self, status, data=None, headers=None):
+    body = json.dumps(data).encode('utf-8') if data is not None else b''
+    self._write(status, body, 'application/json', headers)
+
+  #----------------------------------------------------------------------------
+  def _write(self, status, body, content_type, headers=None):
+    encoding = self._encoding() if body else None
+    if encoding:
+      compressor = zlib.compressobj(
+        6, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+      body = compressor.compress(body) + compressor.flush()
+      self.server.mock._count('compressed_responses')
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    if encoding:
+      self.send_header('Content-Encoding', encoding)
+    self.send_header('Content-Length', str(len(body)))
+    for key, value in ( headers or {} ).items():
+      self.send_header(key, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  #----------------------------------------------------------------------------
+  def _payload(self):
+    # returns the (decompressed) request body, or None
+    size = int(self.headers.get('Content-Length') or 0)
+    if not size:
+      return None
+    data = self.rfile.read(size)
+    encoding = ( self.headers.get('Content-Encoding') or '' ).lower()
+    if encoding in ('gzip', 'deflate'):
+      try:
+        # zlib detects gzip and zlib headers automatically
+        data = zlib.decompress(data, 47)
+      except zlib.error:
+        return None
+      self.server.mock._count('compressed_requests')
+    return data
+
+  #----------------------------------------------------------------------------
+  def _body(self):
+    if self.payload is None \
+        or self.headers.get('Content-Type') == 'application/octet-stream':
+      return None
+    try:
+      return json.loads(self.payload.decode('utf-8'))
+    except ValueError:
+      return None
+
+  #----------------------------------------------------------------------------
+  def _session(self):
+    cookies = http_cookies.SimpleCookie(self.headers.get('Cookie') or '')
+    morsel  = cookies.get('session')
+    return morsel.value if morsel is not None else None
+
+  #----------------------------------------------------------------------------
+  def _route(self):
+    # returns the endpoint name or None if the path is unknown
+    mock = self.server.mock
+    path = self.path.split('?', 1)[0]
+    if path == '/api/version':
+      return 'version'
+    prefix = '/api' if mock.api == 'v1' else '/api/' + mock.api
+    if not path.startswith(prefix + '/'):
+      return None
+    return path[len(prefix) + 1:]
+
+  #----------------------------------------------------------------------------
+  def _handle(self, method):
+    mock = self.server.mock
+    self.payload = self._payload()
+    data = self._body()
+    route = self._route()
+    if route == 'selection' and method == 'POST':
+      if not mock._admit():
+        mock._count('requests')
+        return self._reply(429, dict(message='too many requests'))
+      try:
+        return self._dispatch(method, route, data)
+      finally:
+        mock._leave()
+    return self._dispatch(method, route, data)
+
+  #----------------------------------------------------------------------------
+  def _dispatch(self, method, route, data):
+    mock = self.server.mock
+    mock._delay()
+    mock._count('requests')
+    if route == 'version' and method == 'GET':
+      if mock.api == 'v1':
+        return self._reply(200, dict(api='1.1.0', server=SERVER_VERSION))
+      return self._reply(200, dict(apis=[mock.api], server=SERVER_VERSION))
+    if route == 'auth/session' and method == 'POST':
+      sid = mock._login(data)
+      if sid is None:
+        return self._reply(401, dict(message='invalid credentials'))
+      return self._reply(200, dict(), {
+        'Set-Cookie': 'session=%s; Path=/; HttpOnly' % (sid,)})
+    cma = _CMA_ROUTE.match(route or '')
+    if route not in ('selection', 'reason') and not cma:
+      return self._reply(404, dict(message='not found'))
+    if not mock._valid(self._session()):
+      mock._count('unauthorized')
+      return self._reply(401, dict(message='authentication required'))
+    if mock.error_rate and random.random() < mock.error_rate:
+      mock._count('errors')
+      return self._reply(503, dict(message='service unavailable'))
+    if route == 'selection' and method == 'POST':
+      mock._count('selections')
+      with mock._lock:
+        mock.partners[self.headers.get('x-active-partner-id')] += 1
+      return self._reply(*mock._selection(data))
+    if cma:
+      return self._cma(method, cma, data)
+    if route == 'reason' and method == 'GET':
+      etag = '"%s"' % (hashlib.md5(json.dumps(
+        mock.reasons, sort_keys=True).encode('utf-8')).hexdigest(),)
+      if self.headers.get('If-None-Match') == etag:
+        return self._reply(304, None, {'ETag': etag})
+      return self._reply(200, dict(reasons=mock.reasons), {'ETag': etag})
+    return self._reply(405, dict(message='method not allowed'))
+
+  #----------------------------------------------------------------------------
+  def _cma(self, method, match, data):
+    mock = self.server.mock
+    fid, action, index = match.groups()
+    if fid is None and method == 'POST':
+      return self._reply(*mock._cmaStart(data))
+    if action is None and fid is not None and method == 'GET':
+      return self._reply(*mock._cmaFile(fid))
+    if action == 'complete' and method == 'POST':
+      return self._reply(*mock._cmaComplete(fid))
+    if index is not None and method == 'PUT':
+      return self._reply(*mock._cmaPut(
+        fid, int(index), self.payload or b'',
+        self.headers.get(CHECKSUM_HEADER)))
+    if index is not None and method == 'GET':
+      content = mock._cmaGet(fid, int(index))
+      if content is None:
+        return self._reply(404, dict(message='not found'))
+      return self._write(200, content, 'application/octet-stream', {
+        CHECKSUM_HEADER: hashlib.sha256(content).hexdigest()})
+    return self._reply(405, dict(message='method not allowed'))
+
+  #----------------------------------------------------------------------------
+  def do_GET(self):
+    self._handle('GET')
+
+  #----------------------------------------------------------------------------
+  def do_POST(self):
+    self._handle('POST')
+
+  #----------------------------------------------------------------------------
+  def do_PUT(self):
+    self._handle('PUT')
+
+#------------------------------------------------------------------------------
+def main(args=None):
+  cli = argparse.ArgumentParser(
+    description='Runs a local stand-in for the Canary API')
+  cli.add_argument('--port', type=int, default=8899)
+  cli.add_argument('--api', default='v2', choices=('v1', 'v2'))
+  cli.add_argument('--latency', type=float, default=0)
+  cli.add_argument('--error-rate', dest='error_rate', type=float, default=0)
+  cli.add_argument('--session-ttl', dest='session_ttl', type=float)
+  cli.add_argument(
+    '--payload-size', dest='payload_size', type=int, default=1024)
+  cli.add_argument('--capacity', type=int)
+  cli.add_argument('--max-chunk-size', dest='max_chunk_size', type=int)
+  cli.add_argument('--compress', action='store_true')
+  options = cli.parse_args(args=args)
+  server = MockServer(
+    api=options.api, latency=options.latency, error_rate=options.error_rate,
+    session_ttl=options.session_ttl, payload_size=options.payload_size,
+    capacity=options.capacity, max_chunk_size=options.max_chunk_size,
+    compress=options.compress, port=options.port)
+  print('serving mock Canary API at', server.root)
+  try:
+    server._server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+  sys.exit(main())
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Multi-tenant clients: a :class:`ClientPool` hands out a
+:class:`canarymd.Client` per tenant, i.e. per principal and partner,
+all of which share a single HTTP connection pool:
+
+.. code-block:: python
+
+   pool = canarymd.ClientPool(env=canarymd.Environment.PROD)
+   for job in jobs:
+     client = pool.get(job.principal, job.credential, partner=job.partner)
+     client.select(job.context, job.peo)
+
+Each tenant has its own server session, so tenants never see each
+other's authentication state, but requests of all tenants re-use the
+same warm connections, and the API version is only negotiated once
+per server (see `api` of :class:`canarymd.Client`). The least
+recently used tenants are evicted when there are more than
+`max_tenants`.
+'''
+
+import collections
+import os
+import threading
+
+import requests
+from aadict import aadict
+
+from .client import Client, DEFAULT_POOL_SIZE
+
+#------------------------------------------------------------------------------
+DEFAULT_MAX_TENANTS = 256
+
+#------------------------------------------------------------------------------
+class ClientPool(object):
+  '''
+  A bounded pool of clients for many tenants that share one HTTP
+  connection pool. Use it as a context manager or call :meth:`close`
+  when done.
+
+  :Parameters:
+
+  max_tenants : int, optional, default: 256
+
+    The maximum number of tenant clients to keep; when another tenant
+    is added, the least recently used one is evicted (and, if it is
+    used again, re-created, which requires logging in again). Clients
+    that were evicted keep working for callers that still hold them.
+
+  pool_size, max_connections : int, optional
+
+    The size of the shared connection pool, as for
+    :class:`canarymd.Client`; it should be at least the number of
+    threads that use the pool's clients concurrently.
+
+  options : dict
+
+    Any other keyword arguments (e.g. `env`, `root`, `retry` or
+    `cache`) are passed to the :class:`canarymd.Client` constructor
+    of every tenant.
+
+  After a ``fork()``, the pool creates a new connection pool and
+  forgets its tenants in the child process.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, max_tenants=DEFAULT_MAX_TENANTS,
+               pool_size=DEFAULT_POOL_SIZE, max_connections=None, **options):
+    self.max_tenants  = max_tenants
+    self.pool_size    = max_connections or pool_size
+    self.pool_block   = bool(max_connections)
+    self.options      = options
+    self.evictions    = 0
+    self._reset()
+
+  #----------------------------------------------------------------------------
+  def _reset(self):
+    self._pid     = os.getpid()
+    self._lock    = threading.Lock()
+    self._clients = collections.OrderedDict()
+    self.adapter  = requests.adapters.HTTPAdapter(
+      pool_maxsize=self.pool_size, pool_block=self.pool_block)
+
+  #----------------------------------------------------------------------------
+  def __enter__(self):
+    return self
+
+  #----------------------------------------------------------------------------
+  def __exit__(self, *exc_info):
+    self.close()
+
+  #----------------------------------------------------------------------------
+  def __len__(self):
+    return len(self._clients)
+
+  #----------------------------------------------------------------------------
+  def close(self):
+    '''
+    Forgets all tenants and closes the shared connections.
+    '''
+    with self._lock:
+      self._clients.clear()
+    self.adapter.close()
+
+  #----------------------------------------------------------------------------
+  def get(self, principal, credential, partner=None):
+    '''
+    Returns the client of the tenant `principal` acting for `partner`
+    (if specified), creating it if needed. If `credential` differs
+    from the one the tenant's client was created with, the client
+    switches to it (see :meth:`canarymd.Client.updateAuth`).
+    '''
+    if self._pid != os.getpid():
+      self._reset()
+    key = (principal, partner)
+    with self._lock:
+      client = self._clients.pop(key, None)
+      if client is None:
+        client = Client(
+          principal, credential, partner=partner, adapter=self.adapter,
+          **self.options)
+      self._clients[key] = client
+      while len(self._clients) > self.max_tenants:
+        self._clients.popitem(last=False)
+        self.evictions += 1
+    # outside of the pool's lock, because it waits for any login of
+    # the client in progress
+    return client.updateAuth(principal, credential)
+
+  #----------------------------------------------------------------------------
+  def select(self, principal, credential, context, peo, partner=None, **kw):
+    '''
+    Shorthand for ``get(principal, credential, partner).select(context,
+    peo, **kw)``.
+    '''
+    return self.get(principal, credential, partner).select(context, peo, **kw)
+
+  #----------------------------------------------------------------------------
+  def stats(self):
+    '''
+    Returns the sums of the counters of all current tenants' clients
+    (see :meth:`canarymd.Client.stats`, but without the current rate
+    limits), plus the number of `tenants` and `evictions`.
+    '''
+    with self._lock:
+      clients = list(self._clients.values())
+    ret = collections.Counter()
+    for client in clients:
+      stats = client.stats()
+      stats.pop('rate_limit', None)
+      stats.pop('concurrency_limit', None)
+      ret.update(stats)
+    ret.update(tenants=len(clients), evictions=self.evictions)
+    return aadict(ret)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
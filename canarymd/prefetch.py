@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Ahead-of-time selections for scheduled appointments. The selections
+for e.g. appointment reminders can be made well before they are
+needed, because the schedule is known in advance. A
+:class:`Prefetcher` is fed the upcoming appointments' PEOs and their
+due times, makes their selections in the background (earliest due
+first, within a request rate budget) and keeps the results until
+shortly after they are due, so that the selection at render time is
+a local lookup:
+
+.. code-block:: python
+
+   prefetcher = canarymd.Prefetcher(client, rate=5, lead=12 * 3600)
+   prefetcher.start()
+   for peo in tomorrows_appointments:
+     prefetcher.schedule(context, peo)
+   ...
+   # at render time: a local hit, or else a live selection
+   selection = prefetcher.select(context, peo)
+'''
+
+import calendar
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from aadict import aadict
+import six
+
+from .cache import canonicalKey
+from .ratelimit import TokenBucket
+from .validate import _ISOTIME
+
+#------------------------------------------------------------------------------
+
+log = logging.getLogger(__name__)
+
+#------------------------------------------------------------------------------
+DEFAULT_PREFETCH_RATE     = 5
+DEFAULT_PREFETCH_LEAD     = 86400
+DEFAULT_PREFETCH_TTL      = 3600
+DEFAULT_PREFETCH_THREADS  = 2
+DEFAULT_PREFETCH_MAXSIZE  = 100000
+
+# wall-clock time, because due times are absolute
+_now = time.time
+
+#------------------------------------------------------------------------------
+def dueTime(value):
+  '''
+  Converts the due time `value` to seconds since the epoch: `value`
+  can be a number (which is returned as is), a
+  :class:`datetime.datetime` or an ISO 8601 date/time string such as
+  ``"2014-12-02T18:20:06Z"``. Date/times without a time zone are taken
+  to be in UTC.
+  '''
+  if isinstance(value, datetime.datetime):
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+  if isinstance(value, six.string_types):
+    match = _ISOTIME.match(value)
+    if not match:
+      raise ValueError('invalid ISO 8601 date/time: %r' % (value,))
+    parts = match.groups()
+    ret = calendar.timegm(tuple(int(part or 0) for part in parts[:6]))
+    ret += float(parts[6] or 0)
+    if parts[8]:
+      offset = int(parts[9]) * 3600 + int(parts[10]) * 60
+      ret -= offset if parts[8] == '+' else -offset
+    return ret
+  return float(value)
+
+#------------------------------------------------------------------------------
+class ExpiringStore(object):
+  '''
+  A thread-safe mapping whose entries each expire at their own time.
+  When it holds more than `maxsize` entries, the ones that expire
+  soonest are evicted.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, maxsize=DEFAULT_PREFETCH_MAXSIZE):
+    self.maxsize  = maxsize
+    self._data    = {}
+    # (expires, key) of every entry, possibly with outdated duplicates
+    self._expiry  = []
+    self._lock    = threading.Lock()
+
+  #----------------------------------------------------------------------------
+  def __len__(self):
+    return len(self._data)
+
+  #----------------------------------------------------------------------------
+  def get(self, key):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None:
+        return None
+      if entry[0] <= _now():
+        del self._data[key]
+        return None
+      return entry[1]
+
+  #----------------------------------------------------------------------------
+  def set(self, key, value, expires):
+    with self._lock:
+      self._data[key] = (expires, value)
+      heapq.heappush(self._expiry, (expires, key))
+      self._purge(_now())
+
+  #----------------------------------------------------------------------------
+  def _purge(self, now):
+    expiry = self._expiry
+    while expiry and (
+        expiry[0][0] <= now or len(self._data) > self.maxsize):
+      expires, key = heapq.heappop(expiry)
+      entry = self._data.get(key)
+      # skip entries that have since been replaced
+      if entry is not None and entry[0] == expires:
+        del self._data[key]
+    # drop outdated duplicates once they dominate the heap
+    if len(expiry) > 2 * len(self._data) + 64:
+      self._expiry = [(entry[0], key) for key, entry in self._data.items()]
+      heapq.heapify(self._expiry)
+
+#------------------------------------------------------------------------------
+class Prefetcher(object):
+  '''
+  Makes the selections of scheduled appointments in the background and
+  serves them locally at render time. Call :meth:`start` (or use it
+  as a context manager) to start the background threads, and
+  :meth:`schedule` or :meth:`extend` to add appointments, in any
+  order.
+
+  :Parameters:
+
+  client : canarymd.Client
+
+    The client to make the selections with.
+
+  rate : float, optional, default: 5
+
+    The maximum number of background selections per second, so that
+    prefetching does not compete with live traffic for the client's
+    rate limit (see `rate_limit` of :class:`canarymd.Client`).
+
+  lead : float, optional, default: 86400
+
+    How many seconds before an appointment is due its selection is
+    made. Appointments that are due sooner are prefetched as soon as
+    possible. Pending selections are always made in order of their due
+    times, so that the most urgent ones are made first when the rate
+    budget does not keep up.
+
+  ttl : float, optional, default: 3600
+
+    How many seconds after an appointment is due its selection is
+    kept.
+
+  threads : int, optional, default: 2
+
+    The number of background threads that make selections.
+
+  maxsize : int, optional, default: 100000
+
+    The maximum number of prefetched selections to keep; when there
+    are more, the ones that expire soonest are dropped.
+
+  timeout : float, optional, default: null
+
+    The `timeout` of background selections (see
+    :meth:`canarymd.Client.select`).
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, client, rate=DEFAULT_PREFETCH_RATE,
+               lead=DEFAULT_PREFETCH_LEAD, ttl=DEFAULT_PREFETCH_TTL,
+               threads=DEFAULT_PREFETCH_THREADS,
+               maxsize=DEFAULT_PREFETCH_MAXSIZE, timeout=None):
+    self.client   = client
+    self.lead     = lead
+    self.ttl      = ttl
+    self.threads  = threads
+    self.timeout  = timeout
+    self.bucket   = TokenBucket(rate) if rate else None
+    self.store    = ExpiringStore(maxsize)
+    self.counts   = aadict()
+    # (fetch-time, due-time, sequence, key, context, peo)
+    self._queue   = []
+    self._pending = set()
+    self._active  = 0
+    self._seq     = itertools.count()
+    self._workers = []
+    self._stopped = threading.Event()
+    self._cond    = threading.Condition(threading.Lock())
+
+  #----------------------------------------------------------------------------
+  def __enter__(self):
+    return self.start()
+
+  #----------------------------------------------------------------------------
+  def __exit__(self, *exc_info):
+    self.stop()
+
+  #----------------------------------------------------------------------------
+  def _count(self, name, value=1):
+    with self._cond:
+      self.counts[name] = self.counts.get(name, 0) + value
+
+  #----------------------------------------------------------------------------
+  def _key(self, context, peo):
+    return canonicalKey(context, peo)
+
+  #----------------------------------------------------------------------------
+  def start(self):
+    '''
+    Starts the background threads.
+    '''
+    self._stopped.clear()
+    for idx in range(self.threads):
+      worker = threading.Thread(
+        target=self._run, name='canarymd-prefetch-%d' % (idx,))
+      worker.daemon = True
+      worker.start()
+      self._workers.append(worker)
+    return self
+
+  #----------------------------------------------------------------------------
+  def stop(self):
+    '''
+    Stops the background threads after their current selections.
+    Appointments that have not been prefetched yet remain scheduled
+    until the prefetcher is started again.
+    '''
+    self._stopped.set()
+    with self._cond:
+      self._cond.notify_all()
+    for worker in self._workers:
+      worker.join()
+    self._workers = []
+
+  #----------------------------------------------------------------------------
+  def schedule(self, context, peo, due=None):
+    '''
+    Schedules the selection of `peo` in `context` ahead of `due` (see
+    :func:`dueTime`), which defaults to the time of the PEO's
+    `appointment`. Returns false if the selection is already scheduled
+    or prefetched, or if the appointment is past. Raises a ValueError
+    if `due` is not given and the PEO has no structured appointment
+    with a time (e.g. an HL7 ``SCH`` segment).
+    '''
+    if due is None:
+      appointment = peo.get('appointment')
+      if not isinstance(appointment, dict) or not appointment.get('time'):
+        raise ValueError(
+          'the PEO has no appointment time: `due` must be specified')
+      due = appointment['time']
+    due = dueTime(due)
+    key = self._key(context, peo)
+    with self._cond:
+      if key in self._pending or due + self.ttl <= _now() \
+          or self.store.get(key) is not None:
+        return False
+      self._pending.add(key)
+      heapq.heappush(self._queue, (
+        due - self.lead, due, next(self._seq), key, context, peo))
+      self.counts.scheduled = self.counts.get('scheduled', 0) + 1
+      self._cond.notify()
+    return True
+
+  #----------------------------------------------------------------------------
+  def extend(self, appointments):
+    '''
+    Schedules each of `appointments`, an iterable of ``(context, peo)``
+    or ``(context, peo, due)`` tuples, and returns the number that
+    were added.
+    '''
+    return sum(1 for item in appointments if self.schedule(*item))
+
+  #----------------------------------------------------------------------------
+  def _next(self):
+    # waits for the next appointment that is ready to be prefetched
+    with self._cond:
+      while not self._stopped.is_set():
+        if self._queue:
+          delay = self._queue[0][0] - _now()
+          if delay <= 0:
+            self._active += 1
+            return heapq.heappop(self._queue)
+        else:
+          delay = None
+        self._cond.wait(delay)
+      return None
+
+  #----------------------------------------------------------------------------
+  def _run(self):
+    while True:
+      item = self._next()
+      if item is None:
+        return
+      requeued = False
+      try:
+        requeued = self._prefetch(*item)
+      finally:
+        with self._cond:
+          self._active -= 1
+          if requeued:
+            heapq.heappush(self._queue, item)
+          else:
+            self._pending.discard(item[3])
+          self._cond.notify_all()
+
+  #----------------------------------------------------------------------------
+  def _prefetch(self, fetch, due, seq, key, context, peo):
+    if self.bucket is not None:
+      delay = self.bucket.reserve()
+      if delay and self._stopped.wait(delay):
+        # re-scheduled, so that it is picked up after a restart
+        return True
+    if due + self.ttl <= _now():
+      self._count('expired')
+      return
+    try:
+      selection = self.client.select(
+        context, peo, timeout=self.timeout, cache=False)
+    except Exception as err:
+      # the selection is made live at render time instead
+      log.warning('failed to prefetch selection: %s', err)
+      self._count('errors')
+      return
+    # wrapped, so that "no applicable messages" is stored as well
+    self.store.set(key, (selection,), due + self.ttl)
+    self._count('prefetched')
+
+  #----------------------------------------------------------------------------
+  def wait(self, timeout=None):
+    '''
+    Waits until all appointments that are ready to be prefetched (i.e.
+    that are due within `lead` seconds) have been, and returns true,
+    or returns false after `timeout` seconds.
+    '''
+    deadline = None if timeout is None else _now() + timeout
+    with self._cond:
+      while self._active or ( self._queue and self._queue[0][0] <= _now() ):
+        remaining = None if deadline is None else deadline - _now()
+        if remaining is not None and remaining <= 0:
+          return False
+        # wakes up periodically, as appointments also become ready as
+        # time passes
+        self._cond.wait(0.05 if remaining is None else min(remaining, 0.05))
+    return True
+
+  #----------------------------------------------------------------------------
+  def get(self, context, peo):
+    '''
+    Returns the prefetched selection of `peo` in `context` (which may
+    be ``None`` if no messages were applicable), or raises
+    ``KeyError`` if there is none.
+    '''
+    entry = self.store.get(self._key(context, peo))
+    if entry is None:
+      raise KeyError(context, peo)
+    return entry[0]
+
+  #----------------------------------------------------------------------------
+  def select(self, context, peo, **kw):
+    '''
+    Returns the prefetched selection of `peo` in `context` if there is
+    one, or else makes the selection live with
+    :meth:`canarymd.Client.select`, passing it any additional keyword
+    arguments.
+    '''
+    try:
+      selection = self.get(context, peo)
+    except KeyError:
+      self._count('misses')
+      return self.client.select(context, peo, **kw)
+    self._count('hits')
+    return selection
+
+  #----------------------------------------------------------------------------
+  def stats(self):
+    '''
+    Returns the prefetcher's counters: the number of appointments
+    `scheduled`, `pending` and `prefetched`, the number of prefetched
+    selections `stored`, the number of render-time `hits` and
+    `misses`, and the number of prefetch `errors` and appointments
+    whose selection `expired` before it could be prefetched.
+    '''
+    with self._cond:
+      ret = aadict(self.counts)
+      ret.pending = len(self._pending)
+    ret.stored = len(self.store)
+    return ret
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
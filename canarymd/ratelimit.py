@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Client-side throttling, see the `rate_limit` parameter of
+:class:`canarymd.Client`. A :class:`RateLimiter` combines a token
+bucket, which limits the request rate, with an AIMD (additive
+increase, multiplicative decrease) controller of the number of
+concurrent requests. Both limits are lowered when the server signals
+that it is overloaded -- ``429`` and ``503`` responses, timeouts and,
+optionally, slow responses -- and raised again gradually while
+requests succeed, so that throughput stays close to what the server
+can handle. ``Retry-After`` headers pause all requests.
+'''
+
+import threading
+import time
+import timeit
+
+#------------------------------------------------------------------------------
+OVERLOAD_STATUSES = frozenset([429, 503])
+
+_timer = timeit.default_timer
+
+#------------------------------------------------------------------------------
+class TokenBucket(object):
+  '''
+  A thread-safe token bucket that refills at `rate` tokens per second
+  up to `burst` tokens (default: one second's worth).
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, rate, burst=None):
+    self.rate     = float(rate)
+    self.burst    = float(burst or max(1, rate))
+    self.tokens   = self.burst
+    self._stamp   = _timer()
+    self._lock    = threading.Lock()
+
+  #----------------------------------------------------------------------------
+  def _refill(self, now):
+    self.tokens = min(
+      self.burst, self.tokens + ( now - self._stamp ) * self.rate)
+    self._stamp = now
+
+  #----------------------------------------------------------------------------
+  def reserve(self):
+    '''
+    Takes a token and returns the number of seconds to wait before it
+    may be used (zero if one was available). Tokens are handed out in
+    order, so waiting callers are served first-come, first-served.
+    '''
+    with self._lock:
+      self._refill(_timer())
+      self.tokens -= 1
+      return -self.tokens / self.rate if self.tokens < 0 else 0
+
+  #----------------------------------------------------------------------------
+  def cancel(self):
+    '''
+    Returns a token taken by :meth:`reserve` that will not be used.
+    '''
+    with self._lock:
+      self.tokens = min(self.burst, self.tokens + 1)
+
+  #----------------------------------------------------------------------------
+  def setRate(self, rate):
+    with self._lock:
+      self._refill(_timer())
+      self.rate = float(rate)
+
+#------------------------------------------------------------------------------
+class RateLimiter(object):
+  '''
+  Adaptively limits the rate and concurrency of requests. Callers
+  bracket each request with :meth:`acquire` (or, without blocking,
+  :meth:`tryAcquire`) and :meth:`release`, which also reports the
+  outcome, or :meth:`cancel` if the request is not sent after all.
+
+  :Parameters:
+
+  rate : float, optional, default: null
+
+    The maximum number of requests per second. The effective rate is
+    lowered under pressure (but not below `min_rate`) and recovers
+    back up to `rate`. By default, the rate is not limited.
+
+  burst : int, optional, default: null
+
+    The number of requests that may be sent at once at the start of
+    a quiet period; defaults to one second's worth of `rate`.
+
+  concurrency : int, optional, default: 16
+
+    The maximum number of simultaneous requests; the effective limit
+    is lowered under pressure (but not below `min_concurrency`) and
+    recovers back up to `concurrency`.
+
+  latency : float, optional, default: null
+
+    If specified, responses that take longer than this number of
+    seconds are also treated as a sign of overload.
+
+  decrease : float, optional, default: 0.5
+
+    The factor that limits are multiplied by when overload is
+    detected (at most once per typical response time, so that one
+    burst of rejections only counts once).
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, rate=None, burst=None, concurrency=16, latency=None,
+               min_rate=0.5, min_concurrency=1, decrease=0.5):
+    self.max_rate         = rate
+    self.min_rate         = min(min_rate, rate) if rate else min_rate
+    self.max_concurrency  = concurrency
+    self.min_concurrency  = min_concurrency
+    self.latency          = latency
+    self.decrease         = decrease
+    self.bucket           = TokenBucket(rate, burst) if rate else None
+    self.limit            = float(concurrency)
+    self.inflight         = 0
+    self.throttled        = 0
+    self._paused          = 0
+    self._decreased       = None
+    self._avglatency      = None
+    self._cond            = threading.Condition(threading.Lock())
+
+  #----------------------------------------------------------------------------
+  @property
+  def rate(self):
+    '''
+    The current rate limit, or ``None`` if the rate is not limited.
+    '''
+    return self.bucket.rate if self.bucket is not None else None
+
+  #----------------------------------------------------------------------------
+  def tryAcquire(self):
+    '''
+    Takes a concurrency slot if one is available and returns the
+    number of seconds to wait before sending the request (because of
+    the rate limit or a ``Retry-After`` pause); otherwise returns
+    ``None`` and the caller should try again shortly.
+    '''
+    with self._cond:
+      if self.inflight >= int(self.limit):
+        return None
+      self.inflight += 1
+      pause = max(0, self._paused - _timer())
+    wait = self.bucket.reserve() if self.bucket is not None else 0
+    return max(wait, pause)
+
+  #----------------------------------------------------------------------------
+  def acquire(self, timeout=None):
+    '''
+    Blocks until a request may be sent. Returns the number of seconds
+    spent waiting or, if `timeout` is specified and a request could
+    not be sent within that many seconds, ``None`` immediately (and
+    nothing is taken).
+    '''
+    start = _timer()
+    with self._cond:
+      while self.inflight >= int(self.limit):
+        if timeout is None:
+          self._cond.wait()
+          continue
+        remaining = timeout - ( _timer() - start )
+        if remaining <= 0:
+          return None
+        self._cond.wait(remaining)
+      self.inflight += 1
+      pause = max(0, self._paused - _timer())
+    wait = self.bucket.reserve() if self.bucket is not None else 0
+    wait = max(wait, pause)
+    if timeout is not None and wait > timeout - ( _timer() - start ):
+      self.cancel()
+      return None
+    if wait:
+      time.sleep(wait)
+    return _timer() - start
+
+  #----------------------------------------------------------------------------
+  def cancel(self):
+    '''
+    Releases a slot taken by :meth:`acquire` or :meth:`tryAcquire`
+    for a request that was not sent, and returns its token to the
+    rate limit. The limits are not adjusted.
+    '''
+    if self.bucket is not None:
+      self.bucket.cancel()
+    with self._cond:
+      self.inflight -= 1
+      self._cond.notify_all()
+
+  #----------------------------------------------------------------------------
+  def release(self, status=None, latency=None, retry_after=None,
+              overload=False):
+    '''
+    Releases a slot taken by :meth:`acquire` and adjusts the limits
+    according to the outcome of the request: its HTTP `status` (or
+    ``None`` if it failed without a response, in which case
+    `overload` indicates whether the failure was a timeout), its
+    `latency` in seconds and the server's `retry_after` delay, if
+    any.
+    '''
+    now = _timer()
+    with self._cond:
+      self.inflight -= 1
+      if latency is not None:
+        self._avglatency = latency if self._avglatency is None \
+          else 0.8 * self._avglatency + 0.2 * latency
+      if retry_after:
+        self._paused = max(self._paused, now + retry_after)
+      if status in OVERLOAD_STATUSES or overload \
+          or ( self.latency and latency and latency > self.latency ):
+        self.throttled += 1
+        self._backoff(now)
+      elif status is not None and status < 500:
+        self._increase()
+      self._cond.notify_all()
+
+  #----------------------------------------------------------------------------
+  def _backoff(self, now):
+    # multiplicative decrease, at most once per typical response time
+    if self._decreased is not None \
+        and now - self._decreased < max(0.05, self._avglatency or 0):
+      return
+    self._decreased = now
+    self.limit = max(self.min_concurrency, self.limit * self.decrease)
+    if self.bucket is not None:
+      self.bucket.setRate(max(self.min_rate, self.bucket.rate * self.decrease))
+
+  #----------------------------------------------------------------------------
+  def _increase(self):
+    # additive increase: about one more concurrent request per round
+    # trip of all current ones, and about one more request per second
+    # per second of successful requests
+    self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+    if self.bucket is not None and self.bucket.rate < self.max_rate:
+      self.bucket.setRate(
+        min(self.max_rate, self.bucket.rate + 1.0 / self.bucket.rate))
+
+  #----------------------------------------------------------------------------
+  def stats(self):
+    '''
+    Returns a dictionary with the current `rate` limit, `concurrency`
+    limit, the number of requests `inflight` and how many responses
+    were `throttled` (i.e. signalled overload).
+    '''
+    with self._cond:
+      return dict(
+        rate        = self.rate,
+        concurrency = int(self.limit),
+        inflight    = self.inflight,
+        throttled   = self.throttled,
+      )
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
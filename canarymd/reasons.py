@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from aadict import aadict
+import six
+
+#------------------------------------------------------------------------------
+
+log = logging.getLogger(__name__)
+
+#------------------------------------------------------------------------------
+DEFAULT_REASONS_TTL = 3600
+
+#------------------------------------------------------------------------------
+class ReasonCatalog(object):
+  '''
+  An in-memory cache of the reasons-for-visit catalogue, indexed by
+  reason code (e.g. ``"us/namcs:5035.0"``). Each reason's code is
+  taken from its `code` attribute, or its `id` if it has none.
+
+  :Parameters:
+
+  ttl : float, optional, default: 3600
+
+    The number of seconds the catalogue is considered fresh. After
+    that, it is re-validated with the server using a conditional
+    request, which only transfers the catalogue if it has changed.
+
+  path : str, optional, default: null
+
+    The name of a file to store a snapshot of the catalogue in, so
+    that new processes can start with a warm cache.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, ttl=DEFAULT_REASONS_TTL, path=None):
+    self.ttl      = ttl
+    self.path     = path
+    self.reasons  = None
+    self.etag     = None
+    self.modified = None
+    self.fetched  = None
+    # (index, codes) -- replaced as a unit so that lock-less readers
+    # never see an index and code list from different catalogues
+    self._lookup  = ({}, [])
+    self._lock    = threading.Lock()
+    if path:
+      self.load()
+
+  #----------------------------------------------------------------------------
+  def fresh(self):
+    return self.fetched is not None and time.time() - self.fetched < self.ttl
+
+  #----------------------------------------------------------------------------
+  def refresh(self, fetch, force=False):
+    '''
+    Re-validates the catalogue, unless it is still fresh and `force`
+    is falsy. `fetch` is called with a dictionary of conditional
+    request headers and must return ``None`` if the server reported
+    that the catalogue is unchanged, or otherwise a tuple of
+    ``(reasons, etag, modified)``.
+    '''
+    if not force and self.fresh():
+      return
+    with self._lock:
+      if not force and self.fresh():
+        return
+      headers = {}
+      if self.reasons is not None:
+        if self.etag:
+          headers['if-none-match'] = self.etag
+        if self.modified:
+          headers['if-modified-since'] = self.modified
+      result = fetch(headers)
+      if result is None:
+        # the snapshot is not rewritten: only `fetched` changed
+        log.debug('reasons-for-visit catalogue not modified')
+        self.fetched = time.time()
+        return
+      self._update(*result)
+      if self.path:
+        try:
+          self.save()
+        except (IOError, OSError) as err:
+          log.warning('could not store reasons-for-visit snapshot %r: %s',
+                      self.path, err)
+
+  #----------------------------------------------------------------------------
+  def _update(self, reasons, etag=None, modified=None, fetched=None):
+    self.reasons  = aadict.d2ar(reasons)
+    self.etag     = etag
+    self.modified = modified
+    self.fetched  = fetched or time.time()
+    index = dict((_code(reason), reason) for reason in self.reasons)
+    self._lookup  = (index, sorted(code for code in index if code))
+
+  #----------------------------------------------------------------------------
+  def get(self, code):
+    '''
+    Returns the reason with the specified `code`, or ``None``.
+    '''
+    return self._lookup[0].get(code)
+
+  #----------------------------------------------------------------------------
+  def search(self, prefix):
+    '''
+    Returns the list of reasons whose code starts with `prefix`, in
+    code order, e.g. ``search('us/namcs:')`` returns all reasons in
+    the NAMCS coding system.
+    '''
+    index, codes = self._lookup
+    idx = bisect.bisect_left(codes, prefix)
+    ret = []
+    while idx < len(codes) and codes[idx].startswith(prefix):
+      ret.append(index[codes[idx]])
+      idx += 1
+    return ret
+
+  #----------------------------------------------------------------------------
+  def load(self):
+    '''
+    Loads the catalogue snapshot from `path`, if it exists.
+    '''
+    try:
+      with open(self.path, 'rb') as fp:
+        data = json.loads(fp.read().decode('utf-8'))
+      self._update(
+        data['reasons'], data.get('etag'), data.get('modified'),
+        data.get('fetched'))
+    except (IOError, OSError):
+      pass
+    except (ValueError, KeyError, TypeError) as err:
+      log.warning(
+        'ignoring invalid reasons-for-visit snapshot %r: %s', self.path, err)
+
+  #----------------------------------------------------------------------------
+  def save(self):
+    '''
+    Atomically stores a snapshot of the catalogue to `path`.
+    '''
+    data = json.dumps(dict(
+      reasons  = self.reasons,
+      etag     = self.etag,
+      modified = self.modified,
+      fetched  = self.fetched,
+    ))
+    dirname = os.path.dirname(os.path.abspath(self.path))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.canarymd-reasons-')
+    try:
+      with os.fdopen(fd, 'wb') as fp:
+        fp.write(data.encode('utf-8'))
+      os.rename(tmpname, self.path)
+    except Exception:
+      os.unlink(tmpname)
+      raise
+
+#------------------------------------------------------------------------------
+def _code(reason):
+  code = reason.get('code') or reason.get('id')
+  if code is None:
+    return None
+  return six.text_type(code)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import random
+import time
+import email.utils
+
+import requests
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+#------------------------------------------------------------------------------
+class RetryPolicy(object):
+  '''
+  Decides whether and when a failed HTTP request to the Canary servers
+  should be re-attempted. Delays grow exponentially with the attempt
+  number (``backoff * 2 ** attempt``, capped at `maximum`) with "full
+  jitter" applied, unless the server specifies a ``Retry-After``
+  header, which is honoured.
+
+  Only requests that are known to be safe to re-send are retried:
+
+  * idempotent methods (see `idempotent`) that failed with one of the
+    `statuses` or with a connection error;
+
+  * any method that the server rejected without processing, i.e. a
+    ``429`` response or any of the `statuses` accompanied by a
+    ``Retry-After`` header;
+
+  * any method that failed to connect to the server at all.
+  '''
+
+  IDEMPOTENT = frozenset(['get', 'head', 'put', 'delete', 'options'])
+  STATUSES   = frozenset([429, 502, 503, 504])
+
+  #----------------------------------------------------------------------------
+  def __init__(self, retries=3, backoff=0.5, maximum=30,
+               statuses=STATUSES, idempotent=IDEMPOTENT):
+    self.retries    = retries
+    self.backoff    = backoff
+    self.maximum    = maximum
+    self.statuses   = frozenset(statuses)
+    self.idempotent = frozenset(idempotent)
+
+  #----------------------------------------------------------------------------
+  def delay(self, method, attempt, res=None, error=None):
+    '''
+    Returns the number of seconds to wait before re-sending a request
+    that has been attempted `attempt` times (starting at 1) and failed
+    with either the response `res` or the exception `error`. Returns
+    ``None`` if the request should not be retried.
+    '''
+    if attempt > self.retries:
+      return None
+    idempotent = method.lower() in self.idempotent
+    if error is not None:
+      if not idempotent and not _unsent(error):
+        return None
+      return self._backoff(attempt)
+    if res.status_code not in self.statuses:
+      return None
+    after = _retryAfter(res.headers.get('retry-after'))
+    if not idempotent and after is None and res.status_code != 429:
+      return None
+    if after is not None:
+      return min(after, self.maximum)
+    return self._backoff(attempt)
+
+  #----------------------------------------------------------------------------
+  def _backoff(self, attempt):
+    return random.uniform(0, min(self.maximum, self.backoff * 2 ** attempt))
+
+#------------------------------------------------------------------------------
+def _unsent(error):
+  # returns true if `error` guarantees that the request never reached
+  # the server, i.e. a connection could not be established
+  if isinstance(error, requests.exceptions.ConnectTimeout):
+    return True
+  reason = getattr(error.args[0] if error.args else None, 'reason', None)
+  return isinstance(reason, NewConnectionError)
+
+#------------------------------------------------------------------------------
+def _retryAfter(value):
+  if not value:
+    return None
+  try:
+    return max(0, float(value))
+  except ValueError:
+    pass
+  when = email.utils.parsedate_tz(value)
+  if when is None:
+    return None
+  return max(0, email.utils.mktime_tz(when) - time.time())
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Persistent server sessions, see the `session_store` parameter of
+:class:`canarymd.Client`. A session store keeps the session cookies
+of authenticated clients (and when they expire), keyed by API root
+and principal, so that new clients -- e.g. in the next cron run or
+after a container restart -- can continue a still-valid session
+instead of logging in again.
+'''
+
+import base64
+import contextlib
+import errno
+import hashlib
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+import six
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+#------------------------------------------------------------------------------
+
+log = logging.getLogger(__name__)
+
+#------------------------------------------------------------------------------
+KDF_ITERATIONS = 100000
+
+#------------------------------------------------------------------------------
+def dumpCookies(jar):
+  '''
+  Returns the cookies in the cookie jar `jar` as a JSON-serializable
+  list.
+  '''
+  return [
+    dict(name=cookie.name, value=cookie.value, domain=cookie.domain,
+         path=cookie.path, expires=cookie.expires, secure=cookie.secure)
+    for cookie in jar]
+
+#------------------------------------------------------------------------------
+def loadCookies(jar, cookies):
+  '''
+  Replaces the cookies in the cookie jar `jar` with `cookies`, as
+  returned by :func:`dumpCookies`.
+  '''
+  jar.clear()
+  for cookie in cookies:
+    jar.set_cookie(requests.cookies.create_cookie(**cookie))
+
+#------------------------------------------------------------------------------
+def _key(root, principal):
+  return hashlib.sha256(
+    (root + '\0' + principal).encode('utf-8')).hexdigest()
+
+#------------------------------------------------------------------------------
+def _credentialDigest(root, principal, credential):
+  # binds a plain-text session to the credential it was created with,
+  # without storing the credential itself
+  return hmac.new(
+    six.text_type(credential or '').encode('utf-8'),
+    (root + '\0' + principal).encode('utf-8'), hashlib.sha256).hexdigest()
+
+#------------------------------------------------------------------------------
+class SessionStore(object):
+  '''
+  Abstract base class of session stores. Each session is a
+  dictionary with the `cookies` (as returned by :func:`dumpCookies`)
+  and the time the session `expires`. Subclasses implement
+  :meth:`load`, :meth:`save`, :meth:`discard` and, to prevent clients
+  in several processes from logging in at the same time,
+  :meth:`lock`.
+  '''
+
+  #----------------------------------------------------------------------------
+  def load(self, root, principal, credential):
+    '''
+    Returns the stored session of `principal` at `root`, or ``None``.
+    The `credential` is provided for stores that encrypt sessions
+    with it.
+    '''
+    raise NotImplementedError()
+
+  #----------------------------------------------------------------------------
+  def save(self, root, principal, credential, session):
+    raise NotImplementedError()
+
+  #----------------------------------------------------------------------------
+  def discard(self, root, principal):
+    raise NotImplementedError()
+
+  #----------------------------------------------------------------------------
+  @contextlib.contextmanager
+  def lock(self, root, principal):
+    '''
+    A context manager that holds an exclusive lock on the session of
+    `principal` at `root` while a client logs in.
+    '''
+    yield
+
+#------------------------------------------------------------------------------
+class FileSessionStore(SessionStore):
+  '''
+  A session store that keeps each session in a file in the directory
+  `path` (which is created if needed, with owner-only permissions).
+  Logins are serialized across processes with ``flock()`` where
+  available.
+
+  By default, sessions are encrypted with a key derived from the
+  client's credential, which requires the `cryptography` package
+  (``pip install canarymd[crypto]``): the files are useless without
+  the credential, and sessions stored with a previous credential are
+  ignored. Alternatively, a `secret` (any string) can be specified
+  to derive the key from instead. Setting `encrypt` to false stores
+  sessions in plain text and does not require `cryptography`; a
+  keyed digest of the credential is then stored with each session,
+  so that sessions are still only resumed with the same credential.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, path, encrypt=True, secret=None):
+    if encrypt:
+      try:
+        from cryptography.fernet import Fernet, InvalidToken
+      except ImportError:
+        raise ImportError(
+          'encrypted session stores require the "cryptography" package'
+          ' (or use encrypt=False)')
+      self._fernet  = Fernet
+      self._invalid = InvalidToken
+    self.path     = path
+    self.encrypt  = bool(encrypt)
+    self.secret   = secret
+    self._keys    = dict()
+    self._lock    = threading.Lock()
+    if not os.path.isdir(path):
+      try:
+        os.makedirs(path, 0o700)
+      except OSError as err:
+        if err.errno != errno.EEXIST:
+          raise
+
+  #----------------------------------------------------------------------------
+  def _filename(self, root, principal, ext='.session'):
+    return os.path.join(self.path, _key(root, principal) + ext)
+
+  #----------------------------------------------------------------------------
+  def _cipher(self, root, principal, credential):
+    # key derivation is deliberately slow, so keys are cached
+    secret = self.secret if self.secret is not None else credential
+    cid = hashlib.sha256(
+      repr((root, principal, secret)).encode('utf-8')).digest()
+    with self._lock:
+      ret = self._keys.get(cid)
+    if ret is None:
+      key = hashlib.pbkdf2_hmac(
+        'sha256', six.text_type(secret or '').encode('utf-8'),
+        _key(root, principal).encode('ascii'), KDF_ITERATIONS, 32)
+      ret = self._fernet(base64.urlsafe_b64encode(key))
+      with self._lock:
+        self._keys[cid] = ret
+    return ret
+
+  #----------------------------------------------------------------------------
+  def load(self, root, principal, credential):
+    try:
+      with open(self._filename(root, principal), 'rb') as fp:
+        data = fp.read()
+    except (IOError, OSError):
+      return None
+    try:
+      if self.encrypt:
+        data = self._cipher(root, principal, credential).decrypt(data)
+      ret = json.loads(data.decode('utf-8'))
+    except self._errors():
+      log.info('ignoring unreadable stored session of %r', principal)
+      return None
+    if not self.encrypt:
+      digest = ret.pop('credential_hmac', None)
+      if not isinstance(digest, six.string_types) or not hmac.compare_digest(
+          str(digest), _credentialDigest(root, principal, credential)):
+        log.info('ignoring stored session of %r with another credential',
+                 principal)
+        return None
+    if not ret.get('expires') or ret['expires'] < time.time():
+      return None
+    return ret
+
+  #----------------------------------------------------------------------------
+  def _errors(self):
+    if self.encrypt:
+      return (ValueError, self._invalid)
+    return (ValueError,)
+
+  #----------------------------------------------------------------------------
+  def save(self, root, principal, credential, session):
+    if self.encrypt:
+      data = self._cipher(root, principal, credential).encrypt(
+        json.dumps(session).encode('utf-8'))
+    else:
+      data = json.dumps(dict(session, credential_hmac=_credentialDigest(
+        root, principal, credential))).encode('utf-8')
+    fd, tmpname = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+    try:
+      with os.fdopen(fd, 'wb') as fp:
+        fp.write(data)
+      os.rename(tmpname, self._filename(root, principal))
+    except Exception:
+      os.unlink(tmpname)
+      raise
+
+  #----------------------------------------------------------------------------
+  def discard(self, root, principal):
+    try:
+      os.unlink(self._filename(root, principal))
+    except OSError:
+      pass
+
+  #----------------------------------------------------------------------------
+  @contextlib.contextmanager
+  def lock(self, root, principal):
+    if fcntl is None:
+      yield
+      return
+    fd = os.open(
+      self._filename(root, principal, '.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      yield
+    finally:
+      os.close(fd)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Incremental extraction of the `content` of a selection response, see
+the `stream` parameter of :meth:`canarymd.Client.select`.
+'''
+
+import json
+
+#------------------------------------------------------------------------------
+STREAM_CHUNK_SIZE = 65536
+
+_ESCAPES = {
+  b'"'  : b'"',
+  b'\\' : b'\\',
+  b'/'  : b'/',
+  b'b'  : b'\b',
+  b'f'  : b'\f',
+  b'n'  : b'\n',
+  b'r'  : b'\r',
+  b't'  : b'\t',
+}
+
+_REPLACEMENT = b'\xef\xbf\xbd'
+
+#------------------------------------------------------------------------------
+class ContentStream(object):
+  '''
+  Scans a JSON selection response that is fed in arbitrarily-sized
+  chunks of UTF-8 encoded bytes (see :meth:`feed`) and writes the
+  un-escaped, UTF-8 encoded value of the top-level ``content`` string
+  to the binary file-like object `output` as it is scanned. All other
+  parts of the response are collected and returned, parsed, by
+  :meth:`close` -- with ``content`` set to ``None``. Only the
+  (typically small) selection metadata is therefore held in memory.
+
+  The number of bytes written to `output` is available as `size`.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, output):
+    self.output   = output
+    self.size     = 0
+    self._meta    = bytearray()
+    self._depth   = 0
+    self._string  = False   # scanning a metadata string
+    self._escaped = False   # ... and the previous byte was a backslash
+    self._key     = None    # the top-level key being scanned, if any
+    self._lastkey = None
+    self._expect  = False   # a top-level key is expected next
+    self._value   = False   # the value of "content" is expected next
+    self._content = False   # scanning the "content" string
+    self._esc     = None    # a partial escape sequence in "content"
+    self._high    = None    # a pending high surrogate in "content"
+
+  #----------------------------------------------------------------------------
+  def feed(self, chunk):
+    '''
+    Scans the next `chunk` of bytes of the response.
+    '''
+    pos = 0
+    end = len(chunk)
+    while pos < end:
+      if self._content:
+        pos = self._feedContent(chunk, pos, end)
+      else:
+        pos = self._feedMeta(chunk, pos, end)
+
+  #----------------------------------------------------------------------------
+  def close(self):
+    '''
+    Returns the parsed selection response without its ``content``.
+    Raises ValueError if the response was truncated or is invalid.
+    '''
+    if self._content or self._string or self._depth or not self._meta:
+      raise ValueError('truncated selection response')
+    return json.loads(bytes(self._meta).decode('utf-8'))
+
+  #----------------------------------------------------------------------------
+  def _write(self, data):
+    if data:
+      self.output.write(data)
+      self.size += len(data)
+
+  #----------------------------------------------------------------------------
+  def _feedMeta(self, chunk, pos, end):
+    meta = self._meta
+    while pos < end:
+      char = chunk[pos:pos + 1]
+      pos += 1
+      if self._string:
+        meta += char
+        if self._escaped:
+          self._escaped = False
+        elif char == b'\\':
+          self._escaped = True
+        elif char == b'"':
+          self._string = False
+          if self._key is not None:
+            self._lastkey, self._key = bytes(self._key), None
+        elif self._key is not None:
+          self._key += char
+        continue
+      if self._value:
+        if char in b' \t\r\n':
+          meta += char
+          continue
+        self._value = False
+        if char == b'"':
+          # replace the content with `null` and stream it instead
+          meta += b'null'
+          self._content = True
+          return pos
+      meta += char
+      if char == b'"':
+        self._string = True
+        if self._depth == 1 and self._expect:
+          self._key    = bytearray()
+          self._expect = False
+      elif char in b'{[':
+        self._depth += 1
+        self._expect = self._depth == 1
+      elif char in b'}]':
+        self._depth -= 1
+      elif self._depth == 1:
+        if char == b',':
+          self._expect = True
+        elif char == b':' and self._lastkey == b'content':
+          self._value = True
+    return pos
+
+  #----------------------------------------------------------------------------
+  def _feedContent(self, chunk, pos, end):
+    if self._esc is not None:
+      return self._feedEscape(chunk, pos, end)
+    quote = chunk.find(b'"', pos, end)
+    slash = chunk.find(b'\\', pos, end)
+    if slash >= 0 and ( quote < 0 or slash < quote ):
+      stop = slash
+    else:
+      stop = quote
+    if stop < 0:
+      stop = end
+    if stop > pos:
+      self._flushHigh()
+      self._write(chunk[pos:stop])
+    if stop == end:
+      return end
+    if stop == quote:
+      self._flushHigh()
+      self._content = False
+    else:
+      self._esc = bytearray()
+    return stop + 1
+
+  #----------------------------------------------------------------------------
+  def _feedEscape(self, chunk, pos, end):
+    esc = self._esc
+    while pos < end:
+      esc += chunk[pos:pos + 1]
+      pos += 1
+      if esc[:1] != b'u':
+        self._esc = None
+        self._flushHigh()
+        self._write(_ESCAPES.get(bytes(esc), _REPLACEMENT))
+        return pos
+      if len(esc) == 5:
+        self._esc = None
+        try:
+          code = int(bytes(esc[1:]).decode('ascii'), 16)
+        except ValueError:
+          self._flushHigh()
+          self._write(_REPLACEMENT)
+          return pos
+        self._codepoint(code)
+        return pos
+    return pos
+
+  #----------------------------------------------------------------------------
+  def _codepoint(self, code):
+    if 0xdc00 <= code <= 0xdfff and self._high is not None:
+      code = 0x10000 + ( ( self._high - 0xd800 ) << 10 ) + ( code - 0xdc00 )
+      self._high = None
+      self._write(_utf8(code))
+      return
+    self._flushHigh()
+    if 0xd800 <= code <= 0xdbff:
+      self._high = code
+    elif 0xdc00 <= code <= 0xdfff:
+      self._write(_REPLACEMENT)
+    else:
+      self._write(_utf8(code))
+
+  #----------------------------------------------------------------------------
+  def _flushHigh(self):
+    # a high surrogate that is not followed by a low surrogate
+    if self._high is not None:
+      self._high = None
+      self._write(_REPLACEMENT)
+
+#------------------------------------------------------------------------------
+def _utf8(code):
+  # encodes a code point as UTF-8 without depending on the python
+  # build's unicode width
+  if code < 0x80:
+    return bytearray([code])
+  if code < 0x800:
+    return bytearray([0xc0 | code >> 6, 0x80 | code & 0x3f])
+  if code < 0x10000:
+    return bytearray([
+      0xe0 | code >> 12, 0x80 | code >> 6 & 0x3f, 0x80 | code & 0x3f])
+  return bytearray([
+    0xf0 | code >> 18, 0x80 | code >> 12 & 0x3f,
+    0x80 | code >> 6 & 0x3f, 0x80 | code & 0x3f])
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
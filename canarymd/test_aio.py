@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import socket
+import time
+
+from six.moves.http_cookies import SimpleCookie
+
+from . import client
+from .codec import getCodec
+from .mock import MockServer
+
+try:
+  import asyncio
+  import aiohttp
+  from . import aio
+except (ImportError, SyntaxError):
+  aio = None
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+def unusedPort():
+  sock = socket.socket()
+  try:
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1]
+  finally:
+    sock.close()
+
+#------------------------------------------------------------------------------
+class TestAsyncClient(unittest.TestCase):
+
+  def setUp(self):
+    if aio is None:
+      raise unittest.SkipTest('requires python 3 and aiohttp')
+    client._versions.clear()
+    self.clients = []
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+
+  def tearDown(self):
+    for cli in self.clients:
+      self.loop.run_until_complete(cli.close())
+    self.loop.close()
+    asyncio.set_event_loop(None)
+
+  #----------------------------------------------------------------------------
+  def makeClient(self, server, credential='pass', **kw):
+    cli = aio.AsyncClient('user', credential, root=server.root, **kw)
+    self.clients.append(cli)
+    return cli
+
+  #----------------------------------------------------------------------------
+  def run_(self, coro):
+    return self.loop.run_until_complete(coro)
+
+  #----------------------------------------------------------------------------
+  def test_v2(self):
+    with MockServer(api='v2') as server:
+      cli = self.makeClient(server)
+      selection = self.run_(cli.select('ctx', PEO))
+      self.assertIn('<p>r1</p>', selection.content)
+      self.assertEqual(len(selection.items), 3)
+      self.assertTrue(cli.root.endswith('/v2'))
+      version = self.run_(cli.version())
+      self.assertEqual(version.api, 'v2')
+      self.assertIsNotNone(version.server)
+      self.assertEqual(server.stats['logins'], 1)
+
+  #----------------------------------------------------------------------------
+  def test_v1(self):
+    with MockServer(api='v1') as server:
+      cli = self.makeClient(server)
+      selection = self.run_(cli.select('ctx', PEO))
+      self.assertIn('<p>r1</p>', selection.content)
+      self.assertEqual(self.run_(cli.version()).api, 'v1')
+      self.assertEqual(cli.root, server.root)
+
+  #----------------------------------------------------------------------------
+  def test_reauthentication(self):
+    with MockServer() as server:
+      cli = self.makeClient(server)
+      self.run_(cli.select('ctx', PEO))
+      server.expireSessions()
+      self.assertIsNotNone(self.run_(cli.select('ctx', PEO)))
+      self.assertEqual(server.stats['unauthorized'], 1)
+      self.assertEqual(server.stats['logins'], 2)
+      self.assertEqual(server.stats['selections'], 2)
+
+  #----------------------------------------------------------------------------
+  def test_session_expiry(self):
+    with MockServer() as server:
+      cli = self.makeClient(server)
+      self.run_(cli.authenticate())
+      self.assertTrue(
+        cli._expires - time.time() > client.DEFAULT_SESSION_TTL - 5)
+      # a cookie that expires before the session TTL shortens it, as
+      # for `canarymd.Client`
+      cookie = SimpleCookie()
+      cookie['lb'] = 'node1'
+      cookie['lb']['max-age'] = 60
+      cli.session.cookie_jar.update_cookies(cookie)
+      self.run_(cli._authenticate(stale=cli._authgen))
+      self.assertTrue(55 < cli._expires - time.time() <= 60)
+
+  #----------------------------------------------------------------------------
+  def test_errors(self):
+    with MockServer(principal='user', credential='pass') as server:
+      with self.assertRaises(client.AuthorizationError):
+        self.run_(self.makeClient(server, 'wrong').select('ctx', PEO))
+      cli = self.makeClient(server)
+      with self.assertRaises(client.ValidationError):
+        self.run_(cli.select('ctx', dict(PEO, transport='paper')))
+      server.error_rate = 1
+      with self.assertRaises(client.ProtocolError) as cm:
+        self.run_(cli.select('ctx', PEO))
+      self.assertIn('503', str(cm.exception))
+      with self.assertRaises(client.ProtocolError) as cm:
+        self.run_(cli.reasons())
+    # connection failures are protocol errors too
+    cli = aio.AsyncClient(
+      'user', 'pass', root='http://127.0.0.1:%d/api' % (unusedPort(),))
+    self.clients.append(cli)
+    with self.assertRaises(client.ProtocolError):
+      self.run_(cli.select('ctx', PEO))
+
+  #----------------------------------------------------------------------------
+  def test_cookie_expiry(self):
+    cookie = SimpleCookie()
+    cookie['session'] = 'abc'
+    self.assertIsNone(aio._cookieExpiry(cookie['session']))
+    cookie['session']['max-age'] = 60
+    expires = aio._cookieExpiry(cookie['session']) - time.time()
+    self.assertTrue(59 < expires <= 60)
+    cookie = SimpleCookie()
+    cookie['session'] = 'abc'
+    cookie['session']['expires'] = 'Wed, 21 Oct 2026 07:28:00 GMT'
+    self.assertEqual(aio._cookieExpiry(cookie['session']), 1792567680)
+    # the first of the TTL and the cookies' expiry wins
+    now = time.time()
+    self.assertTrue(
+      now + 9 < client._sessionExpiry(10, [None, now + 60]) < now + 11)
+    self.assertEqual(client._sessionExpiry(10, [now + 5, None]), now + 5)
+
+  #----------------------------------------------------------------------------
+  def test_response_codec(self):
+    res = aio._Response(200, 'OK', {}, b'{"a": [1]}', getCodec('json'))
+    self.assertEqual(res.json(), {'a': [1]})
+    res = aio._Response(502, 'Bad Gateway', {}, b'<html>', getCodec('json'))
+    self.assertRaises(ValueError, res.json)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
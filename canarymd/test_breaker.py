@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import time
+
+from . import client
+from .breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from .mock import MockServer
+from .test_client import FakeResponse, makeClient, v2handler
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+class TestCircuitBreaker(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_open(self):
+    breaker = CircuitBreaker(window=4, min_requests=4, reset_timeout=60)
+    for status in (200, 503, 200):
+      self.assertTrue(breaker.allow('/a'))
+      breaker.record('/a', status, 0.1)
+    self.assertEqual(breaker.state('/a'), CLOSED)
+    self.assertTrue(breaker.allow('/a'))
+    breaker.record('/a', failed=True)
+    self.assertEqual(breaker.state('/a'), OPEN)
+    self.assertFalse(breaker.allow('/a'))
+    # other endpoints are not affected
+    self.assertTrue(breaker.allow('/b'))
+    health = breaker.health()
+    self.assertFalse(health.healthy)
+    self.assertEqual(health.endpoints['/a'].state, OPEN)
+    self.assertEqual(health.endpoints['/a'].failures, 2)
+    self.assertTrue(59 < health.endpoints['/a'].retry_in <= 60)
+    breaker.reset()
+    self.assertTrue(breaker.health().healthy)
+
+  #----------------------------------------------------------------------------
+  def test_outcomes(self):
+    breaker = CircuitBreaker(window=2, min_requests=2, latency=0.5)
+    # client errors and neutral outcomes are not failures...
+    breaker.record('/a', 400, 0.1)
+    breaker.record('/a')
+    breaker.record('/a', 200, 0.1)
+    self.assertEqual(breaker.state('/a'), CLOSED)
+    # ... but slow responses are
+    breaker.record('/a', 200, 0.6)
+    breaker.record('/a', 429, 0.1)
+    self.assertEqual(breaker.state('/a'), OPEN)
+
+  #----------------------------------------------------------------------------
+  def test_half_open(self):
+    breaker = CircuitBreaker(
+      window=1, min_requests=1, reset_timeout=0.05, probes=2)
+    breaker.record('/a', 503)
+    self.assertFalse(breaker.allow('/a'))
+    time.sleep(0.06)
+    self.assertEqual(breaker.state('/a'), HALF_OPEN)
+    # only `probes` requests at a time...
+    self.assertTrue(breaker.allow('/a'))
+    self.assertTrue(breaker.allow('/a'))
+    self.assertFalse(breaker.allow('/a'))
+    breaker.record('/a', 200)
+    self.assertEqual(breaker.state('/a'), HALF_OPEN)
+    # ... and a failed probe re-opens the circuit
+    breaker.record('/a', 502)
+    self.assertEqual(breaker.state('/a'), OPEN)
+    self.assertEqual(breaker.health().endpoints['/a'].opened, 2)
+    time.sleep(0.06)
+    for _ in range(2):
+      self.assertTrue(breaker.allow('/a'))
+      breaker.record('/a', 200)
+    self.assertEqual(breaker.state('/a'), CLOSED)
+    self.assertTrue(breaker.allow('/a'))
+
+  #----------------------------------------------------------------------------
+  def test_endpoint_names(self):
+    root = 'https://api.canary.md/api'
+    fid = '9f1c2b3a4d5e6f708192a3b4c5d6e7f8'
+    self.assertEqual(
+      client._endpointName(root, root + '/v2/selection?x=1'), '/v2/selection')
+    self.assertEqual(
+      client._endpointName(root, root + '/v2/cma/%s/chunk/12' % (fid,)),
+      '/v2/cma/{id}/chunk/{id}')
+    self.assertEqual(
+      client._endpointName(root, root + '/v2/cma/%s?x=1' % (fid,)),
+      '/v2/cma/{id}')
+
+#------------------------------------------------------------------------------
+class TestClientBreaker(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+    self.failing = True
+
+  #----------------------------------------------------------------------------
+  def handler(self, method, path, data):
+    if path == '/v2/selection' and self.failing:
+      return FakeResponse(503, {'message': 'service unavailable'})
+    return v2handler(method, path, data)
+
+  #----------------------------------------------------------------------------
+  def makeClient(self, **kw):
+    breaker = CircuitBreaker(window=4, min_requests=4, **kw)
+    return makeClient(self.handler, retry=0, circuit_breaker=breaker)
+
+  #----------------------------------------------------------------------------
+  def test_fail_fast(self):
+    cli = self.makeClient(reset_timeout=0.1)
+    for _ in range(4):
+      self.assertRaises(client.ProtocolError, cli.select, 'ctx', PEO)
+    sent = len(cli.session.requests)
+    with self.assertRaises(client.CircuitOpenError) as cm:
+      cli.select('ctx', PEO)
+    self.assertIsInstance(cm.exception, client.ProtocolError)
+    self.assertEqual(len(cli.session.requests), sent)
+    stats = cli.stats()
+    self.assertEqual(stats.circuit_rejected, 1)
+    self.assertEqual(stats.requests, sent)
+    health = cli.health()
+    self.assertFalse(health.healthy)
+    self.assertEqual(health.endpoints['/v2/selection'].state, OPEN)
+    self.assertEqual(health.endpoints['/v2/auth/session'].state, CLOSED)
+    # a probe closes the circuit again once the server recovers
+    self.failing = False
+    time.sleep(0.11)
+    self.assertIsNotNone(cli.select('ctx', PEO))
+    self.assertTrue(cli.health().healthy)
+
+  #----------------------------------------------------------------------------
+  def test_fallback(self):
+    cli = self.makeClient(fallback=None)
+    for _ in range(4):
+      self.assertRaises(client.ProtocolError, cli.select, 'ctx', PEO)
+    self.assertIsNone(cli.select('ctx', PEO))
+    self.assertEqual(
+      cli.select_many('ctx', [PEO, PEO], concurrency=2), [None, None])
+    self.assertEqual(cli.stats().circuit_fallbacks, 3)
+
+  #----------------------------------------------------------------------------
+  def test_default(self):
+    cli = makeClient(circuit_breaker=True)
+    self.assertIsInstance(cli.breaker, CircuitBreaker)
+    self.assertTrue(makeClient().health().healthy)
+
+  #----------------------------------------------------------------------------
+  def test_async(self):
+    try:
+      import asyncio
+      from .aio import AsyncClient
+      import aiohttp
+    except (ImportError, SyntaxError):
+      raise unittest.SkipTest('requires python 3 and aiohttp')
+    with MockServer(error_rate=1) as server:
+      loop = asyncio.new_event_loop()
+      asyncio.set_event_loop(loop)
+      cli = AsyncClient('user', 'pass', root=server.root, circuit_breaker=(
+        CircuitBreaker(window=2, min_requests=2, fallback=None)))
+      try:
+        for _ in range(2):
+          with self.assertRaises(client.ProtocolError):
+            loop.run_until_complete(cli.select('ctx', PEO))
+        self.assertIsNone(loop.run_until_complete(cli.select('ctx', PEO)))
+        self.assertEqual(server.stats['errors'], 2)
+        self.assertFalse(cli.health().healthy)
+      finally:
+        loop.run_until_complete(cli.close())
+        loop.close()
+        asyncio.set_event_loop(None)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+from .cache import canonicalKey, MemoryCache, FileCache
+from .test_client import makeClient
+from . import client
+
+#------------------------------------------------------------------------------
+class TestCanonicalKey(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_ordering_and_hl7_terminators(self):
+    self.assertEqual(
+      canonicalKey('ctx', {'a': 1, 'recipient': 'MSH|x\r\nPID|y\n'}),
+      canonicalKey('ctx', {'recipient': 'MSH|x\rPID|y', 'a': 1}))
+    self.assertEqual(
+      canonicalKey('ctx', {'appointment': {
+        'patients': ['PID|1\nPV1|2\n', 'PID|3'], 'provider': 'PRD|4\r\n'}}),
+      canonicalKey('ctx', {'appointment': {
+        'patients': ['PID|1\rPV1|2', 'PID|3'], 'provider': 'PRD|4'}}))
+
+  #----------------------------------------------------------------------------
+  def test_no_collisions(self):
+    # line breaks and whitespace are significant outside of HL7 segments
+    pairs = [
+      ({'appointment': {'reason': 'x\n'}}, {'appointment': {'reason': 'x'}}),
+      ({'appointment': {'type': 'a\r\nb'}},
+       {'appointment': {'type': 'a\nb'}}),
+      ({'recipient': {'name': 'a\nb'}}, {'recipient': {'name': 'a\rb'}}),
+      ({'recipient': {'name': ' x'}}, {'recipient': {'name': 'x'}}),
+      ({'custom': 'a\r\n'}, {'custom': 'a'}),
+    ]
+    for peo1, peo2 in pairs:
+      self.assertNotEqual(
+        canonicalKey('ctx', peo1), canonicalKey('ctx', peo2), (peo1, peo2))
+
+  #----------------------------------------------------------------------------
+  def test_context_and_namespace(self):
+    key = canonicalKey('ctx', {'a': 1}, namespace=['prod'])
+    self.assertNotEqual(key, canonicalKey('ctx2', {'a': 1}, namespace=['prod']))
+    self.assertNotEqual(key, canonicalKey('ctx', {'a': 1}, namespace=['stg']))
+
+#------------------------------------------------------------------------------
+class TestMemoryCache(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_lru_eviction(self):
+    cache = MemoryCache(maxsize=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    self.assertEqual(cache.get('a'), 'A')
+    cache.set('c', 'C')
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.get('a'), 'A')
+    self.assertEqual(cache.get('c'), 'C')
+    self.assertEqual(cache.stats(), dict(
+      hits=3, misses=1, entries=2, size=2))
+
+  #----------------------------------------------------------------------------
+  def test_size_eviction(self):
+    cache = MemoryCache(maxbytes=10)
+    cache.set('a', 'x' * 6)
+    cache.set('b', 'y' * 6)
+    self.assertIsNone(cache.get('a'))
+    self.assertEqual(cache.size, 6)
+    cache.set('c', 'z' * 11)
+    self.assertEqual(cache.stats()['entries'], 0)
+
+  #----------------------------------------------------------------------------
+  def test_ttl(self):
+    cache = MemoryCache(ttl=-1)
+    cache.set('a', 'A')
+    self.assertIsNone(cache.get('a'))
+    self.assertEqual(cache.size, 0)
+
+#------------------------------------------------------------------------------
+class TestFileCache(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  #----------------------------------------------------------------------------
+  def test_shared_between_instances(self):
+    FileCache(self.tmpdir).set('a', u'é')
+    cache = FileCache(self.tmpdir)
+    self.assertEqual(cache.get('a'), u'é')
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.stats(), dict(hits=1, misses=1))
+
+  #----------------------------------------------------------------------------
+  def test_ttl(self):
+    cache = FileCache(self.tmpdir, ttl=-1)
+    cache.set('a', 'A')
+    self.assertIsNone(cache.get('a'))
+
+  #----------------------------------------------------------------------------
+  def test_prune(self):
+    cache = FileCache(self.tmpdir, maxsize=10)
+    for idx in range(10):
+      cache.set('k%d' % (idx,), 'v')
+      os.utime(cache._filename('k%d' % (idx,)), (idx, time.time()))
+    self.assertEqual(len(os.listdir(self.tmpdir)), 10)
+    cache.set('k10', 'v')
+    names = sorted(os.listdir(self.tmpdir))
+    self.assertEqual(len(names), 9)
+    self.assertNotIn('k0.json', names)
+    self.assertIn('k10.json', names)
+
+#------------------------------------------------------------------------------
+class TestClientCache(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_hits_and_namespacing(self):
+    cache = MemoryCache()
+    peo   = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+    cli   = makeClient(cache=cache)
+    first = cli.select('ctx', peo)
+    self.assertEqual(cli.select('ctx', dict(peo)).id, first.id)
+    self.assertEqual(cli.session.requests.count(('post', '/v2/selection')), 1)
+    self.assertEqual(cli.stats().cache_hits, 1)
+    other = makeClient(cache=cache, root='http://other.test/api')
+    other.select('ctx', peo)
+    self.assertEqual(other.stats().cache_misses, 1)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
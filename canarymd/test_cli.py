@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+from aadict import aadict
+
+from . import cli, client
+from .mock import MockServer
+
+#------------------------------------------------------------------------------
+class Crash(Exception): pass
+
+#------------------------------------------------------------------------------
+class FakeSelection(object):
+  def __init__(self, recipient):
+    self.id      = 'sel-' + recipient
+    self.content = recipient
+    self.items   = [aadict(channel_id='c1')]
+
+#------------------------------------------------------------------------------
+class FakeClient(object):
+  # implements `iselect_many` by echoing the recipient, optionally
+  # "crashing" after `crashAfter` results
+  def __init__(self, crashAfter=None):
+    self.crashAfter = crashAfter
+  def iselect_many(self, context, peos, concurrency=None, timeout=None,
+                   ordered=False):
+    for idx, peo in enumerate(peos):
+      if self.crashAfter is not None and idx >= self.crashAfter:
+        raise Crash()
+      if 'recipient' not in peo:
+        yield idx, client.Error('invalid PEO')
+        continue
+      yield idx, FakeSelection(peo['recipient'])
+
+#------------------------------------------------------------------------------
+class TestSelectBatch(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.input  = os.path.join(self.tmpdir, 'in.jsonl')
+    self.output = os.path.join(self.tmpdir, 'out.jsonl')
+    with open(self.input, 'w') as fp:
+      for idx in range(250):
+        fp.write('garbage\n' if idx == 7
+                 else json.dumps({'recipient': 'r%d' % (idx,)}) + '\n')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  #----------------------------------------------------------------------------
+  def options(self, **kw):
+    opts = dict(
+      datafile=self.input, output=self.output, context='ctx',
+      concurrency=2, timeout=None, offset=None, checkpoint=None)
+    opts.update(kw)
+    return argparse.Namespace(**opts)
+
+  #----------------------------------------------------------------------------
+  def records(self):
+    with open(self.output) as fp:
+      return [json.loads(line) for line in fp]
+
+  #----------------------------------------------------------------------------
+  def test_output(self):
+    self.assertEqual(cli.selectBatch(FakeClient(), self.options(), {}), 0)
+    records = self.records()
+    self.assertEqual([rec['index'] for rec in records], list(range(250)))
+    self.assertEqual(records[0], dict(
+      index=0, id='sel-r0', items=['c1'], content='r0'))
+    self.assertTrue(records[7]['error'].startswith('invalid JSON data'))
+
+  #----------------------------------------------------------------------------
+  def test_offset(self):
+    cli.selectBatch(FakeClient(), self.options(offset=240), {})
+    self.assertEqual(
+      [rec['index'] for rec in self.records()], list(range(240, 250)))
+
+  #----------------------------------------------------------------------------
+  def test_resume_from_checkpoint(self):
+    checkpoint = os.path.join(self.tmpdir, 'checkpoint')
+    options = self.options(checkpoint=checkpoint)
+    with self.assertRaises(Crash):
+      cli.selectBatch(FakeClient(crashAfter=230), options, {})
+    with open(checkpoint) as fp:
+      self.assertEqual(fp.read().split()[0], '200')
+    cli.selectBatch(FakeClient(), options, {})
+    self.assertEqual(
+      [rec['index'] for rec in self.records()], list(range(250)))
+    with open(checkpoint) as fp:
+      self.assertEqual(fp.read().split()[0], '250')
+
+  #----------------------------------------------------------------------------
+  def test_processes(self):
+    client._versions.clear()
+    with MockServer() as server:
+      ret = cli.main([
+        '--root', server.root, '--username', 'user', '--password', 'pass',
+        '--context', 'ctx', '--processes', '2', '--concurrency', '3',
+        '--output', self.output, 'select-batch', self.input])
+      self.assertEqual(server.stats['logins'], 1)
+    self.assertEqual(ret, 0)
+    records = self.records()
+    self.assertEqual([rec['index'] for rec in records], list(range(250)))
+    self.assertIn('invalid JSON data', records[7]['error'])
+    self.assertEqual(len(records[8]['items']), 3)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import json
+import threading
+import time
+import random
+import pickle
+
+from . import client
+
+#------------------------------------------------------------------------------
+class FakeResponse(object):
+  def __init__(self, status_code, data=None, headers=None, reason=None):
+    self.status_code = status_code
+    self.text        = json.dumps(data) if data is not None else ''
+    self.content     = self.text.encode('utf-8')
+    self.headers     = headers or {}
+    self.reason      = reason
+  def json(self):
+    return json.loads(self.text)
+  def iter_content(self, chunk_size=1):
+    data = self.text.encode('utf-8')
+    for idx in range(0, len(data), chunk_size):
+      yield data[idx:idx + chunk_size]
+  def close(self):
+    pass
+
+#------------------------------------------------------------------------------
+class FakeSession(object):
+  '''
+  A stand-in for a `requests.Session` that dispatches requests to a
+  ``handler(method, path, data)`` callable, where `path` is the URL
+  with the root stripped, and records all requests.
+  '''
+  def __init__(self, root, handler):
+    self.root     = root
+    self.handler  = handler
+    self.requests = []
+    self.cookies  = []
+    self.headers  = {}
+  def request(self, method, url, data=None, **kw):
+    path = url[len(self.root):]
+    self.requests.append((method, path))
+    return self.handler(method, path, data)
+
+#------------------------------------------------------------------------------
+def v2handler(method, path, data):
+  if path == '/version':
+    return FakeResponse(200, {'apis': ['v2'], 'server': '2.0.0'})
+  if path == '/v2/auth/session':
+    return FakeResponse(200, {})
+  if path == '/v2/selection':
+    peo = json.loads(data)['selection']['peo']
+    return FakeResponse(200, {
+      'selection'       : {'id': 'sel-' + str(peo.get('recipient'))},
+      'selectionitems'  : [{'channel_id': 'c1'}],
+      'content'         : '<p>%s</p>' % (peo.get('recipient'),),
+    })
+  return FakeResponse(404, {'message': 'not found'})
+
+#------------------------------------------------------------------------------
+def makeClient(handler=v2handler, **kw):
+  root = kw.pop('root', 'http://canary.test/api')
+  ret = client.Client('user', 'pass', root=root, **kw)
+  ret.session = FakeSession(root, handler)
+  return ret
+
+#------------------------------------------------------------------------------
+class TestClientVersion(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_negotiation_is_lazy(self):
+    cli = makeClient()
+    self.assertEqual(cli.session.requests, [])
+    self.assertEqual(cli.version().api, 'v2')
+    self.assertEqual(cli.root, 'http://canary.test/api/v2')
+
+  #----------------------------------------------------------------------------
+  def test_negotiation_is_cached(self):
+    makeClient().version()
+    cli = makeClient()
+    cli.authenticate()
+    self.assertEqual(cli.session.requests, [('post', '/v2/auth/session')])
+
+  #----------------------------------------------------------------------------
+  def test_pinned_version_is_kept(self):
+    cli = makeClient(api='v1')
+    version = cli.version()
+    self.assertEqual(version.api, 'v1')
+    self.assertEqual(version.server, '2.0.0')
+    self.assertEqual(cli.root, 'http://canary.test/api')
+
+#------------------------------------------------------------------------------
+class TestImap(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def _slow(self, value):
+    time.sleep(random.random() * 0.005)
+    if value == 13:
+      raise ValueError('unlucky')
+    return value * 2
+
+  #----------------------------------------------------------------------------
+  def test_ordered(self):
+    res = list(client._imap(self._slow, range(50), 4, True))
+    self.assertEqual([idx for idx, val in res], list(range(50)))
+    self.assertEqual(res[3], (3, 6))
+    self.assertIsInstance(res[13][1], ValueError)
+
+  #----------------------------------------------------------------------------
+  def test_unordered(self):
+    res = list(client._imap(self._slow, iter(range(50)), 4, False))
+    self.assertEqual(sorted(idx for idx, val in res), list(range(50)))
+    self.assertEqual(dict(res)[20], 40)
+
+  #----------------------------------------------------------------------------
+  def test_empty(self):
+    self.assertEqual(list(client._imap(self._slow, [], 4, True)), [])
+
+  #----------------------------------------------------------------------------
+  def test_window(self):
+    # the input must not be consumed more than 2 * concurrency ahead of
+    # the consumer, even if the head-of-line item is slow
+    pulled  = []
+    release = threading.Event()
+    def source():
+      for idx in range(100):
+        pulled.append(idx)
+        yield idx
+    def func(value):
+      if value == 0:
+        release.wait(5)
+      return value
+    gen = client._imap(func, source(), 3, True)
+    thread = threading.Thread(target=lambda: next(gen))
+    thread.start()
+    time.sleep(0.05)
+    self.assertEqual(len(pulled), 6)
+    release.set()
+    thread.join()
+    self.assertEqual(len(list(gen)), 99)
+
+#------------------------------------------------------------------------------
+class TestSelectMany(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_results_and_errors(self):
+    cli  = makeClient()
+    peos = [
+      {'transport': 'site', 'purpose': 'discover', 'recipient': 'r%d' % idx}
+      for idx in range(20)]
+    peos[5] = {'transport': 'bogus'}
+    res = cli.select_many('ctx', peos, concurrency=4)
+    self.assertEqual(len(res), 20)
+    self.assertEqual(res[0].content, '<p>r0</p>')
+    self.assertEqual(res[19].id, 'sel-r19')
+    self.assertIsInstance(res[5], client.Error)
+    self.assertIn('invalid/unknown transport', str(res[5]))
+    # concurrent callers share a single login
+    self.assertEqual(cli.stats().logins, 1)
+
+#------------------------------------------------------------------------------
+class TestSelection(unittest.TestCase):
+
+  DATA = {
+    'selection'       : {'id': 'sel-1', 'score': 3},
+    'selectionitems'  : [
+      {'channel_id': 'c1', 'message': {'id': 'm1'}},
+      {'channel_id': 'c2', 'message': {'id': 'm2'}},
+    ],
+    'content'         : '<p>hello</p>',
+  }
+
+  #----------------------------------------------------------------------------
+  def test_lazy(self):
+    sel = client.Selection(json.loads(json.dumps(self.DATA)))
+    self.assertFalse(hasattr(sel, '__dict__'))
+    self.assertEqual(sel.id, 'sel-1')
+    self.assertEqual(sel.content, '<p>hello</p>')
+    self.assertIsNone(sel._data)
+    self.assertEqual([item.channel_id for item in sel.items], ['c1', 'c2'])
+    self.assertEqual(sel.items[1].message.id, 'm2')
+    self.assertEqual(sel.data.selection.score, 3)
+    with self.assertRaises(AttributeError):
+      sel.items[0].nosuchattribute
+
+  #----------------------------------------------------------------------------
+  def test_compact(self):
+    sel = client.Selection(json.loads(json.dumps(self.DATA)), compact=True)
+    self.assertEqual(sel.id, 'sel-1')
+    self.assertEqual([item.channel_id for item in sel.items], ['c1', 'c2'])
+    self.assertIsNone(sel.data)
+    with self.assertRaises(AttributeError):
+      sel.items[0].message
+
+  #----------------------------------------------------------------------------
+  def test_pickle(self):
+    for compact in (False, True):
+      sel = client.Selection(json.loads(json.dumps(self.DATA)), compact=compact)
+      sel.items
+      for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        copy = pickle.loads(pickle.dumps(sel, protocol))
+        self.assertEqual(copy.id, 'sel-1')
+        self.assertEqual(copy.content, sel.content)
+        self.assertEqual([item.channel_id for item in copy.items], ['c1', 'c2'])
+        if not compact:
+          self.assertEqual(copy.items[0].message.id, 'm1')
+
+  #----------------------------------------------------------------------------
+  def test_client_compact(self):
+    client._versions.clear()
+    cli = makeClient(compact=True)
+    sel = cli.select('ctx', {
+      'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'})
+    self.assertEqual(sel.id, 'sel-r1')
+    self.assertEqual(sel.items[0].channel_id, 'c1')
+    self.assertIsNone(sel.data)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
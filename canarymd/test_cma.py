@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+from . import cli, client, cma
+from .mock import MockServer
+from .retry import RetryPolicy
+
+#------------------------------------------------------------------------------
+CHUNK = 1000
+
+#------------------------------------------------------------------------------
+class FlakyFile(io.BytesIO):
+  # fails all reads of whole chunks after the first `good` ones
+  def __init__(self, data, good):
+    super(FlakyFile, self).__init__(data)
+    self.good = good
+  def read(self, size=-1):
+    if size == CHUNK and self.good is not None:
+      if self.good <= 0:
+        raise IOError('disk on fire')
+      self.good -= 1
+    return super(FlakyFile, self).read(size)
+
+#------------------------------------------------------------------------------
+class TestChunkedFile(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_chunks(self):
+    data = os.urandom(2500)
+    self.assertEqual(cma.chunkCount(2500, CHUNK), 3)
+    self.assertEqual(cma.chunkCount(0, CHUNK), 0)
+    self.assertEqual(
+      cma.fileDigest(io.BytesIO(data)),
+      (2500, hashlib.sha256(data).hexdigest()))
+    chunks = cma.ChunkedFile(io.BytesIO(data), CHUNK, len(data))
+    self.assertEqual(chunks.read(2), data[2000:])
+    checksums = [
+      cma.sha256(data[idx:idx + CHUNK]) for idx in range(0, 2500, CHUNK)]
+    self.assertEqual(chunks.verified(checksums), set([0, 1, 2]))
+    chunks.write(1, b'x' * CHUNK)
+    self.assertEqual(chunks.verified(checksums), set([0, 2]))
+    # a short final chunk does not match
+    chunks = cma.ChunkedFile(io.BytesIO(data[:2400]), CHUNK, len(data))
+    self.assertEqual(chunks.verified(checksums), set([0, 1]))
+
+#------------------------------------------------------------------------------
+class TestClientCMA(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+    self.tmpdir = tempfile.mkdtemp()
+    self.data   = os.urandom(10500)
+    self.source = os.path.join(self.tmpdir, 'export.bin')
+    with open(self.source, 'wb') as fp:
+      fp.write(self.data)
+    self.server = MockServer().start()
+    self.cli    = client.Client('user', 'pass', root=self.server.root)
+
+  def tearDown(self):
+    self.server.stop()
+    shutil.rmtree(self.tmpdir)
+
+  #----------------------------------------------------------------------------
+  def path(self, name):
+    return os.path.join(self.tmpdir, name)
+
+  #----------------------------------------------------------------------------
+  def read(self, name):
+    with open(self.path(name), 'rb') as fp:
+      return fp.read()
+
+  #----------------------------------------------------------------------------
+  def test_roundtrip(self):
+    res = self.cli.cma_upload(self.source, chunk_size=CHUNK, concurrency=3)
+    self.assertEqual(res.name, 'export.bin')
+    self.assertEqual(res.size, 10500)
+    self.assertEqual(res.sha256, hashlib.sha256(self.data).hexdigest())
+    self.assertEqual((res.chunks, res.sent, res.resumed), (11, 11, 0))
+    self.assertEqual(self.server.stats['cma_chunks_received'], 11)
+    out = self.cli.cma_download(res.id, self.path('copy.bin'), concurrency=3)
+    self.assertEqual(self.read('copy.bin'), self.data)
+    self.assertEqual((out.chunks, out.fetched, out.resumed), (11, 11, 0))
+    self.assertEqual(out.path, self.path('copy.bin'))
+    self.assertFalse(os.path.exists(self.path('copy.bin.part')))
+    stats = self.cli.stats()
+    self.assertEqual(stats.cma_chunks_sent, 11)
+    self.assertEqual(stats.cma_chunks_received, 11)
+    # one session for everything
+    self.assertEqual(self.server.stats['logins'], 1)
+
+  #----------------------------------------------------------------------------
+  def test_empty(self):
+    res = self.cli.cma_upload(io.BytesIO(), name='empty.bin')
+    self.assertEqual((res.size, res.chunks), (0, 0))
+    self.cli.cma_download(res.id, self.path('empty.bin'))
+    self.assertEqual(self.read('empty.bin'), b'')
+    self.assertRaises(ValueError, self.cli.cma_upload, io.BytesIO(b'data'))
+
+  #----------------------------------------------------------------------------
+  def test_resume_upload(self):
+    source = FlakyFile(self.data, good=4)
+    self.assertRaises(
+      IOError, self.cli.cma_upload, source, name='export.bin',
+      chunk_size=CHUNK, concurrency=1)
+    self.assertEqual(self.server.stats['cma_chunks_received'], 4)
+    source.good = None
+    res = self.cli.cma_upload(source, name='export.bin', chunk_size=CHUNK)
+    self.assertEqual((res.resumed, res.sent), (4, 7))
+    self.assertEqual(self.cli.stats().cma_chunks_sent, 11)
+    self.cli.cma_download(res.id, self.path('copy.bin'))
+    self.assertEqual(self.read('copy.bin'), self.data)
+    # a different file with the same name is a new upload
+    res2 = self.cli.cma_upload(
+      io.BytesIO(self.data[:5000]), name='export.bin', chunk_size=CHUNK)
+    self.assertNotEqual(res2.id, res.id)
+    self.assertEqual(res2.resumed, 0)
+
+  #----------------------------------------------------------------------------
+  def test_resume_download(self):
+    res = self.cli.cma_upload(self.source, chunk_size=CHUNK)
+    # an interrupted download: six chunks, one of them corrupt
+    with open(self.path('copy.bin.part'), 'wb') as fp:
+      fp.write(self.data[:6000])
+      fp.seek(2000)
+      fp.write(b'x' * 10)
+    out = self.cli.cma_download(res.id, self.path('copy.bin'))
+    self.assertEqual((out.resumed, out.fetched), (5, 6))
+    self.assertEqual(self.server.stats['cma_chunks_sent'], 6)
+    self.assertEqual(self.read('copy.bin'), self.data)
+
+  #----------------------------------------------------------------------------
+  def test_corrupt_download(self):
+    res = self.cli.cma_upload(self.source, chunk_size=CHUNK)
+    self.server.files[res.id]['chunks'][3] = b'x' * CHUNK
+    with self.assertRaises(client.ProtocolError) as cm:
+      self.cli.cma_download(res.id, self.path('copy.bin'))
+    self.assertIn('checksum mismatch in chunk 3', str(cm.exception))
+    self.assertFalse(os.path.exists(self.path('copy.bin')))
+    # the chunks that were verified are kept for the next attempt
+    self.assertTrue(os.path.exists(self.path('copy.bin.part')))
+
+  #----------------------------------------------------------------------------
+  def test_server_checksum(self):
+    res = self.cli._req('post', '/cma', dict(upload=dict(
+      name='x', size=3, sha256=cma.sha256(b'abc'), chunk_size=CHUNK)))
+    fid = res.json()['upload']['id']
+    res = self.cli._req('put', '/cma/%s/chunk/0' % (fid,), b'abc', headers={
+      'content-type': 'application/octet-stream',
+      cma.CHECKSUM_HEADER: cma.sha256(b'abd')})
+    self.assertEqual(res.status_code, 400)
+    self.assertEqual(self.server.stats['cma_checksum_errors'], 1)
+    res = self.cli._req('post', '/cma/%s/complete' % (fid,), {})
+    self.assertEqual(res.status_code, 409)
+
+  #----------------------------------------------------------------------------
+  def test_server_chunk_size(self):
+    self.server.max_chunk_size = 4000
+    res = self.cli.cma_upload(self.source, chunk_size=CHUNK * 10)
+    self.assertEqual(res.chunks, 3)
+    self.cli.cma_download(res.id, self.path('copy.bin'))
+    self.assertEqual(self.read('copy.bin'), self.data)
+
+  #----------------------------------------------------------------------------
+  def test_retried_chunks(self):
+    # the chunk PUTs are retried; so are the (resumable) POSTs here
+    self.server.error_rate = 0.3
+    retry = RetryPolicy(retries=20, backoff=0.001, idempotent=(
+      RetryPolicy.IDEMPOTENT | set(['post'])))
+    cli = client.Client('user', 'pass', root=self.server.root, retry=retry)
+    res = cli.cma_upload(self.source, chunk_size=CHUNK, concurrency=4)
+    cli.cma_download(res.id, self.path('copy.bin'), concurrency=4)
+    self.assertEqual(self.read('copy.bin'), self.data)
+
+  #----------------------------------------------------------------------------
+  def test_circuit_breaker(self):
+    breaker = client.CircuitBreaker()
+    cli = client.Client(
+      'user', 'pass', root=self.server.root, circuit_breaker=breaker)
+    res = cli.cma_upload(self.source, chunk_size=CHUNK)
+    cli.cma_download(res.id, self.path('copy.bin'))
+    # one circuit per route, not per file and chunk
+    self.assertEqual(sorted(cli.health().endpoints), [
+      '/v2/auth/session', '/v2/cma', '/v2/cma/{id}', '/v2/cma/{id}/chunk/{id}',
+      '/v2/cma/{id}/complete', '/version'])
+    self.assertEqual(
+      cli.health().endpoints['/v2/cma/{id}/chunk/{id}'].requests, 20)
+
+  #----------------------------------------------------------------------------
+  def test_call_timeout(self):
+    cli = client.Client(
+      'user', 'pass', root=self.server.root, call_timeout=0.2)
+    res = cli.cma_upload(self.source, chunk_size=CHUNK)
+    self.server.latency = 1
+    self.assertRaises(
+      client.TimeoutError, cli.cma_download, res.id, self.path('copy.bin'))
+
+  #----------------------------------------------------------------------------
+  def test_cli(self):
+    args = [
+      '--root', self.server.root, '--username', 'user', '--password', 'pass',
+      '--chunk-size', str(CHUNK), '--concurrency', '2']
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+      self.assertEqual(cli.main(args + ['cma-upload', self.source]), 0)
+      fid = sys.stdout.getvalue().strip()
+      self.assertEqual(cli.main(args + [
+        '--output', self.path('copy.bin'), 'cma-download', fid]), 0)
+    finally:
+      sys.stdout = stdout
+    self.assertEqual(self.read('copy.bin'), self.data)
+    self.assertEqual(self.server.stats['cma_chunks_received'], 11)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import json
+
+from . import client, codec
+from .cache import MemoryCache, canonicalKey
+from .test_client import FakeResponse, makeClient, v2handler
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': u'r\xe9'}
+
+#------------------------------------------------------------------------------
+class TestCodec(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_backends(self):
+    names = codec.available()
+    self.assertEqual(names[-1], 'json')
+    for name in names:
+      backend = codec.getCodec(name)
+      self.assertIs(codec.getCodec(name), backend)
+      data = backend.dumps(PEO)
+      self.assertIsInstance(data, bytes)
+      self.assertEqual(json.loads(data.decode('utf-8')), PEO)
+      self.assertEqual(backend.loads(data), PEO)
+      self.assertEqual(backend.loads(data.decode('utf-8')), PEO)
+      # non-string keys fall back to the standard library's conversion
+      self.assertEqual(backend.loads(backend.dumps({1: 2})), {'1': 2})
+
+  #----------------------------------------------------------------------------
+  def test_default(self):
+    self.assertEqual(codec.getCodec().name, codec.available()[0])
+    backend = codec.StdlibCodec()
+    self.assertIs(codec.getCodec(backend), backend)
+    self.assertIs(makeClient(codec=backend).codec, backend)
+
+  #----------------------------------------------------------------------------
+  def test_errors(self):
+    with self.assertRaises(ValueError):
+      codec.getCodec('yaml')
+    if 'ujson' not in codec.available():
+      with self.assertRaises(ImportError):
+        codec.getCodec('ujson')
+
+#------------------------------------------------------------------------------
+class TestEncodedRequests(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_preencoded_peo(self):
+    bodies = []
+    def handler(method, path, data):
+      if path == '/v2/selection':
+        bodies.append(data)
+      return v2handler(method, path, data)
+    cli = makeClient(handler)
+    sel = cli.select('ctx', json.dumps(PEO).encode('utf-8'), timeout=5)
+    self.assertEqual(sel.content, u'<p>r\xe9</p>')
+    self.assertEqual(json.loads(bodies[0].decode('utf-8')), {
+      'selection' : {'context': 'ctx', 'peo': PEO}, 'timeout': 5})
+    # encoded PEOs are passed through as-is, i.e. not validated
+    self.assertIsNone(client._selectionErrors('ctx', b'{}'))
+    with self.assertRaises(client.ValidationError):
+      cli.select(None, b'{}')
+
+  #----------------------------------------------------------------------------
+  def test_encoded_once(self):
+    state  = dict(expired=True)
+    bodies = []
+    def handler(method, path, data):
+      if path == '/v2/selection':
+        bodies.append(data)
+        if state.pop('expired', False):
+          return FakeResponse(401, {'message': 'session expired'})
+      return v2handler(method, path, data)
+    cli = makeClient(handler)
+    calls = []
+    dumps = cli.codec.dumps
+    def counting(obj):
+      calls.append(obj)
+      return dumps(obj)
+    cli.codec = codec.Codec()
+    cli.codec.dumps = counting
+    cli.codec.loads = codec.getCodec().loads
+    self.assertEqual(cli.select('ctx', PEO).id, u'sel-r\xe9')
+    self.assertEqual(len(bodies), 2)
+    self.assertIs(bodies[0], bodies[1])
+    # one login, one re-login and one selection request
+    self.assertEqual(len(calls), 3)
+
+  #----------------------------------------------------------------------------
+  def test_cache_key(self):
+    self.assertEqual(
+      canonicalKey('ctx', PEO),
+      canonicalKey('ctx', json.dumps(PEO).encode('utf-8')))
+    cli = makeClient(cache=MemoryCache())
+    cli.select('ctx', PEO)
+    sel = cli.select('ctx', bytearray(json.dumps(PEO).encode('utf-8')))
+    self.assertEqual(sel.content, u'<p>r\xe9</p>')
+    self.assertEqual(cli.session.requests.count(('post', '/v2/selection')), 1)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import io
+import json
+import zlib
+
+from . import client
+from .mock import MockServer
+from .test_client import makeClient, v2handler
+
+#------------------------------------------------------------------------------
+PEO = {
+  'transport'   : 'site',
+  'purpose'     : 'prepare',
+  'recipient'   : 'PID|||12345||Doe^Jane',
+  'appointment' : {
+    'time'        : '2014-12-02T18:20:06Z',
+    'patients'    : ['PID|||%d||Doe^Jane' % (idx,) for idx in range(100)],
+    'provider'    : {'name': 'Dr. Who'},
+  },
+}
+
+#------------------------------------------------------------------------------
+class TestCompressBody(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_threshold(self):
+    data = json.dumps(PEO).encode('utf-8')
+    self.assertIsNone(client._compressBody(data, None))
+    self.assertIsNone(client._compressBody(data, len(data) + 1))
+    body = client._compressBody(data, len(data))
+    self.assertLess(len(body), len(data))
+    self.assertEqual(zlib.decompress(body, 31), data)
+    # incompressible bodies are sent as is
+    self.assertIsNone(client._compressBody(b'{}', 1))
+
+  #----------------------------------------------------------------------------
+  def test_option(self):
+    self.assertIsNone(client._compressThreshold(None))
+    self.assertIsNone(client._compressThreshold(False))
+    self.assertEqual(
+      client._compressThreshold(True), client.DEFAULT_COMPRESS_THRESHOLD)
+    self.assertEqual(client._compressThreshold(100), 100)
+
+#------------------------------------------------------------------------------
+class TestClientCompression(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+    self.server = MockServer(compress=True, payload_size=16384).start()
+
+  def tearDown(self):
+    self.server.stop()
+
+  #----------------------------------------------------------------------------
+  def makeClient(self, **kw):
+    return client.Client('user', 'pass', root=self.server.root, **kw)
+
+  #----------------------------------------------------------------------------
+  def test_compressed(self):
+    cli = self.makeClient(compress=True)
+    selection = cli.select('ctx', PEO)
+    self.assertIn('<p>PID|||12345||Doe^Jane</p>', selection.content)
+    self.assertEqual(self.server.stats['compressed_requests'], 1)
+    stats = cli.stats()
+    self.assertEqual(stats.compressed_requests, 1)
+    self.assertGreater(stats.request_bytes_saved, 1000)
+    # the version, login and selection responses
+    self.assertEqual(stats.compressed_responses, 3)
+    self.assertGreater(stats.response_bytes_saved, 10000)
+
+  #----------------------------------------------------------------------------
+  def test_small_bodies(self):
+    cli = self.makeClient(compress=True)
+    cli.select('ctx', dict(PEO, appointment=None))
+    cli = self.makeClient(compress=None)
+    cli.select('ctx', PEO)
+    self.assertEqual(self.server.stats['compressed_requests'], 0)
+    self.assertIsNone(cli.stats().compressed_requests)
+    # responses are compressed regardless (the API version is already
+    # known from the first client)
+    self.assertEqual(cli.stats().compressed_responses, 2)
+
+  #----------------------------------------------------------------------------
+  def test_resent(self):
+    cli = self.makeClient(compress=True)
+    cli.select('ctx', PEO)
+    self.server.expireSessions()
+    self.assertIsNotNone(cli.select('ctx', PEO))
+    # the re-sent request is compressed as well, but only once
+    self.assertEqual(self.server.stats['unauthorized'], 1)
+    self.assertEqual(self.server.stats['compressed_requests'], 3)
+    self.assertEqual(cli.stats().compressed_requests, 2)
+
+  #----------------------------------------------------------------------------
+  def test_stream(self):
+    cli = self.makeClient(compress=True)
+    output = io.BytesIO()
+    selection = cli.select('ctx', PEO, stream=output)
+    self.assertEqual(len(selection.items), 3)
+    content = output.getvalue().decode('utf-8')
+    self.assertTrue(content.endswith('</div>'))
+    self.assertGreater(len(content), 16000)
+    self.assertGreater(cli.stats().response_bytes_saved, 10000)
+
+  #----------------------------------------------------------------------------
+  def test_uncompressed_server(self):
+    self.server.compress = False
+    cli = self.makeClient()
+    cli.select('ctx', PEO)
+    self.assertIsNone(cli.stats().compressed_responses)
+
+  #----------------------------------------------------------------------------
+  def test_fake_session(self):
+    # responses without a raw stream (e.g. test doubles) are ignored
+    def handler(method, path, data):
+      if data is not None and data[:2] == b'\x1f\x8b':
+        data = zlib.decompress(data, 31)
+      return v2handler(method, path, data)
+    cli = makeClient(handler, compress=True)
+    cli.select('ctx', PEO)
+    self.assertEqual(cli.stats().compressed_requests, 1)
+    self.assertIsNone(cli.stats().compressed_responses)
+
+  #----------------------------------------------------------------------------
+  def test_async(self):
+    try:
+      import asyncio
+      from .aio import AsyncClient
+      import aiohttp
+    except (ImportError, SyntaxError):
+      raise unittest.SkipTest('requires python 3 and aiohttp')
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    cli = AsyncClient('user', 'pass', root=self.server.root, compress=True)
+    try:
+      selection = loop.run_until_complete(cli.select('ctx', PEO))
+      self.assertIn('<p>PID|||12345||Doe^Jane</p>', selection.content)
+      self.assertEqual(self.server.stats['compressed_requests'], 1)
+      self.assertEqual(self.server.stats['compressed_responses'], 3)
+    finally:
+      loop.run_until_complete(cli.close())
+      loop.close()
+      asyncio.set_event_loop(None)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
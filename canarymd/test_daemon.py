@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+
+from . import cli, client, daemon
+from .mock import MockServer
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+class TestDaemon(unittest.TestCase):
+
+  def setUp(self):
+    if not daemon.available():
+      raise unittest.SkipTest('requires Unix sockets')
+    client._versions.clear()
+    self.tmpdir = tempfile.mkdtemp()
+    self.path   = os.path.join(self.tmpdir, 'run', 'daemon.sock')
+    self.server = MockServer().start()
+
+  def tearDown(self):
+    self.server.stop()
+    shutil.rmtree(self.tmpdir)
+
+  #----------------------------------------------------------------------------
+  def makeDaemon(self):
+    return daemon.Daemon(self.path, 'user', 'pass', root=self.server.root)
+
+  #----------------------------------------------------------------------------
+  def select(self, **kw):
+    return daemon.request(
+      self.path, dict(dict(command='select', context='ctx', peo=PEO), **kw))
+
+  #----------------------------------------------------------------------------
+  def test_select(self):
+    self.assertIsNone(self.select())
+    with self.makeDaemon() as server:
+      self.assertEqual(os.stat(self.path).st_mode & 0o077, 0)
+      for _ in range(3):
+        res = self.select(principal='user')
+        self.assertEqual(res['status'], 'ok')
+        self.assertEqual(len(res['selection']['items']), 3)
+        self.assertIn('<p>r1</p>', res['selection']['content'])
+      res = self.select(peo=dict(PEO, transport='carrier-pigeon'))
+      self.assertEqual(res['status'], 'error')
+      self.assertIn('peo.transport', res['error'])
+      self.assertEqual(server.stats['selections'], 4)
+    # one login for all selections, and the socket is removed
+    self.assertEqual(self.server.stats['logins'], 1)
+    self.assertFalse(os.path.exists(self.path))
+
+  #----------------------------------------------------------------------------
+  def test_rejected(self):
+    with self.makeDaemon() as server:
+      self.assertEqual(self.select(principal='other')['status'], 'rejected')
+      self.assertEqual(self.select(credential='other')['status'], 'rejected')
+      self.assertEqual(self.server.stats['selections'], 0)
+
+  #----------------------------------------------------------------------------
+  def test_stale_socket(self):
+    os.makedirs(os.path.dirname(self.path))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(self.path)
+    sock.close()
+    with self.makeDaemon():
+      self.assertEqual(self.select()['status'], 'ok')
+      # but a live daemon is not replaced
+      self.assertRaises(IOError, self.makeDaemon().start)
+      self.assertEqual(self.select()['status'], 'ok')
+
+  #----------------------------------------------------------------------------
+  def test_cli(self):
+    datafile = os.path.join(self.tmpdir, 'peo.json')
+    output   = os.path.join(self.tmpdir, 'out.html')
+    with open(datafile, 'w') as fp:
+      json.dump(dict(recipient='r7'), fp)
+    args = [
+      '--root', self.server.root, '--username', 'user', '--password', 'pass',
+      '--context', 'ctx', '--socket', self.path, '--output', output,
+      'select', datafile]
+    with self.makeDaemon() as server:
+      self.assertEqual(cli.main(args), 0)
+      self.assertEqual(server.stats['selections'], 1)
+      with open(output) as fp:
+        self.assertIn('<p>r7</p>', fp.read())
+      # a daemon for another principal is not used
+      args[3] = 'other'
+      self.assertEqual(cli.main(args), 0)
+      self.assertEqual(cli.main(['--no-daemon'] + args), 0)
+      self.assertEqual(server.stats['selections'], 1)
+      self.assertEqual(server.stats['rejected'], 1)
+    self.assertEqual(self.server.stats['selections'], 3)
+
+#------------------------------------------------------------------------------
+class TestUnsupportedPlatform(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+    self.available = daemon.available
+    daemon.available = lambda: False
+
+  def tearDown(self):
+    daemon.available = self.available
+
+  #----------------------------------------------------------------------------
+  def test_cli(self):
+    # without Unix sockets, "select" silently selects in-process
+    tmpdir = tempfile.mkdtemp()
+    try:
+      datafile = os.path.join(tmpdir, 'peo.json')
+      output   = os.path.join(tmpdir, 'out.html')
+      with open(datafile, 'w') as fp:
+        json.dump(dict(recipient='r7'), fp)
+      with MockServer() as server:
+        self.assertEqual(cli.main([
+          '--root', server.root, '--username', 'user', '--password', 'pass',
+          '--context', 'ctx', '--output', output, 'select', datafile]), 0)
+        self.assertEqual(server.stats['selections'], 1)
+      with open(output) as fp:
+        self.assertIn('<p>r7</p>', fp.read())
+    finally:
+      shutil.rmtree(tmpdir)
+    self.assertIsNone(daemon.request('/no/such.sock', dict(command='ping')))
+    self.assertRaises(IOError, daemon.Daemon, '/no/such.sock', 'user', 'pass')
+
+  #----------------------------------------------------------------------------
+  def test_socket_path(self):
+    getuid = getattr(os, 'getuid', None)
+    runtime = os.environ.pop('XDG_RUNTIME_DIR', None)
+    logname = os.environ.get('LOGNAME')
+    os.environ['LOGNAME'] = 'jane'
+    try:
+      if getuid is not None:
+        del os.getuid
+      path = daemon.socketPath('prod', principal='user')
+    finally:
+      if getuid is not None:
+        os.getuid = getuid
+      if runtime is not None:
+        os.environ['XDG_RUNTIME_DIR'] = runtime
+      if logname is None:
+        del os.environ['LOGNAME']
+      else:
+        os.environ['LOGNAME'] = logname
+    self.assertIn('canarymd-jane', path)
+    self.assertTrue(path.endswith('.sock'))
+
+#------------------------------------------------------------------------------
+class TestLazyImports(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_cli(self):
+    if sys.version_info < (3, 7):
+      raise unittest.SkipTest('requires python 3.7+')
+    out = subprocess.check_output([sys.executable, '-c', (
+      'import sys, canarymd.cli;'
+      'print(sorted(set(sys.modules) & set(["requests", "canarymd.client",'
+      ' "asset", "aiohttp", "multiprocessing"])))')])
+    self.assertEqual(out.strip(), b'[]')
+
+  #----------------------------------------------------------------------------
+  def test_attributes(self):
+    import canarymd
+    self.assertIs(canarymd.Client, client.Client)
+    self.assertIs(canarymd.Purpose, client.Purpose)
+    self.assertIn('WorkerPool', dir(canarymd))
+    self.assertRaises(AttributeError, getattr, canarymd, 'NoSuchThing')
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import json
+import time
+
+from . import client
+from .mock import MockServer
+from .ratelimit import RateLimiter
+from .test_client import FakeResponse, FakeSession, makeClient, v2handler
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+class TimedSession(FakeSession):
+  # also records the `timeout` of each request
+  def __init__(self, *args, **kw):
+    super(TimedSession, self).__init__(*args, **kw)
+    self.timeouts = []
+  def request(self, method, url, data=None, **kw):
+    self.timeouts.append(kw.get('timeout'))
+    return super(TimedSession, self).request(method, url, data, **kw)
+
+#------------------------------------------------------------------------------
+class TestDeadline(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_timeouts(self):
+    deadline = client.Deadline(2)
+    connect, read = deadline.timeouts((1, None))
+    self.assertEqual(connect, 1)
+    self.assertTrue(1.9 < read <= 2)
+    self.assertTrue(all(
+      1.9 < value <= 2 for value in deadline.timeouts(5)))
+
+  #----------------------------------------------------------------------------
+  def test_expired(self):
+    deadline = client.Deadline(0.01)
+    time.sleep(0.02)
+    self.assertLess(deadline.remaining(), 0)
+    with self.assertRaises(client.TimeoutError) as cm:
+      deadline.timeouts((1, 1))
+    self.assertIsInstance(cm.exception, client.Error)
+
+#------------------------------------------------------------------------------
+class TestClientDeadline(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_budget(self):
+    bodies = []
+    def handler(method, path, data):
+      if path == '/v2/selection':
+        bodies.append(json.loads(data))
+      return v2handler(method, path, data)
+    cli = makeClient(handler, read_timeout=60)
+    cli.session = TimedSession(cli.root, handler)
+    self.assertIsNotNone(cli.select('ctx', PEO, timeout=5))
+    # the server is given what is left of the budget...
+    self.assertTrue(4.9 < bodies[0]['timeout'] <= 5)
+    # ... and every request (version, login, selection) is limited to it
+    self.assertEqual(len(cli.session.timeouts), 3)
+    for connect, read in cli.session.timeouts:
+      self.assertLessEqual(connect, client.DEFAULT_CONNECT_TIMEOUT)
+      self.assertTrue(4.9 < read <= 5)
+    # without a deadline, nothing changes
+    cli.select('ctx', PEO)
+    self.assertNotIn('timeout', bodies[1])
+    self.assertEqual(
+      cli.session.timeouts[-1], (client.DEFAULT_CONNECT_TIMEOUT, 60))
+
+  #----------------------------------------------------------------------------
+  def test_call_timeout(self):
+    bodies = []
+    def handler(method, path, data):
+      if path == '/v2/selection':
+        bodies.append(json.loads(data))
+      return v2handler(method, path, data)
+    cli = makeClient(handler, call_timeout=3)
+    cli.select('ctx', PEO)
+    cli.select('ctx', PEO, timeout=1)
+    self.assertTrue(2.9 < bodies[0]['timeout'] <= 3)
+    self.assertTrue(0.9 < bodies[1]['timeout'] <= 1)
+
+  #----------------------------------------------------------------------------
+  def test_no_time_to_retry(self):
+    def handler(method, path, data):
+      if path == '/v2/selection':
+        return FakeResponse(429, {}, {'retry-after': '10'})
+      return v2handler(method, path, data)
+    cli = makeClient(handler)
+    start = time.time()
+    self.assertRaises(
+      client.TimeoutError, cli.select, 'ctx', PEO, timeout=1)
+    self.assertLess(time.time() - start, 0.5)
+    self.assertEqual(cli.session.requests[-1], ('post', '/v2/selection'))
+    self.assertIsNone(cli.stats().retries)
+
+  #----------------------------------------------------------------------------
+  def test_hung_server(self):
+    with MockServer(latency=1) as server:
+      cli = client.Client('user', 'pass', root=server.root, api='v2')
+      start = time.time()
+      # the login hangs...
+      self.assertRaises(
+        client.TimeoutError, cli.select, 'ctx', PEO, timeout=0.2)
+      self.assertLess(time.time() - start, 0.6)
+      # ... and so does the selection
+      server.latency = 0
+      cli.authenticate()
+      server.latency = 1
+      start = time.time()
+      self.assertRaises(
+        client.TimeoutError, cli.select, 'ctx', PEO, timeout=0.2)
+      self.assertLess(time.time() - start, 0.6)
+
+  #----------------------------------------------------------------------------
+  def test_select_many(self):
+    with MockServer(latency=1) as server:
+      cli = client.Client(
+        'user', 'pass', root=server.root, api='v2', call_timeout=0.2)
+      res = cli.select_many('ctx', [PEO] * 3, concurrency=3)
+      self.assertTrue(all(isinstance(err, client.TimeoutError) for err in res))
+
+  #----------------------------------------------------------------------------
+  def test_rate_limited(self):
+    limiter = RateLimiter(rate=0.5, burst=1)
+    cli = makeClient(rate_limit=limiter)
+    start = time.time()
+    # the version request takes the only token; the login would have
+    # to wait two seconds for the next one
+    with self.assertRaises(client.TimeoutError) as cm:
+      cli.select('ctx', PEO, timeout=0.3)
+    self.assertLess(time.time() - start, 0.2)
+    self.assertIn('rate limited', str(cm.exception))
+    self.assertEqual(limiter.inflight, 0)
+    self.assertEqual(len(cli.session.requests), 1)
+    # waiting for a concurrency slot is limited as well
+    limiter = RateLimiter(concurrency=1)
+    cli = makeClient(rate_limit=limiter)
+    limiter.acquire()
+    start = time.time()
+    self.assertRaises(
+      client.TimeoutError, cli.select, 'ctx', PEO, timeout=0.2)
+    self.assertTrue(0.15 < time.time() - start < 0.5)
+
+  #----------------------------------------------------------------------------
+  def test_async_rate_limited(self):
+    try:
+      import asyncio
+      from .aio import AsyncClient
+      import aiohttp
+    except (ImportError, SyntaxError):
+      raise unittest.SkipTest('requires python 3 and aiohttp')
+    with MockServer() as server:
+      limiter = RateLimiter(rate=0.5, burst=1)
+      loop = asyncio.new_event_loop()
+      asyncio.set_event_loop(loop)
+      cli = AsyncClient(
+        'user', 'pass', root=server.root, api='v2', rate_limit=limiter)
+      try:
+        start = time.time()
+        with self.assertRaises(client.TimeoutError) as cm:
+          loop.run_until_complete(cli.select('ctx', PEO, timeout=0.3))
+        self.assertLess(time.time() - start, 0.2)
+        self.assertIn('rate limited', str(cm.exception))
+        self.assertEqual(limiter.inflight, 0)
+      finally:
+        loop.run_until_complete(cli.close())
+        loop.close()
+        asyncio.set_event_loop(None)
+
+  #----------------------------------------------------------------------------
+  def test_async(self):
+    try:
+      import asyncio
+      from .aio import AsyncClient
+      import aiohttp
+    except (ImportError, SyntaxError):
+      raise unittest.SkipTest('requires python 3 and aiohttp')
+    with MockServer(latency=1) as server:
+      loop = asyncio.new_event_loop()
+      asyncio.set_event_loop(loop)
+      cli = AsyncClient('user', 'pass', root=server.root, api='v2')
+      try:
+        start = time.time()
+        with self.assertRaises(client.TimeoutError):
+          loop.run_until_complete(cli.select('ctx', PEO, timeout=0.2))
+        self.assertLess(time.time() - start, 0.6)
+      finally:
+        loop.run_until_complete(cli.close())
+        loop.close()
+        asyncio.set_event_loop(None)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
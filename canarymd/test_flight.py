@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import threading
+import time
+
+from . import client
+from .flight import SingleFlight
+from .mock import MockServer
+from .test_client import FakeResponse, makeClient, v2handler
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+def runThreads(count, target):
+  results = [None] * count
+  def _run(idx):
+    try:
+      results[idx] = target()
+    except Exception as err:
+      results[idx] = err
+  threads = [
+    threading.Thread(target=_run, args=(idx,)) for idx in range(count)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return results
+
+#------------------------------------------------------------------------------
+class TestSingleFlight(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_coalesce(self):
+    flight = SingleFlight()
+    calls  = []
+    def work():
+      calls.append(1)
+      time.sleep(0.05)
+      return object()
+    results = runThreads(8, lambda: flight.do('k', work))
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(len(set(id(res) for res, shared in results)), 1)
+    self.assertEqual(
+      sorted(shared for res, shared in results), [False] + [True] * 7)
+    self.assertEqual(len(flight), 0)
+    # completed calls are not remembered
+    flight.do('k', work)
+    self.assertEqual(len(calls), 2)
+
+  #----------------------------------------------------------------------------
+  def test_error(self):
+    flight = SingleFlight()
+    def fail():
+      time.sleep(0.05)
+      raise ValueError('nope')
+    results = runThreads(4, lambda: flight.do('k', fail))
+    self.assertTrue(all(isinstance(res, ValueError) for res in results))
+    self.assertEqual(len(flight), 0)
+
+#------------------------------------------------------------------------------
+class TestClientSingleFlight(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def handler(self, method, path, data):
+    if path in ('/v2/selection', '/v2/reason'):
+      time.sleep(0.05)
+    if path == '/v2/reason':
+      return FakeResponse(200, {'reasons': [{'code': 'x', 'label': 'X'}]})
+    return v2handler(method, path, data)
+
+  #----------------------------------------------------------------------------
+  def test_select(self):
+    cli = makeClient(self.handler, single_flight=True)
+    cli.authenticate()
+    peo = dict(PEO, recipient='PID|||1\r\n')
+    results = runThreads(6, lambda: cli.select('ctx', dict(peo)))
+    self.assertEqual(cli.session.requests.count(('post', '/v2/selection')), 1)
+    self.assertTrue(all(res is results[0] for res in results))
+    self.assertEqual(cli.stats().coalesced, 5)
+    # different requests are not coalesced
+    runThreads(2, lambda: cli.select('ctx', dict(peo, recipient='r2')))
+    runThreads(
+      2, lambda: cli.select('ctx', dict(peo, recipient='r2'), timeout=3))
+    self.assertEqual(cli.session.requests.count(('post', '/v2/selection')), 3)
+
+  #----------------------------------------------------------------------------
+  def test_disabled(self):
+    cli = makeClient(self.handler)
+    runThreads(3, lambda: cli.select('ctx', PEO))
+    self.assertEqual(cli.session.requests.count(('post', '/v2/selection')), 3)
+
+  #----------------------------------------------------------------------------
+  def test_reasons(self):
+    cli = makeClient(self.handler, single_flight=True)
+    cli.authenticate()
+    runThreads(5, lambda: cli.reasons(refresh=True))
+    self.assertEqual(cli.session.requests.count(('get', '/v2/reason')), 1)
+    self.assertEqual(cli.reason('x').label, 'X')
+
+#------------------------------------------------------------------------------
+class TestAsyncSingleFlight(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_select(self):
+    try:
+      import asyncio
+      from .aio import AsyncClient
+      import aiohttp
+    except (ImportError, SyntaxError):
+      raise unittest.SkipTest('requires python 3 and aiohttp')
+    client._versions.clear()
+    with MockServer(latency=0.05) as server:
+      loop = asyncio.new_event_loop()
+      asyncio.set_event_loop(loop)
+      cli  = AsyncClient('user', 'pass', root=server.root, single_flight=True)
+      try:
+        loop.run_until_complete(cli.authenticate())
+        sels = loop.run_until_complete(asyncio.gather(*[
+          cli.select('ctx', dict(PEO)) for _ in range(10)]))
+        reasons = loop.run_until_complete(asyncio.gather(*[
+          cli.reasons() for _ in range(3)]))
+        self.assertEqual(len(cli._flight), 0)
+      finally:
+        loop.run_until_complete(cli.close())
+        loop.close()
+        asyncio.set_event_loop(None)
+      self.assertTrue(all(sel is sels[0] for sel in sels))
+      self.assertEqual(len(reasons[0]), len(reasons[2]))
+      self.assertEqual(server.stats['selections'], 1)
+      # requests: version, login, one selection and one reasons fetch
+      self.assertEqual(server.stats['requests'], 4)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+
+from . import client
+from .cache import MemoryCache
+from .metrics import Histogram, MetricsCollector, Observer
+from .test_client import FakeResponse, makeClient, v2handler
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+class Recorder(Observer):
+  def __init__(self):
+    self.calls = []
+  def observe(self, call):
+    self.calls.append(call)
+
+#------------------------------------------------------------------------------
+class TestHistogram(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_quantile(self):
+    hist = Histogram(buckets=(1, 2, 4))
+    self.assertIsNone(hist.quantile(0.5))
+    for value in (0.5, 1.5, 1.5, 3, 10):
+      hist.add(value)
+    self.assertEqual(hist.counts, [1, 2, 1, 1])
+    self.assertEqual(hist.count, 5)
+    self.assertEqual(hist.sum, 16.5)
+    self.assertEqual(hist.quantile(0.2), 1)
+    self.assertEqual(hist.quantile(0.4), 1.5)
+    self.assertEqual(hist.quantile(1), 4)
+
+#------------------------------------------------------------------------------
+class TestClientObservers(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_phases(self):
+    rec = Recorder()
+    cli = makeClient(observers=[rec])
+    cli.select('ctx', PEO)
+    cli.select('ctx', PEO)
+    first, second = rec.calls
+    self.assertEqual(first.operation, 'select')
+    self.assertEqual(first.status, 200)
+    self.assertIsNone(first.error)
+    self.assertEqual(
+      sorted(first.phases),
+      ['auth', 'network', 'parse', 'serialize', 'version'])
+    # the second call re-uses the negotiated version and session
+    self.assertEqual(sorted(second.phases), ['network', 'parse', 'serialize'])
+    self.assertTrue(first.duration >= sum(first.phases.values()))
+    self.assertTrue(first.request_bytes > 0)
+    self.assertEqual(first.response_bytes, len(v2handler(
+      'post', '/v2/selection', '{"selection":{"peo":{"recipient":"r1"}}}'
+    ).content))
+
+  #----------------------------------------------------------------------------
+  def test_reauth_and_retries(self):
+    state = dict(expired=True, busy=1)
+    def handler(method, path, data):
+      if path == '/v2/selection':
+        if state['busy']:
+          state['busy'] -= 1
+          return FakeResponse(429, headers={'retry-after': '0'})
+        if state['expired']:
+          state['expired'] = False
+          return FakeResponse(401, {'message': 'session expired'})
+      return v2handler(method, path, data)
+    rec = Recorder()
+    cli = makeClient(handler=handler, observers=[rec])
+    cli.select('ctx', PEO)
+    call = rec.calls[0]
+    self.assertIn('reauth', call.phases)
+    self.assertEqual(call.retries, 1)
+    self.assertEqual(call.status, 200)
+
+  #----------------------------------------------------------------------------
+  def test_cache_and_errors(self):
+    rec = Recorder()
+    cli = makeClient(observers=[rec], cache=MemoryCache())
+    cli.select('ctx', PEO)
+    cli.select('ctx', PEO)
+    with self.assertRaises(client.ValidationError):
+      cli.select('ctx', {'transport': 'bogus'})
+    self.assertEqual([call.cache for call in rec.calls], ['miss', 'hit', None])
+    self.assertIsNone(rec.calls[1].status)
+    self.assertNotIn('network', rec.calls[1].phases)
+    self.assertEqual(rec.calls[2].error, 'ValidationError')
+
+  #----------------------------------------------------------------------------
+  def test_broken_observer(self):
+    class Broken(Observer):
+      def observe(self, call):
+        raise RuntimeError('broken')
+    rec = Recorder()
+    cli = makeClient(observers=[Broken(), rec])
+    self.assertEqual(cli.select('ctx', PEO).id, 'sel-r1')
+    self.assertEqual(len(rec.calls), 1)
+
+#------------------------------------------------------------------------------
+class TestMetricsCollector(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_collect(self):
+    metrics = MetricsCollector()
+    cli = makeClient(observers=[metrics], cache=MemoryCache())
+    for _ in range(3):
+      cli.select('ctx', PEO)
+    snap = metrics.snapshot()
+    self.assertEqual(snap['calls']['select/200']['count'], 1)
+    self.assertEqual(snap['calls']['select/none']['count'], 2)
+    self.assertEqual(snap['phases']['select/network']['count'], 1)
+    self.assertEqual(snap['counters']['cache/select/hit'], 2)
+    text = metrics.prometheus()
+    self.assertIn('# TYPE canarymd_call_duration_seconds histogram\n', text)
+    self.assertIn(
+      'canarymd_call_duration_seconds_count{operation="select",status="200"} 1\n',
+      text)
+    self.assertIn(
+      'canarymd_call_duration_seconds_bucket'
+      '{operation="select",status="none",le="+Inf"} 2\n', text)
+    self.assertIn(
+      'canarymd_cache_total{operation="select",result="miss"} 1\n', text)
+    metrics.reset()
+    self.assertEqual(metrics.prometheus(), '\n')
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import time
+
+from . import client
+from .mock import MockServer
+from .bench import Benchmark
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+class TestMockServer(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_versions(self):
+    for api in ('v1', 'v2'):
+      client._versions.clear()
+      with MockServer(api=api, payload_size=5000, items=2) as server:
+        cli = client.Client('user', 'pass', root=server.root)
+        sel = cli.select('ctx', PEO)
+        self.assertEqual(cli.version().api, api)
+        self.assertEqual(len(sel.items), 2)
+        self.assertTrue(4900 < len(sel.content) < 5100)
+
+  #----------------------------------------------------------------------------
+  def test_credentials(self):
+    with MockServer(principal='user', credential='pass') as server:
+      with self.assertRaises(client.AuthorizationError):
+        client.Client('user', 'wrong', root=server.root).authenticate()
+      client.Client('user', 'pass', root=server.root).authenticate()
+
+  #----------------------------------------------------------------------------
+  def test_session_expiry(self):
+    with MockServer(session_ttl=0.05) as server:
+      cli = client.Client('user', 'pass', root=server.root)
+      cli.select('ctx', PEO)
+      time.sleep(0.1)
+      cli.select('ctx', PEO)
+      self.assertEqual(server.stats['logins'], 2)
+      self.assertEqual(server.stats['unauthorized'], 1)
+
+  #----------------------------------------------------------------------------
+  def test_errors(self):
+    with MockServer(error_rate=1) as server:
+      cli = client.Client(
+        'user', 'pass', root=server.root,
+        retry=client.RetryPolicy(retries=2, backoff=0.001))
+      with self.assertRaises(client.ProtocolError) as cm:
+        cli.reasons()
+      self.assertIn('503', str(cm.exception))
+      self.assertEqual(server.stats['errors'], 3)
+
+  #----------------------------------------------------------------------------
+  def test_validation_and_reasons(self):
+    with MockServer() as server:
+      cli = client.Client('user', 'pass', root=server.root)
+      # bypass the client-side validation
+      res = cli._req('post', '/selection', dict(
+        selection=dict(context='ctx', peo=dict(PEO, transport='paper'))))
+      self.assertEqual(res.status_code, 400)
+      self.assertIn('selection.peo.width', cli._apiError(res))
+      self.assertEqual(len(cli.reasons()), 100)
+      cli.reasons(refresh=True)
+      self.assertEqual(cli.stats().reasons_not_modified, 1)
+
+  #----------------------------------------------------------------------------
+  def test_unwritable_reasons_snapshot(self):
+    with MockServer() as server:
+      cli = client.Client(
+        'user', 'pass', root=server.root,
+        reasons_snapshot='/nonexistent/dir/reasons.json')
+      reasons = cli.reasons()
+      self.assertEqual(len(reasons), 100)
+      code = reasons[0].get('code') or reasons[0].id
+      self.assertIs(cli.reason(code), reasons[0])
+
+#------------------------------------------------------------------------------
+class TestBenchmark(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_run(self):
+    client._versions.clear()
+    with Benchmark(count=20, concurrency=2) as bench:
+      results = bench.run(['sequential', 'batch', 'reauth'])
+    self.assertEqual(
+      [result.name for result in results], ['sequential', 'batch', 'reauth'])
+    for result in results:
+      self.assertEqual(result.count, 20)
+      self.assertEqual(result.errors, 0)
+      self.assertTrue(result.rate > 0)
+      self.assertTrue(result.percentile(0.5) <= result.percentile(0.99))
+    self.assertEqual(results[2].logins, 2)
+    self.assertEqual(results[2].extra['reauth_count'], 1)
+
+  #----------------------------------------------------------------------------
+  def test_concurrent(self):
+    client._versions.clear()
+    # a count that does not divide evenly among the workers
+    with Benchmark(count=11, concurrency=3) as bench:
+      results = bench.run(['threaded', 'async'])
+      self.assertEqual(bench.server.stats['selections'], 11 * len(results))
+    for result in results:
+      self.assertEqual(result.count, 11)
+      self.assertEqual(result.errors, 0)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import threading
+
+from . import client
+from .mock import MockServer
+from .pool import ClientPool
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+class TestClientPool(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+    self.server = MockServer().start()
+    self.pool   = ClientPool(max_tenants=3, root=self.server.root)
+
+  def tearDown(self):
+    self.pool.close()
+    self.server.stop()
+
+  #----------------------------------------------------------------------------
+  def test_tenants(self):
+    first  = self.pool.get('user', 'pass')
+    second = self.pool.get('user', 'pass', partner='p1')
+    third  = self.pool.get('other', 'pass', partner='p1')
+    self.assertIsNot(first, second)
+    self.assertIs(self.pool.get('user', 'pass'), first)
+    for cli in (first, second, third):
+      cli.select('ctx', PEO)
+      self.assertIs(cli.session.get_adapter(cli.root), self.pool.adapter)
+    # separate sessions, but one connection pool and version probe
+    self.assertEqual(self.server.stats['logins'], 3)
+    self.assertEqual(len(self.pool.adapter.poolmanager.pools), 1)
+    self.assertEqual(dict(self.server.partners), {None: 1, 'p1': 2})
+    stats = self.pool.stats()
+    self.assertEqual(stats.tenants, 3)
+    self.assertEqual(stats.logins, 3)
+    self.assertEqual(stats.requests, 7)
+
+  #----------------------------------------------------------------------------
+  def test_lru(self):
+    for name in ('a', 'b', 'c'):
+      self.pool.get(name, 'pass')
+    first = self.pool.get('a', 'pass')
+    self.pool.get('d', 'pass')
+    self.assertEqual(len(self.pool), 3)
+    self.assertEqual(self.pool.evictions, 1)
+    self.assertIs(self.pool.get('a', 'pass'), first)
+    self.pool.get('b', 'pass')
+    self.assertEqual(self.pool.evictions, 2)
+
+  #----------------------------------------------------------------------------
+  def test_credential_change(self):
+    cli = self.pool.get('user', 'pass')
+    cli.select('ctx', PEO)
+    session = cli.session
+    self.assertIs(self.pool.get('user', 'new'), cli)
+    self.assertEqual(cli.credential, 'new')
+    self.assertIsNot(cli.session, session)
+    self.assertIs(cli.session.get_adapter(cli.root), self.pool.adapter)
+    cli.select('ctx', PEO)
+    self.assertEqual(self.server.stats['logins'], 2)
+
+  #----------------------------------------------------------------------------
+  def test_threads(self):
+    errors = []
+    def _run(idx):
+      try:
+        for _ in range(5):
+          self.pool.select(
+            'user%d' % (idx % 5,), 'pass', 'ctx', PEO, partner=str(idx % 2))
+      except Exception as err:
+        errors.append(err)
+    threads = [threading.Thread(target=_run, args=(idx,)) for idx in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(errors, [])
+    self.assertEqual(self.server.stats['selections'], 40)
+    self.assertEqual(len(self.pool), 3)
+
+#------------------------------------------------------------------------------
+class TestClientAdapter(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_update_auth_keeps_connections(self):
+    cli = client.Client('user', 'pass', root='http://canary.test/api')
+    adapter = cli.session.get_adapter(cli.root)
+    cli.updateAuth('other', 'pass')
+    self.assertIs(cli.session.get_adapter(cli.root), adapter)
+
+  #----------------------------------------------------------------------------
+  def test_partner_header(self):
+    cli = client.Client(
+      'user', 'pass', root='http://canary.test/api', partner=42)
+    self.assertEqual(cli.session.headers['x-active-partner-id'], '42')
+    cli = client.Client('user', 'pass', root='http://canary.test/api')
+    self.assertNotIn('x-active-partner-id', cli.session.headers)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import datetime
+import json
+import time
+
+from . import client, prefetch
+from .test_client import FakeResponse, makeClient, v2handler
+
+#------------------------------------------------------------------------------
+def peo(recipient):
+  return {'transport': 'site', 'purpose': 'prepare', 'recipient': recipient}
+
+#------------------------------------------------------------------------------
+class TestDueTime(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_formats(self):
+    base = 1417544406
+    self.assertEqual(prefetch.dueTime(base), base)
+    self.assertEqual(prefetch.dueTime('2014-12-02T18:20:06Z'), base)
+    self.assertEqual(prefetch.dueTime('2014-12-02 18:20:06'), base)
+    self.assertEqual(
+      prefetch.dueTime('2014-12-02T19:20:06.5+01:00'), base + 0.5)
+    self.assertEqual(prefetch.dueTime('2014-12-02T13:20-0500'), base - 6)
+    self.assertEqual(
+      prefetch.dueTime(datetime.datetime(2014, 12, 2, 18, 20, 6)), base)
+    self.assertRaises(ValueError, prefetch.dueTime, 'tomorrow')
+
+#------------------------------------------------------------------------------
+class TestExpiringStore(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_expiry(self):
+    store = prefetch.ExpiringStore(maxsize=2)
+    now = time.time()
+    store.set('a', 1, now + 0.05)
+    store.set('b', 2, now + 60)
+    self.assertEqual(store.get('a'), 1)
+    time.sleep(0.06)
+    self.assertIsNone(store.get('a'))
+    # the entry that expires soonest is evicted first
+    store.set('c', 3, now + 120)
+    store.set('d', 4, now + 30)
+    self.assertEqual(len(store), 2)
+    self.assertIsNone(store.get('d'))
+    self.assertEqual((store.get('b'), store.get('c')), (2, 3))
+
+#------------------------------------------------------------------------------
+class TestPrefetcher(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+    self.selected = []
+    self.cli = makeClient(self.handler)
+
+  #----------------------------------------------------------------------------
+  def handler(self, method, path, data):
+    if path == '/v2/selection':
+      recipient = json.loads(data)['selection']['peo']['recipient']
+      self.selected.append(recipient)
+      if recipient == 'none':
+        return FakeResponse(200, {'selection': None})
+    return v2handler(method, path, data)
+
+  #----------------------------------------------------------------------------
+  def test_render_time_hits(self):
+    now = time.time()
+    with prefetch.Prefetcher(self.cli, rate=None, lead=60) as prefetcher:
+      self.assertTrue(prefetcher.schedule('ctx', peo('r1'), now + 10))
+      self.assertTrue(prefetcher.schedule('ctx', peo('none'), now + 10))
+      # duplicates are ignored
+      self.assertFalse(prefetcher.schedule('ctx', peo('r1'), now + 20))
+      self.assertTrue(prefetcher.wait(5))
+      self.assertEqual(sorted(self.selected), ['none', 'r1'])
+      selection = prefetcher.select('ctx', peo('r1'))
+      self.assertEqual(selection.content, '<p>r1</p>')
+      self.assertIsNone(prefetcher.select('ctx', peo('none')))
+      self.assertFalse(prefetcher.schedule('ctx', peo('r1'), now + 20))
+      # not prefetched: a live selection
+      self.assertEqual(
+        prefetcher.select('ctx', peo('r2')).content, '<p>r2</p>')
+      self.assertEqual(len(self.selected), 3)
+      stats = prefetcher.stats()
+      self.assertEqual(stats.scheduled, 2)
+      self.assertEqual(stats.prefetched, 2)
+      self.assertEqual(stats.stored, 2)
+      self.assertEqual(stats.pending, 0)
+      self.assertEqual(stats.hits, 2)
+      self.assertEqual(stats.misses, 1)
+
+  #----------------------------------------------------------------------------
+  def test_priority(self):
+    now = time.time()
+    prefetcher = prefetch.Prefetcher(self.cli, rate=None, lead=60, threads=1)
+    self.assertEqual(prefetcher.extend([
+      ('ctx', peo('r3'), now + 30),
+      ('ctx', peo('r1'), now + 10),
+      ('ctx', dict(peo('r2'), appointment=dict(time=time.strftime(
+        '%Y-%m-%dT%H:%M:%SZ', time.gmtime(now + 20))))),
+    ]), 3)
+    with prefetcher:
+      self.assertTrue(prefetcher.wait(5))
+    self.assertEqual(self.selected, ['r1', 'r2', 'r3'])
+
+  #----------------------------------------------------------------------------
+  def test_lead(self):
+    now = time.time()
+    with prefetch.Prefetcher(self.cli, rate=None, lead=10) as prefetcher:
+      prefetcher.schedule('ctx', peo('later'), now + 10.3)
+      prefetcher.schedule('ctx', peo('past'), now - 5)
+      self.assertTrue(prefetcher.wait(5))
+      self.assertEqual(self.selected, ['past'])
+      time.sleep(0.4)
+      self.assertTrue(prefetcher.wait(5))
+      self.assertEqual(self.selected, ['past', 'later'])
+    # appointments that are past their `ttl` are not scheduled at all
+    prefetcher = prefetch.Prefetcher(self.cli, ttl=60)
+    self.assertFalse(prefetcher.schedule('ctx', peo('gone'), now - 61))
+
+  #----------------------------------------------------------------------------
+  def test_rate(self):
+    now = time.time()
+    prefetcher = prefetch.Prefetcher(self.cli, rate=20, lead=60, threads=3)
+    # an exhausted budget, i.e. one selection every 50ms
+    prefetcher.bucket.tokens = 0
+    prefetcher.extend(
+      ('ctx', peo('r%d' % (idx,)), now + idx) for idx in range(6))
+    start = time.time()
+    with prefetcher:
+      self.assertTrue(prefetcher.wait(5))
+    self.assertGreaterEqual(time.time() - start, 0.25)
+    self.assertEqual(len(self.selected), 6)
+
+  #----------------------------------------------------------------------------
+  def test_expiry(self):
+    now = time.time()
+    with prefetch.Prefetcher(
+        self.cli, rate=None, lead=60, ttl=0.2) as prefetcher:
+      prefetcher.schedule('ctx', peo('r1'), now)
+      self.assertTrue(prefetcher.wait(5))
+      self.assertEqual(prefetcher.get('ctx', peo('r1')).content, '<p>r1</p>')
+      time.sleep(0.3)
+      self.assertRaises(KeyError, prefetcher.get, 'ctx', peo('r1'))
+      prefetcher.select('ctx', peo('r1'))
+    self.assertEqual(self.selected, ['r1', 'r1'])
+
+  #----------------------------------------------------------------------------
+  def test_errors(self):
+    def handler(method, path, data):
+      if path == '/v2/selection':
+        return FakeResponse(400, {'message': 'bad request'})
+      return v2handler(method, path, data)
+    cli = makeClient(handler)
+    with prefetch.Prefetcher(cli, rate=None, lead=60) as prefetcher:
+      prefetcher.schedule('ctx', peo('r1'), time.time())
+      self.assertTrue(prefetcher.wait(5))
+      self.assertEqual(prefetcher.stats().errors, 1)
+      self.assertRaises(KeyError, prefetcher.get, 'ctx', peo('r1'))
+      # the render-time selection reports the error
+      self.assertRaises(client.Error, prefetcher.select, 'ctx', peo('r1'))
+
+  #----------------------------------------------------------------------------
+  def test_appointment_time(self):
+    prefetcher = prefetch.Prefetcher(self.cli, rate=None, lead=60)
+    due = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 10))
+    self.assertTrue(prefetcher.schedule(
+      'ctx', dict(peo('r1'), appointment={'time': due})))
+    # without a structured appointment time, `due` must be given
+    for appointment in (None, {}, 'SCH|1234||||||ROUTINE'):
+      item = dict(peo('r2'), appointment=appointment)
+      with self.assertRaises(ValueError) as cm:
+        prefetcher.schedule('ctx', item)
+      self.assertIn('`due` must be specified', str(cm.exception))
+    self.assertRaises(ValueError, prefetcher.schedule, 'ctx', peo('r2'))
+    self.assertTrue(prefetcher.schedule(
+      'ctx', dict(peo('r2'), appointment='SCH|1234'), due))
+    self.assertEqual(prefetcher.stats().scheduled, 2)
+
+  #----------------------------------------------------------------------------
+  def test_stop(self):
+    now = time.time()
+    prefetcher = prefetch.Prefetcher(self.cli, rate=None, lead=60)
+    prefetcher.start().stop()
+    prefetcher.schedule('ctx', peo('r1'), now)
+    self.assertFalse(prefetcher.wait(0.1))
+    self.assertEqual(prefetcher.stats().pending, 1)
+    with prefetcher:
+      self.assertTrue(prefetcher.wait(5))
+    self.assertEqual(self.selected, ['r1'])
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
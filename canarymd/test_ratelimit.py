@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import time
+
+from . import client
+from .mock import MockServer
+from .ratelimit import TokenBucket, RateLimiter
+from .retry import RetryPolicy
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+class TestTokenBucket(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_reserve(self):
+    bucket = TokenBucket(10, burst=2)
+    self.assertEqual(bucket.reserve(), 0)
+    self.assertEqual(bucket.reserve(), 0)
+    self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+    self.assertAlmostEqual(bucket.reserve(), 0.2, places=2)
+    bucket.setRate(100)
+    self.assertAlmostEqual(bucket.reserve(), 0.03, places=2)
+
+#------------------------------------------------------------------------------
+class TestRateLimiter(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_concurrency(self):
+    limiter = RateLimiter(concurrency=4)
+    self.assertEqual(
+      [limiter.tryAcquire() for _ in range(5)], [0] * 4 + [None])
+    limiter.release(429, 0.01)
+    self.assertEqual(limiter.stats()['concurrency'], 2)
+    # a burst of rejections only backs off once
+    limiter.release(503, 0.01)
+    self.assertEqual(limiter.stats(), dict(
+      rate=None, concurrency=2, inflight=2, throttled=2))
+    self.assertIsNone(limiter.tryAcquire())
+    for _ in range(2):
+      limiter.release(200, 0.01)
+    self.assertEqual(limiter.stats()['concurrency'], 2)
+    self.assertAlmostEqual(limiter.limit, 2.9)
+    for _ in range(20):
+      self.assertEqual(limiter.tryAcquire(), 0)
+      limiter.release(200, 0.01)
+    self.assertEqual(limiter.stats()['concurrency'], 4)
+
+  #----------------------------------------------------------------------------
+  def test_rate(self):
+    limiter = RateLimiter(rate=10, burst=1, min_rate=4)
+    self.assertEqual(limiter.tryAcquire(), 0)
+    limiter.release(429, 0.01, retry_after=0.5)
+    self.assertEqual(limiter.rate, 5)
+    # paused for the `Retry-After` delay
+    self.assertGreater(limiter.tryAcquire(), 0.45)
+    limiter.release(429, 0.01)
+    time.sleep(0.06)
+    limiter.tryAcquire()
+    limiter.release(429, 0.01)
+    self.assertEqual(limiter.rate, 4)
+    # about one more request per second per second of successes
+    for _ in range(60):
+      limiter.tryAcquire()
+      limiter.release(200, 0.01)
+    self.assertEqual(limiter.rate, 10)
+
+  #----------------------------------------------------------------------------
+  def test_latency(self):
+    limiter = RateLimiter(concurrency=8, latency=0.5)
+    limiter.tryAcquire()
+    limiter.release(200, 1.5)
+    self.assertEqual(limiter.stats()['concurrency'], 4)
+    self.assertEqual(limiter.throttled, 1)
+
+  #----------------------------------------------------------------------------
+  def test_acquire_waits(self):
+    limiter = RateLimiter(rate=50, burst=1)
+    start = time.time()
+    for _ in range(6):
+      limiter.acquire()
+      limiter.release(200, 0.001)
+    self.assertGreater(time.time() - start, 0.09)
+
+  #----------------------------------------------------------------------------
+  def test_acquire_timeout(self):
+    limiter = RateLimiter(rate=0.5, burst=1, concurrency=1)
+    self.assertIsNotNone(limiter.acquire(timeout=1))
+    # no concurrency slot within the timeout
+    start = time.time()
+    self.assertIsNone(limiter.acquire(timeout=0.1))
+    self.assertTrue(0.09 < time.time() - start < 0.5)
+    limiter.release(200, 0.01)
+    # the next token is two seconds away: no waiting at all, and the
+    # slot and token are given back
+    start = time.time()
+    self.assertIsNone(limiter.acquire(timeout=0.3))
+    self.assertLess(time.time() - start, 0.1)
+    self.assertEqual(limiter.inflight, 0)
+    self.assertGreater(limiter.bucket.tokens, -0.5)
+
+#------------------------------------------------------------------------------
+class TestClientRateLimit(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_overload(self):
+    with MockServer(capacity=2, latency=0.02) as server:
+      limiter = RateLimiter(concurrency=8)
+      cli = client.Client(
+        'user', 'pass', root=server.root, rate_limit=limiter,
+        retry=RetryPolicy(retries=50, backoff=0.005, maximum=0.02))
+      res = cli.select_many('ctx', [PEO] * 40, concurrency=8)
+      self.assertTrue(all(isinstance(sel, client.Selection) for sel in res))
+      stats = cli.stats()
+      self.assertEqual(stats.throttled, server.stats['throttled'])
+      self.assertGreater(stats.throttled, 0)
+      self.assertLessEqual(stats.concurrency_limit, 8)
+      self.assertIsNone(stats.rate_limit)
+      self.assertEqual(limiter.inflight, 0)
+
+  #----------------------------------------------------------------------------
+  def test_rate(self):
+    with MockServer() as server:
+      cli = client.Client('user', 'pass', root=server.root, rate_limit=40)
+      self.assertIsInstance(cli.limiter, RateLimiter)
+      cli.authenticate()
+      start = time.time()
+      for _ in range(50):
+        cli.select('ctx', PEO)
+      # 40 requests pass as a burst, the rest at 40 per second
+      self.assertGreater(time.time() - start, 0.2)
+      self.assertEqual(cli.stats().rate_limit, 40)
+
+  #----------------------------------------------------------------------------
+  def test_async(self):
+    try:
+      import asyncio
+      from .aio import AsyncClient
+      import aiohttp
+    except (ImportError, SyntaxError):
+      raise unittest.SkipTest('requires python 3 and aiohttp')
+    with MockServer() as server:
+      limiter = RateLimiter(rate=50, burst=1, concurrency=2)
+      loop = asyncio.new_event_loop()
+      asyncio.set_event_loop(loop)
+      cli = AsyncClient('user', 'pass', root=server.root, rate_limit=limiter)
+      try:
+        loop.run_until_complete(cli.authenticate())
+        start = time.time()
+        sels = loop.run_until_complete(asyncio.gather(*[
+          cli.select('ctx', PEO) for _ in range(6)]))
+        elapsed = time.time() - start
+      finally:
+        loop.run_until_complete(cli.close())
+        loop.close()
+        asyncio.set_event_loop(None)
+      self.assertEqual(len(sels), 6)
+      self.assertGreater(elapsed, 0.09)
+      self.assertEqual(limiter.inflight, 0)
+
+  #----------------------------------------------------------------------------
+  def test_async_slots(self):
+    try:
+      import asyncio
+      from . import aio
+      import aiohttp
+    except (ImportError, SyntaxError):
+      raise unittest.SkipTest('requires python 3 and aiohttp')
+    with MockServer(latency=0.01) as server:
+      limiter = RateLimiter(concurrency=1)
+      loop = asyncio.new_event_loop()
+      asyncio.set_event_loop(loop)
+      cli = aio.AsyncClient(
+        'user', 'pass', root=server.root, rate_limit=limiter)
+      poll = aio.RATE_LIMIT_POLL
+      # waiters are woken when a slot is released, not by polling
+      aio.RATE_LIMIT_POLL = 30
+      try:
+        loop.run_until_complete(cli.authenticate())
+        start = time.time()
+        sels = loop.run_until_complete(asyncio.wait_for(asyncio.gather(*[
+          cli.select('ctx', PEO) for _ in range(6)]), 5))
+        elapsed = time.time() - start
+      finally:
+        aio.RATE_LIMIT_POLL = poll
+        loop.run_until_complete(cli.close())
+        loop.close()
+        asyncio.set_event_loop(None)
+      self.assertEqual(len(sels), 6)
+      self.assertLess(elapsed, 2)
+      self.assertEqual(server.stats['selections'], 6)
+      self.assertEqual(limiter.inflight, 0)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from .reasons import ReasonCatalog
+
+#------------------------------------------------------------------------------
+REASONS = [
+  {'id': 'us/namcs:5035.0', 'label': 'Diabetes'},
+  {'id': 'us/namcs:1000.0', 'label': 'Fever'},
+  {'id': 'us/icd10:E11',    'label': 'Type 2 diabetes'},
+  {'id': 42,                'label': 'Numeric'},
+]
+
+#------------------------------------------------------------------------------
+class TestReasonCatalog(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_lookup_and_search(self):
+    cat = ReasonCatalog()
+    cat.refresh(lambda headers: (REASONS, '"e1"', None))
+    self.assertEqual(cat.get('us/namcs:5035.0').label, 'Diabetes')
+    self.assertEqual(cat.get('42').label, 'Numeric')
+    self.assertIsNone(cat.get('us/namcs:9999'))
+    self.assertEqual(
+      [r.label for r in cat.search('us/namcs:')], ['Fever', 'Diabetes'])
+    self.assertEqual(cat.search('xx/'), [])
+
+  #----------------------------------------------------------------------------
+  def test_conditional_refresh(self):
+    calls = []
+    def fetch(headers):
+      calls.append(headers)
+      return None if calls[1:] else (REASONS, '"e1"', 'Mon, 01 Jan 2024')
+    cat = ReasonCatalog(ttl=0)
+    cat.refresh(fetch)
+    cat.refresh(fetch)
+    self.assertEqual(calls, [{}, {
+      'if-none-match'     : '"e1"',
+      'if-modified-since' : 'Mon, 01 Jan 2024',
+    }])
+    self.assertEqual(len(cat.reasons), 4)
+
+  #----------------------------------------------------------------------------
+  def test_fresh_catalogue_is_not_refetched(self):
+    calls = []
+    cat = ReasonCatalog(ttl=60)
+    cat.refresh(lambda headers: calls.append(1) or (REASONS, None, None))
+    cat.refresh(lambda headers: calls.append(1) or (REASONS, None, None))
+    self.assertEqual(calls, [1])
+
+  #----------------------------------------------------------------------------
+  def test_snapshot(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tmpdir, 'reasons.json')
+      ReasonCatalog(path=path).refresh(lambda headers: (REASONS, '"e1"', None))
+      cat = ReasonCatalog(path=path)
+      self.assertTrue(cat.fresh())
+      self.assertEqual(cat.etag, '"e1"')
+      self.assertEqual(cat.get('us/icd10:E11').label, 'Type 2 diabetes')
+    finally:
+      shutil.rmtree(tmpdir)
+
+  #----------------------------------------------------------------------------
+  def test_snapshot_not_modified(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tmpdir, 'reasons.json')
+      cat = ReasonCatalog(ttl=0, path=path)
+      cat.refresh(lambda headers: (REASONS, '"e1"', None))
+      os.unlink(path)
+      cat.refresh(lambda headers: None)
+      self.assertFalse(os.path.exists(path))
+      self.assertEqual(len(cat.reasons), 4)
+    finally:
+      shutil.rmtree(tmpdir)
+
+  #----------------------------------------------------------------------------
+  def test_snapshot_errors(self):
+    # failing to store the snapshot does not affect lookups
+    cat = ReasonCatalog(path='/nonexistent/dir/reasons.json')
+    cat.refresh(lambda headers: (REASONS, '"e1"', None))
+    self.assertEqual(cat.get('us/icd10:E11').label, 'Type 2 diabetes')
+    self.assertTrue(cat.fresh())
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import email.utils
+import time
+
+import requests
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+from . import client
+from .retry import RetryPolicy
+from .test_client import FakeResponse, makeClient, v2handler
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+def connectError():
+  reason = NewConnectionError(None, 'connection refused')
+  return requests.exceptions.ConnectionError(
+    requests.packages.urllib3.exceptions.MaxRetryError(None, '/', reason))
+
+#------------------------------------------------------------------------------
+class TestRetryPolicy(unittest.TestCase):
+
+  def setUp(self):
+    self.policy = RetryPolicy(retries=3, backoff=0.5, maximum=4)
+
+  #----------------------------------------------------------------------------
+  def test_attempts_exhausted(self):
+    res = FakeResponse(503)
+    self.assertIsNotNone(self.policy.delay('get', 3, res=res))
+    self.assertIsNone(self.policy.delay('get', 4, res=res))
+
+  #----------------------------------------------------------------------------
+  def test_backoff_is_jittered_and_capped(self):
+    res = FakeResponse(503)
+    for attempt in (1, 2, 3):
+      for _ in range(20):
+        delay = self.policy.delay('get', attempt, res=res)
+        self.assertTrue(0 <= delay <= min(4, 0.5 * 2 ** attempt))
+
+  #----------------------------------------------------------------------------
+  def test_statuses(self):
+    for status in (200, 400, 401, 404, 500):
+      self.assertIsNone(self.policy.delay('get', 1, res=FakeResponse(status)))
+    for status in (429, 502, 503, 504):
+      self.assertIsNotNone(
+        self.policy.delay('get', 1, res=FakeResponse(status)))
+
+  #----------------------------------------------------------------------------
+  def test_non_idempotent_statuses(self):
+    self.assertIsNone(self.policy.delay('post', 1, res=FakeResponse(503)))
+    self.assertIsNotNone(self.policy.delay('post', 1, res=FakeResponse(429)))
+    res = FakeResponse(503, headers={'retry-after': '2'})
+    self.assertEqual(self.policy.delay('post', 1, res=res), 2)
+
+  #----------------------------------------------------------------------------
+  def test_retry_after(self):
+    res = FakeResponse(429, headers={'retry-after': '3'})
+    self.assertEqual(self.policy.delay('get', 1, res=res), 3)
+    res = FakeResponse(429, headers={'retry-after': '120'})
+    self.assertEqual(self.policy.delay('get', 1, res=res), 4)
+    when = email.utils.formatdate(time.time() + 2, usegmt=True)
+    res = FakeResponse(503, headers={'retry-after': when})
+    self.assertTrue(0 < self.policy.delay('post', 1, res=res) <= 2)
+    res = FakeResponse(503, headers={'retry-after': 'garbage'})
+    self.assertIsNone(self.policy.delay('post', 1, res=res))
+
+  #----------------------------------------------------------------------------
+  def test_errors(self):
+    timeout = requests.exceptions.ReadTimeout('read timed out')
+    self.assertIsNotNone(self.policy.delay('get', 1, error=timeout))
+    self.assertIsNone(self.policy.delay('post', 1, error=timeout))
+    timeout = requests.exceptions.ConnectTimeout('connect timed out')
+    self.assertIsNotNone(self.policy.delay('post', 1, error=timeout))
+    self.assertIsNotNone(self.policy.delay('post', 1, error=connectError()))
+    reset = requests.exceptions.ConnectionError('connection reset')
+    self.assertIsNone(self.policy.delay('post', 1, error=reset))
+
+#------------------------------------------------------------------------------
+class TestClientRetry(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def makeClient(self, failures, **kw):
+    state = dict(failures=failures)
+    def handler(method, path, data):
+      if path == '/v2/selection' and state['failures']:
+        state['failures'] -= 1
+        return FakeResponse(429, headers={'retry-after': '0'})
+      return v2handler(method, path, data)
+    return makeClient(handler=handler, **kw)
+
+  #----------------------------------------------------------------------------
+  def test_retried(self):
+    cli = self.makeClient(2)
+    self.assertEqual(cli.select('ctx', PEO).id, 'sel-r1')
+    stats = cli.stats()
+    self.assertEqual(stats.retries, 2)
+    self.assertEqual(
+      [req for req in cli.session.requests if req[1] == '/v2/selection'],
+      [('post', '/v2/selection')] * 3)
+
+  #----------------------------------------------------------------------------
+  def test_exhausted(self):
+    cli = self.makeClient(5, retry=1)
+    with self.assertRaises(client.ProtocolError):
+      cli.select('ctx', PEO)
+    self.assertEqual(cli.stats().retries, 1)
+
+  #----------------------------------------------------------------------------
+  def test_disabled(self):
+    cli = self.makeClient(1, retry=0)
+    with self.assertRaises(client.ProtocolError):
+      cli.select('ctx', PEO)
+    self.assertFalse(cli.stats().retries)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
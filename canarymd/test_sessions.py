@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+
+from . import client
+from .mock import MockServer
+from .sessions import FileSessionStore
+
+#------------------------------------------------------------------------------
+PEO = {'transport': 'site', 'purpose': 'discover', 'recipient': 'r1'}
+
+#------------------------------------------------------------------------------
+class TestFileSessionStore(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+    self.tmpdir = tempfile.mkdtemp()
+    self.server = MockServer().start()
+
+  def tearDown(self):
+    self.server.stop()
+    shutil.rmtree(self.tmpdir)
+
+  #----------------------------------------------------------------------------
+  def makeClient(self, store=None, credential='pass'):
+    return client.Client(
+      'user', credential, root=self.server.root,
+      session_store=store or FileSessionStore(self.tmpdir, encrypt=False))
+
+  #----------------------------------------------------------------------------
+  def test_resume(self):
+    first = self.makeClient()
+    first.select('ctx', PEO)
+    self.assertEqual(first.stats().logins, 1)
+    second = self.makeClient()
+    self.assertIsNotNone(second.select('ctx', PEO))
+    self.assertIsNone(second.stats().logins)
+    self.assertEqual(second.stats().session_resumes, 1)
+    self.assertEqual(self.server.stats['logins'], 1)
+    self.assertEqual(self.server.stats['unauthorized'], 0)
+    names = [
+      name for name in os.listdir(self.tmpdir) if name.endswith('.session')]
+    self.assertEqual(len(names), 1)
+    path = os.path.join(self.tmpdir, names[0])
+    self.assertEqual(os.stat(path).st_mode & 0o077, 0)
+
+  #----------------------------------------------------------------------------
+  def test_rejected(self):
+    self.makeClient().authenticate()
+    self.server.expireSessions()
+    cli = self.makeClient()
+    # resumes the stored session, which the server rejects; the client
+    # then logs in and replaces the stored session
+    self.assertIsNotNone(cli.select('ctx', PEO))
+    self.assertEqual(cli.stats().logins, 1)
+    self.assertEqual(self.server.stats['logins'], 2)
+    self.assertEqual(self.server.stats['unauthorized'], 1)
+    self.assertIsNone(self.makeClient().authenticate().stats().logins)
+
+  #----------------------------------------------------------------------------
+  def test_adopt_newer(self):
+    first = self.makeClient().authenticate()
+    self.server.expireSessions()
+    # another process logs in after the server expired the session...
+    self.makeClient().session_store.discard(first._baseroot, 'user')
+    self.makeClient().authenticate()
+    # ... so the first client adopts its session when rejected
+    self.assertIsNotNone(first.select('ctx', PEO))
+    self.assertEqual(first.stats().logins, 1)
+    self.assertEqual(first.stats().session_resumes, 1)
+    self.assertEqual(self.server.stats['logins'], 2)
+
+  #----------------------------------------------------------------------------
+  def test_no_stampede(self):
+    clients = [self.makeClient() for _ in range(6)]
+    threads = [threading.Thread(target=cli.authenticate) for cli in clients]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(self.server.stats['logins'], 1)
+
+  #----------------------------------------------------------------------------
+  def test_wrong_credential(self):
+    self.makeClient().authenticate()
+    for name in os.listdir(self.tmpdir):
+      with open(os.path.join(self.tmpdir, name), 'rb') as fp:
+        self.assertNotIn(b'pass', fp.read())
+    # a plain-text session is not resumed with another credential...
+    other = self.makeClient(credential='WRONG')
+    self.assertIsNotNone(other.select('ctx', PEO))
+    self.assertIsNone(other.stats().session_resumes)
+    self.assertEqual(other.stats().logins, 1)
+    # ... which replaces it with its own
+    cli = self.makeClient()
+    self.assertEqual(cli.authenticate().stats().logins, 1)
+    self.assertIsNone(
+      self.makeClient().authenticate().stats().logins)
+
+  #----------------------------------------------------------------------------
+  def test_encrypted(self):
+    try:
+      import cryptography
+    except ImportError:
+      raise unittest.SkipTest('requires the "cryptography" package')
+    store = FileSessionStore(self.tmpdir)
+    self.makeClient(store).authenticate()
+    for name in os.listdir(self.tmpdir):
+      with open(os.path.join(self.tmpdir, name), 'rb') as fp:
+        self.assertNotIn(b'session', fp.read())
+    self.assertIsNone(self.makeClient(store).authenticate().stats().logins)
+    # a session stored with another credential cannot be decrypted
+    other = self.makeClient(FileSessionStore(self.tmpdir), credential='new')
+    self.assertEqual(other.authenticate().stats().logins, 1)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
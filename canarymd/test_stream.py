@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import io
+import json
+import os
+import tempfile
+
+from . import client
+from .stream import ContentStream
+from .test_client import makeClient
+
+#------------------------------------------------------------------------------
+PEO = {
+  'transport': 'paper', 'purpose': 'discover', 'recipient': 'r1',
+  'width': 2550, 'height': 3300}
+
+#------------------------------------------------------------------------------
+def scan(data, chunk_size):
+  output  = io.BytesIO()
+  scanner = ContentStream(output)
+  for idx in range(0, len(data), chunk_size):
+    scanner.feed(data[idx:idx + chunk_size])
+  return scanner.close(), output.getvalue(), scanner.size
+
+#------------------------------------------------------------------------------
+class TestContentStream(unittest.TestCase):
+
+  CONTENT = u'<p class="x">café \\ \U0001f600\n\t/ end</p>'
+
+  #----------------------------------------------------------------------------
+  def test_chunk_boundaries(self):
+    doc = {
+      'selection'       : {'id': 's1', 'content': 'nested'},
+      'selectionitems'  : [{'channel_id': 'c1', 'content': '"quoted"'}],
+      'content'         : self.CONTENT,
+      'trailer'         : 'x',
+    }
+    expected = self.CONTENT.encode('utf-8')
+    for ascii in (True, False):
+      data = json.dumps(doc, ensure_ascii=ascii, indent=1).encode('utf-8')
+      for chunk_size in (1, 2, 3, 7, 64, len(data)):
+        meta, content, size = scan(data, chunk_size)
+        self.assertEqual(content, expected)
+        self.assertEqual(size, len(expected))
+        self.assertIsNone(meta['content'])
+        self.assertEqual(meta['selection'], doc['selection'])
+        self.assertEqual(meta['selectionitems'], doc['selectionitems'])
+        self.assertEqual(meta['trailer'], 'x')
+
+  #----------------------------------------------------------------------------
+  def test_null_content(self):
+    meta, content, size = scan(b'{"selection": null, "content": null}', 5)
+    self.assertEqual(meta, {'selection': None, 'content': None})
+    self.assertEqual(content, b'')
+
+  #----------------------------------------------------------------------------
+  def test_truncated(self):
+    with self.assertRaises(ValueError):
+      scan(b'{"selection": {"id": "s1"}, "content": "<p>trunc', 4)
+
+#------------------------------------------------------------------------------
+class TestClientStream(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_fileobj(self):
+    output = io.BytesIO()
+    sel = makeClient().select('ctx', PEO, stream=output)
+    self.assertEqual(sel.id, 'sel-r1')
+    self.assertEqual(sel.items[0].channel_id, 'c1')
+    self.assertIsNone(sel.content)
+    self.assertEqual(output.getvalue(), b'<p>r1</p>')
+
+  #----------------------------------------------------------------------------
+  def test_path(self):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+      makeClient().select('ctx', PEO, stream=path)
+      with open(path, 'rb') as fp:
+        self.assertEqual(fp.read(), b'<p>r1</p>')
+    finally:
+      os.unlink(path)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
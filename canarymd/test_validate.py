@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+
+from . import client, validate
+from .test_client import FakeResponse, makeClient, v2handler
+
+#------------------------------------------------------------------------------
+PEO = {
+  'transport'   : 'site',
+  'purpose'     : 'prepare',
+  'recipient'   : 'PID|||12345||Doe^Jane',
+  'appointment' : {
+    'time'        : '2014-12-02T18:20:06Z',
+    'patients'    : ['PID|||12345||Doe^Jane'],
+    'provider'    : {'name': 'Dr. Who'},
+    'type'        : 'new',
+    'reason'      : 'us/namcs:5035.0',
+  },
+}
+
+#------------------------------------------------------------------------------
+def reasonsHandler(method, path, data):
+  if path == '/v2/reason':
+    return FakeResponse(200, {'reasons': [{'code': 'us/namcs:5035.0'}]})
+  return v2handler(method, path, data)
+
+#------------------------------------------------------------------------------
+class TestCheckers(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_scalars(self):
+    self.assertIsNone(validate.integer(minimum=1)(3))
+    self.assertEqual(validate.integer()(True), 'expected an integer')
+    self.assertEqual(validate.integer(minimum=1)(0), 'must be at least 1')
+    self.assertIsNone(validate.number()(0.5))
+    self.assertEqual(validate.string()('  '), 'must not be empty')
+    self.assertEqual(
+      validate.oneOf(['a'], 'letter')('b'), "invalid/unknown letter: 'b'")
+    for value in ('2014-12-02', '2014-12-02T18:20', '2014-12-02T18:20:06.5Z',
+                  '2014-12-02 18:20:06+01:00'):
+      self.assertIsNone(validate.isotime()(value), value)
+    for value in ('12/02/2014', '2014-12-02T6pm', 20141202):
+      self.assertIsNotNone(validate.isotime()(value), value)
+
+  #----------------------------------------------------------------------------
+  def test_structures(self):
+    check = validate.record([
+      ('kind',  validate.oneOf(['a', 'b']),                 True),
+      ('items', validate.listOf(validate.integer()),        False),
+    ], conditions=[('kind', 'b', ('items',))])
+    self.assertIsNone(check({'kind': 'a', 'other': 1}))
+    self.assertEqual(check([]), 'expected a dictionary')
+    self.assertEqual(check({}), {'kind': 'required'})
+    self.assertEqual(check({'kind': 'b'}), {'items': "required for kind 'b'"})
+    self.assertEqual(
+      validate.flatten(check({'kind': 'a', 'items': [1, 'x', 2, None]})),
+      {'items[1]': 'expected an integer', 'items[3]': 'expected an integer'})
+
+#------------------------------------------------------------------------------
+class TestSelectionValidation(unittest.TestCase):
+
+  def setUp(self):
+    client._versions.clear()
+
+  #----------------------------------------------------------------------------
+  def test_valid(self):
+    self.assertIsNone(client._selectionErrors('ctx', PEO))
+    self.assertIsNone(client._selectionErrors('ctx', dict(
+      PEO, transport='paper', width=2550, height=3300, appointment='SCH|1')))
+
+  #----------------------------------------------------------------------------
+  def test_errors(self):
+    peo = dict(PEO, transport='paper', width=0, recipient=None, appointment=dict(
+      PEO['appointment'], time='tomorrow', patients=['PID|1', 7]))
+    self.assertEqual(client._selectionErrors(None, peo, timeout=-1), {
+      'context'               : 'required',
+      'timeout'               : 'must be at least 0',
+      'peo.width'             : 'must be at least 1',
+      'peo.height'            : "required for transport 'paper'",
+      'peo.recipient'         : 'required',
+      'peo.appointment.time'  : validate.isotime()('tomorrow'),
+      'peo.appointment.patients[1]' : 'expected a dictionary or an HL7 string',
+    })
+    self.assertEqual(
+      client._selectionErrors('ctx', 'PID|1'), {'peo': 'expected a dictionary'})
+
+  #----------------------------------------------------------------------------
+  def test_select_fails_offline(self):
+    cli = makeClient()
+    with self.assertRaises(client.ValidationError) as cm:
+      cli.select('ctx', dict(PEO, purpose='bogus'))
+    self.assertEqual(
+      cm.exception.fields, {'peo.purpose': "invalid/unknown purpose: 'bogus'"})
+    self.assertIsInstance(cm.exception, ValueError)
+    self.assertEqual(cli.session.requests, [])
+
+  #----------------------------------------------------------------------------
+  def test_batch_with_reasons(self):
+    cli  = makeClient(handler=reasonsHandler)
+    bad  = dict(PEO, appointment=dict(PEO['appointment'], reason='us/x:1'))
+    peos = [PEO, bad, dict(PEO, transport=None)]
+    # reason codes are not checked until the catalogue is loaded
+    res = cli.validate('ctx', peos)
+    self.assertEqual([err is None for err in res], [True, True, False])
+    self.assertEqual(cli.session.requests, [])
+    res = cli.validate('ctx', peos, reasons=True)
+    self.assertIsNone(res[0])
+    self.assertEqual(
+      res[1].fields, {'peo.appointment.reason': "unknown reason code: 'us/x:1'"})
+    self.assertEqual(res[2].fields, {'peo.transport': 'required'})
+    # ... and from then on, also by `select`
+    with self.assertRaises(client.ValidationError):
+      cli.select('ctx', bad)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+import unittest
+import os
+import pickle
+
+from . import client
+from .mock import MockServer
+from .workers import WorkerPool
+
+#------------------------------------------------------------------------------
+def makePEO(idx):
+  return {'transport': 'site', 'purpose': 'discover', 'recipient': 'r%d' % idx}
+
+#------------------------------------------------------------------------------
+class TestFork(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_child_reuses_session(self):
+    if not hasattr(os, 'fork'):
+      raise unittest.SkipTest('requires os.fork()')
+    client._versions.clear()
+    with MockServer(items=1) as server:
+      cli = client.Client('user', 'pass', root=server.root).authenticate()
+      parent = cli.session
+      rfd, wfd = os.pipe()
+      pid = os.fork()
+      if pid == 0:
+        status = 1
+        try:
+          sel = cli.select('ctx', makePEO(1))
+          ok  = cli.session is not parent and cli.stats().logins is None
+          os.write(wfd, (sel.items[0].channel_id if ok else 'bad').encode())
+          status = 0
+        finally:
+          os._exit(status)
+      os.close(wfd)
+      _, status = os.waitpid(pid, 0)
+      result = os.read(rfd, 1024).decode()
+      os.close(rfd)
+      self.assertEqual(status, 0)
+      self.assertEqual(result, 'channel-0')
+      # the parent's transport is untouched and still usable
+      self.assertIs(cli.session, parent)
+      self.assertIsNotNone(cli.select('ctx', makePEO(2)))
+      self.assertEqual(server.stats['logins'], 1)
+
+  #----------------------------------------------------------------------------
+  def test_pickle_validation_error(self):
+    err = pickle.loads(
+      pickle.dumps(client.ValidationError({'peo': 'required'})))
+    self.assertEqual(err.fields, {'peo': 'required'})
+    self.assertEqual(str(err), 'invalid parameters (peo: required)')
+
+#------------------------------------------------------------------------------
+class TestWorkerPool(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_select_many(self):
+    client._versions.clear()
+    with MockServer() as server:
+      peos = [makePEO(idx) for idx in range(30)]
+      peos[7] = {'transport': 'bogus'}
+      with WorkerPool('user', 'pass', processes=2, root=server.root) as pool:
+        res = pool.select_many('ctx', peos, concurrency=4)
+        unordered = list(pool.iselect_many('ctx', iter(peos[:10])))
+      self.assertEqual(len(res), 30)
+      self.assertIn('r3', res[3].content)
+      self.assertIsInstance(res[7], client.ValidationError)
+      self.assertIn('peo.transport', res[7].fields)
+      self.assertEqual(sorted(idx for idx, _ in unordered), list(range(10)))
+      # the workers continue the parent's session
+      self.assertEqual(server.stats['logins'], 1)
+      self.assertEqual(server.stats['selections'], 38)
+      self.assertEqual(server.stats['requests'], 40)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
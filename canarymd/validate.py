@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+A minimal schema engine for validating request parameters before they
+are sent to the Canary servers. Schemas are built from the checker
+factories in this module once and can then be applied cheaply to any
+number of values; each checker returns ``None`` if the value is valid,
+or otherwise an error message -- or, for records and lists, the
+per-field errors as a dictionary or list (with ``None`` for valid
+elements), as in the `field` attribute of Canary API error responses.
+'''
+
+import re
+
+import morph
+import six
+
+#------------------------------------------------------------------------------
+# groups: year, month, day, hour, minute, second, fraction, zone, sign,
+# and the zone's hours and minutes (see :func:`canarymd.prefetch.dueTime`)
+_ISOTIME = re.compile(
+  r'^(\d{4})-(\d{2})-(\d{2})'
+  r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(\.\d+)?)?'
+  r'(Z|([+-])(\d{2}):?(\d{2}))?)?$')
+
+#------------------------------------------------------------------------------
+def oneOf(values, label='value'):
+  values = frozenset(values)
+  def check(value):
+    if value not in values:
+      return 'invalid/unknown %s: %r' % (label, value)
+  return check
+
+#------------------------------------------------------------------------------
+def string(empty=False):
+  def check(value):
+    if not isinstance(value, six.string_types):
+      return 'expected a string'
+    if not empty and not value.strip():
+      return 'must not be empty'
+  return check
+
+#------------------------------------------------------------------------------
+def integer(minimum=None):
+  def check(value):
+    if isinstance(value, bool) or not isinstance(value, six.integer_types):
+      return 'expected an integer'
+    if minimum is not None and value < minimum:
+      return 'must be at least %d' % (minimum,)
+  return check
+
+#------------------------------------------------------------------------------
+def number(minimum=None):
+  def check(value):
+    if isinstance(value, bool) \
+        or not isinstance(value, six.integer_types + (float,)):
+      return 'expected a number'
+    if minimum is not None and value < minimum:
+      return 'must be at least %s' % (minimum,)
+  return check
+
+#------------------------------------------------------------------------------
+def isotime():
+  def check(value):
+    if not isinstance(value, six.string_types) or not _ISOTIME.match(value):
+      return 'expected an ISO 8601 date/time (e.g. "2014-12-02T18:20:06Z")'
+  return check
+
+#------------------------------------------------------------------------------
+def either(*checkers):
+  '''
+  Accepts values that pass any of `checkers`; for a value that passes
+  none, the error of the last checker is returned.
+  '''
+  def check(value):
+    for checker in checkers:
+      err = checker(value)
+      if err is None:
+        return None
+    return err
+  return check
+
+#------------------------------------------------------------------------------
+def hl7():
+  '''
+  An HL7-serialized segment string or a dictionary of attributes.
+  '''
+  text = string()
+  def check(value):
+    if isinstance(value, dict):
+      return None
+    if text(value) is not None:
+      return 'expected a dictionary or an HL7 string'
+  return check
+
+#------------------------------------------------------------------------------
+def listOf(checker, empty=True):
+  def check(value):
+    if not isinstance(value, (list, tuple)):
+      return 'expected a list'
+    if not empty and not value:
+      return 'must not be empty'
+    errors = [checker(item) for item in value]
+    if any(err is not None for err in errors):
+      return errors
+  return check
+
+#------------------------------------------------------------------------------
+def record(fields, conditions=None):
+  '''
+  A dictionary with the specified `fields`, which is a list of
+  ``(name, checker, required)`` tuples; attributes not listed are
+  allowed. `conditions` is an optional list of ``(name, value,
+  names)`` tuples: if attribute `name` equals `value`, then the
+  attributes `names` are required.
+  '''
+  fields = tuple(fields)
+  conditions = tuple(conditions or ())
+  def check(value):
+    if not isinstance(value, dict):
+      return 'expected a dictionary'
+    errors = dict()
+    for name, checker, required in fields:
+      if value.get(name) is None:
+        if required:
+          errors[name] = 'required'
+        continue
+      err = checker(value[name])
+      if err is not None:
+        errors[name] = err
+    for name, match, names in conditions:
+      if value.get(name) == match:
+        for key in names:
+          if value.get(key) is None:
+            errors[key] = 'required for %s %r' % (name, match)
+    return errors or None
+  return check
+
+#------------------------------------------------------------------------------
+def flatten(errors):
+  '''
+  Flattens nested per-field `errors` into a dictionary that maps
+  dotted field names (with ``[index]`` for list elements) to messages.
+  '''
+  return dict(
+    (key, value) for key, value in morph.flatten(errors).items()
+    if value is not None)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
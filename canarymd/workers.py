@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: Philip J Grabner <phil@canary.md>
+# date: 2026/10/18
+# copy: (C) Copyright 2014-EOT Canary Health, Inc., All Rights Reserved.
+#------------------------------------------------------------------------------
+
+'''
+Multi-process selections: a :class:`WorkerPool` spreads a large
+number of selection requests across a pool of worker processes, each
+of which holds a single, pre-authenticated :class:`canarymd.Client`:
+
+.. code-block:: python
+
+   with canarymd.WorkerPool(principal, credential, processes=4) as pool:
+     for index, result in pool.iselect_many(context, peos):
+       ...
+
+The pool's parent process negotiates the API version and logs in
+once; the workers inherit that session instead of repeating the
+``/version`` probe and the login.
+'''
+
+import functools
+import itertools
+import multiprocessing
+
+import six
+from six.moves import queue
+
+from .client import Client, Error, _versions, _trySelect
+from .sessions import dumpCookies, loadCookies
+
+#------------------------------------------------------------------------------
+# the client of a worker process
+_client = None
+
+#------------------------------------------------------------------------------
+def _clientState(client):
+  # the parts of an authenticated client's state that a worker needs to
+  # continue its session
+  key = (client._baseroot, client.env)
+  return dict(
+    version = _versions.get(key),
+    api     = client._version.api,
+    cookies = dumpCookies(client.session.cookies),
+    expires = client._expires,
+  )
+
+#------------------------------------------------------------------------------
+def _initWorker(principal, credential, options, state):
+  global _client
+  options = dict(options, api=state['api'])
+  _client = Client(principal, credential, **options)
+  if state['version'] is not None:
+    _versions[(_client._baseroot, _client.env)] = state['version']
+    _client._version.update(server=state['version'][1])
+  if state['cookies']:
+    loadCookies(_client.session.cookies, state['cookies'])
+    _client._expires = state['expires']
+
+#------------------------------------------------------------------------------
+def _workerSelect(index, context, peos, timeout, concurrency):
+  if len(peos) == 1:
+    return index, [_trySelect(_client, context, peos[0], timeout)]
+  return index, _client.select_many(
+    context, peos, concurrency=concurrency, timeout=timeout)
+
+#------------------------------------------------------------------------------
+def _workerFailed(outq, index, count, err):
+  # called in the parent if a worker could not run a selection or
+  # return its result (e.g. because it could not be pickled)
+  outq.put((index, [Error('%s: %s' % (err.__class__.__name__, err))] * count))
+
+#------------------------------------------------------------------------------
+class WorkerPool(object):
+  '''
+  A pool of worker processes that make selections. Use it as a
+  context manager or call :meth:`close` when done.
+
+  :Parameters:
+
+  principal, credential : str
+
+    The credentials to authenticate with, as for
+    :class:`canarymd.Client`.
+
+  processes : int, optional, default: the number of CPUs
+
+    The number of worker processes.
+
+  options : dict
+
+    Any other keyword arguments are passed to the
+    :class:`canarymd.Client` constructor, both in the parent and in
+    the workers (and therefore must be picklable if the
+    multiprocessing start method is not ``fork``).
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, principal, credential, processes=None, **options):
+    self.processes  = processes or multiprocessing.cpu_count()
+    self.client     = Client(principal, credential, **options).authenticate()
+    self._pool      = multiprocessing.Pool(
+      self.processes, _initWorker,
+      (principal, credential, options, _clientState(self.client)))
+
+  #----------------------------------------------------------------------------
+  def __enter__(self):
+    return self
+
+  #----------------------------------------------------------------------------
+  def __exit__(self, exc_type, *exc_info):
+    if exc_type is None:
+      self.close()
+    else:
+      self.terminate()
+
+  #----------------------------------------------------------------------------
+  def close(self):
+    '''
+    Waits for pending selections to complete and stops the workers.
+    '''
+    self._pool.close()
+    self._pool.join()
+
+  #----------------------------------------------------------------------------
+  def terminate(self):
+    '''
+    Stops the workers immediately, abandoning pending selections.
+    '''
+    self._pool.terminate()
+    self._pool.join()
+
+  #----------------------------------------------------------------------------
+  def select_many(self, context, peos, timeout=None, concurrency=1):
+    '''
+    Same as :meth:`canarymd.Client.select_many`, but with the
+    selections spread across the worker processes.
+    '''
+    return [
+      result for idx, result in self.iselect_many(
+        context, peos, timeout=timeout, concurrency=concurrency,
+        ordered=True)]
+
+  #----------------------------------------------------------------------------
+  def iselect_many(self, context, peos, timeout=None, concurrency=1,
+                   ordered=False):
+    '''
+    Same as :meth:`canarymd.Client.iselect_many`, but with the
+    selections spread across the worker processes, each of which
+    makes up to `concurrency` simultaneous requests: PEOs are sent to
+    the workers in chunks of `concurrency` and ``(index, result)``
+    tuples are yielded as the workers complete each chunk (or, if
+    `ordered` is truthy, in the order of `peos`). At most two chunks
+    per worker are pending at any time, so `peos` can be an
+    arbitrarily long generator.
+    '''
+    concurrency = max(1, int(concurrency or 1))
+    window   = self.processes * 2
+    outq     = queue.Queue()
+    items    = iter(peos)
+    nextidx  = 0
+    pending  = 0
+    yielded  = 0
+    buffered = {}
+    while True:
+      while items is not None and pending < window:
+        chunk = list(itertools.islice(items, concurrency))
+        if len(chunk) < concurrency:
+          items = None
+        if not chunk:
+          break
+        kw = dict()
+        if not six.PY2:
+          kw['error_callback'] = functools.partial(
+            _workerFailed, outq, nextidx, len(chunk))
+        self._pool.apply_async(
+          _workerSelect, (nextidx, context, chunk, timeout, concurrency),
+          callback=outq.put, **kw)
+        nextidx += len(chunk)
+        pending += 1
+      if not pending:
+        return
+      start, results = outq.get()
+      pending -= 1
+      if not ordered:
+        for idx, result in enumerate(results):
+          yield start + idx, result
+        continue
+      buffered[start] = results
+      while yielded in buffered:
+        results = buffered.pop(yielded)
+        for result in results:
+          yielded += 1
+          yield yielded - 1, result
+
+#------------------------------------------------------------------------------
+# end of $Id$
+#------------------------------------------------------------------------------
@@ -32,6 +32,18 @@ dependencies = [
   'asset                >= 0.6.3',
 ]
 
+extras_dependencies = {
+  'async': [
+    'aiohttp              >= 3.0.0',
+  ],
+  'fast': [
+    'orjson               >= 2.0.0',
+  ],
+  'crypto': [
+    'cryptography         >= 2.0',
+  ],
+}
+
 entrypoints = {
   'console_scripts': [
     'canarymd           = canarymd.cli:main',
@@ -77,6 +89,7 @@ setup(
   include_package_data  = True,
   zip_safe              = True,
   install_requires      = dependencies,
+  extras_require        = extras_dependencies,
   tests_require         = test_dependencies,
   test_suite            = 'canarymd',
   entry_points          = entrypoints,